@@ -0,0 +1,322 @@
+import argparse
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+from sirinstr import ast_nodes
+from sirlex import Lexer
+from sirparser import ASTParser
+
+# Generator of large Solar IR programs for benchmarking the front end.
+# Programs are fully determined by the seed and the size parameters, so that results can be
+# compared across versions. Every generated program lexes and parses, but is not meant to run.
+class CorpusGenerator:
+    OPS = ["+", "-", "*", "/", "/$", "%", "%$", "&", "|", "^", "~&", "~|", "~^", "<<", ">>", ">>$"]
+    RELS = ["==", "!=", ">", "<", ">=", "<=", ">$", "<$", ">=$", "<=$"]
+    TYPES = ["word1", "word2", "word4", "word8"]
+    ALIGNS = ["align1", "align2", "align4", "align8", "alignp"]
+    WORDS = ["the", "value", "register", "frame", "pointer", "returns", "result", "buffer", "loop", "index",
+             "table", "entry", "offset", "count", "this", "is", "a", "of", "to", "when", "data", "call"]
+    ESCAPES = ["\\n", "\\t", "\\\\", "\\\"", "\\0", "\\e"]
+
+    # 'functions' functions of about 'stmts' statements, with expressions nested up to 'expr_depth'
+    # levels. Global data holds about 'data_words' initialized words and 'strings' strings of
+    # 'string_length' characters. 'comment_ratio' is the chance of a comment before a statement.
+    def __init__(self, seed=0, functions=100, stmts=20, expr_depth=4, data_words=1024, strings=16,
+                 string_length=64, comment_ratio=0.1):
+        self.seed = seed
+        self.functions = functions
+        self.stmts = stmts
+        self.expr_depth = expr_depth
+        self.data_words = data_words
+        self.strings = strings
+        self.string_length = string_length
+        self.comment_ratio = comment_ratio
+
+    # Returns the source text of the program
+    def generate(self):
+        self.random = random.Random(self.seed)
+        self.lines = []
+        self.labels = []
+        self.funct_names = [f"fn{i}" for i in range(self.functions)]
+        self.callees = self.funct_names + ["putc", "alloc"]
+
+        self.__comment("", block=True)
+        self.lines.append("import putc, getc, alloc;")
+        self.lines.append(f"export {', '.join(self.funct_names[:max(1, self.functions // 8)])};")
+        self.lines.append("export weak fn0;")
+        for i in range(8):
+            self.lines.append(f"const K{i} = {self.random.randint(0, 1 << 12)} + {self.__literal()};")
+        self.__global_data()
+        for name in self.funct_names:
+            self.__function(name)
+        self.lines.append("")
+        return "\n".join(self.lines)
+
+    def __comment(self, indent, block=False):
+        words = self.random.choices(CorpusGenerator.WORDS, k=self.random.randint(3, 24 if block else 10))
+        if block:
+            self.lines.append(f"{indent}/*")
+            for i in range(0, len(words), 8):
+                self.lines.append(f"{indent} * {' '.join(words[i:i + 8])}")
+            self.lines.append(f"{indent} */")
+        else:
+            self.lines.append(f"{indent}/* {' '.join(words)} */")
+
+    def __maybe_comment(self, indent):
+        if self.random.random() < self.comment_ratio:
+            self.__comment(indent, block=self.random.random() < 0.2)
+
+    def __literal(self):
+        kind = self.random.random()
+        if kind < 0.6:
+            return str(self.random.randint(0, 1000))
+        elif kind < 0.75:
+            return hex(self.random.randint(0, 0xFFFF))
+        elif kind < 0.85:
+            return bin(self.random.randint(0, 255))
+        return f"'{self.random.choice('abcdefghijklmnopqrstuvwxyz0123456789')}'"
+
+    def __string(self):
+        chars = []
+        for _ in range(self.string_length):
+            if self.random.random() < 0.05:
+                chars.append(self.random.choice(CorpusGenerator.ESCAPES))
+            else:
+                chars.append(chr(self.random.randint(0x20, 0x7E)).replace("\\", "/").replace("\"", "'"))
+        return f"\"{''.join(chars)}\""
+
+    def __global_data(self):
+        self.lines.append("data {")
+        for i in range(self.strings):
+            self.__maybe_comment("    ")
+            self.lines.append(f"    str{i}: word1[] {self.__string()};")
+            self.labels.append(f"str{i}")
+        remaining = self.data_words
+        table = 0
+        while remaining > 0:
+            size = min(remaining, self.random.randint(16, 512))
+            type = self.random.choice(CorpusGenerator.TYPES)
+            self.lines.append(f"    {self.random.choice(CorpusGenerator.ALIGNS)};")
+            self.lines.append(f"    table{table}:")
+            self.lines.append(f"    {type}[{size}] {{")
+            values = [self.__literal() for _ in range(size)]
+            for i in range(0, size, 16):
+                self.lines.append(f"        {', '.join(values[i:i + 16])}{',' if i + 16 < size else ''}")
+            self.lines.append("    };")
+            self.lines.append(f"    zero{table}: {type}[{size}];")
+            self.labels.extend([f"table{table}", f"zero{table}"])
+            remaining -= size
+            table += 1
+        self.lines.append("}")
+
+    def __function(self, name):
+        self.__maybe_comment("")
+        regs = [f"r{i}" for i in range(self.random.randint(2, 8))]
+        args = regs[:self.random.randint(0, min(4, len(regs)))]
+        conv = self.random.choice(["", "foreign C ", "foreign MS "])
+        fargs = ", ".join(f"{self.random.choice(CorpusGenerator.TYPES)} {arg}" for arg in args)
+        self.lines.append(f"{conv}(word1) {name}({fargs})")
+        if self.random.random() < 0.3:
+            self.lines.append(f"data {{ {name}.local: word1[{self.random.randint(1, 64)}]; {name}.msg: word1[] {self.__string()}; }}")
+        self.lines.append("{")
+        locals = regs[len(args):]
+        if locals:
+            self.lines.append(f"    {self.random.choice(CorpusGenerator.TYPES)} {', '.join(locals)};")
+        self.regs = regs
+        self.nlabels = 0
+        self.__block(self.stmts, "    ", 0)
+        self.lines.append(f"    return {self.__expr(self.expr_depth)};")
+        self.lines.append("}")
+
+    def __block(self, count, indent, depth):
+        for _ in range(count):
+            self.__maybe_comment(indent)
+            kind = self.random.random()
+            if kind < 0.4:
+                self.lines.append(f"{indent}{self.random.choice(self.regs)} = {self.__expr(self.expr_depth)};")
+            elif kind < 0.55:
+                type = self.random.choice(CorpusGenerator.TYPES)
+                self.lines.append(f"{indent}{type}[{self.__address()}] = {self.__expr(self.expr_depth)};")
+            elif kind < 0.7 and depth < 3:
+                self.lines.append(f"{indent}if ({self.__expr(2)} {self.random.choice(CorpusGenerator.RELS)} {self.__expr(2)}) {{")
+                self.__block(self.random.randint(1, 4), indent + "    ", depth + 1)
+                if self.random.random() < 0.5:
+                    self.lines.append(f"{indent}}} else {{")
+                    self.__block(self.random.randint(1, 4), indent + "    ", depth + 1)
+                self.lines.append(f"{indent}}}")
+            elif kind < 0.85:
+                args = ", ".join(self.__expr(2) for _ in range(self.random.randint(0, 4)))
+                callee = self.random.choice(self.callees)
+                conv = self.random.choice(["", "foreign C "])
+                ret = f"{self.random.choice(self.regs)} = " if self.random.random() < 0.6 else ""
+                self.lines.append(f"{indent}{conv}(word1) {ret}{callee}({args});")
+            elif kind < 0.92:
+                label = f"L{self.nlabels}"
+                self.nlabels += 1
+                self.lines.append(f"{indent[:-4]}{label}:")
+                if self.random.random() < 0.5:
+                    self.lines.append(f"{indent}goto {label};")
+            else:
+                self.lines.append(f"{indent}pass;")
+
+    def __address(self):
+        return f"{self.random.choice(self.labels)} + ({self.__expr(1)} & {self.random.randint(0, 15)})"
+
+    def __expr(self, depth):
+        if depth <= 0 or self.random.random() < 0.15:
+            kind = self.random.random()
+            if kind < 0.5:
+                return self.random.choice(self.regs)
+            elif kind < 0.8:
+                return self.__literal()
+            elif kind < 0.9:
+                return f"K{self.random.randint(0, 7)}"
+            return f"{self.random.choice(CorpusGenerator.TYPES)}[{self.__address()}]"
+        kind = self.random.random()
+        if kind < 0.75:
+            return f"({self.__expr(depth - 1)} {self.random.choice(CorpusGenerator.OPS)} {self.__expr(depth - 1)})"
+        elif kind < 0.85:
+            return f"{self.random.choice(CorpusGenerator.TYPES)}({self.__expr(depth - 1)})"
+        elif kind < 0.95:
+            return f"{self.random.choice(CorpusGenerator.TYPES)}$({self.__expr(depth - 1)})"
+        return f"-{self.__expr(depth - 1)}"
+
+# Corpora stressing one part of the front end each, as CorpusGenerator parameters
+CORPORA = {
+    "functions": dict(functions=500, stmts=12, expr_depth=3, data_words=256, strings=8),
+    "expressions": dict(functions=20, stmts=40, expr_depth=9, data_words=256, strings=8),
+    "data": dict(functions=10, stmts=10, data_words=50000, strings=8),
+    "strings": dict(functions=10, stmts=10, data_words=256, strings=500, string_length=512),
+    "comments": dict(functions=100, stmts=20, comment_ratio=0.9),
+    "mixed": dict(functions=100, stmts=20, expr_depth=5, data_words=5000, strings=50, string_length=128, comment_ratio=0.3)
+}
+
+# Returns the number of AST nodes of a program, constant nodes included
+def count_nodes(program):
+    return sum(1 for _ in ast_nodes(program))
+
+# Times the lexer and the parser over a source text, separately.
+# Times are the best of 'repeat' runs. Peak memory is measured in an extra run of each phase,
+# as tracing allocations slows execution down.
+def bench_source(name, text, repeat=3):
+    lex_times, parse_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = Lexer(text).lex()
+        lex_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        program = ASTParser(tokens).program()
+        parse_times.append(time.perf_counter() - start)
+    nodes = count_nodes(program)
+
+    tracemalloc.start()
+    tokens = Lexer(text).lex()
+    lex_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    ASTParser(tokens).program()
+    parse_peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    lex_best, parse_best = min(lex_times), min(parse_times)
+    return {
+        "name": name,
+        "bytes": len(text.encode("utf8")),
+        "lines": text.count("\n") + 1,
+        "tokens": len(tokens),
+        "nodes": nodes,
+        "lex": {
+            "best_s": lex_best,
+            "mean_s": sum(lex_times) / repeat,
+            "tokens_per_s": len(tokens) / lex_best,
+            "bytes_per_s": len(text.encode("utf8")) / lex_best,
+            "peak_bytes": lex_peak
+        },
+        "parse": {
+            "best_s": parse_best,
+            "mean_s": sum(parse_times) / repeat,
+            "nodes_per_s": nodes / parse_best,
+            "tokens_per_s": len(tokens) / parse_best,
+            "peak_bytes": parse_peak
+        }
+    }
+
+# Returns the generator of a named corpus, its size multiplied by 'scale'
+def corpus(name, seed=0, scale=1.0):
+    params = dict(CORPORA[name])
+    for key in ["functions", "data_words", "strings"]:
+        if key in params:
+            params[key] = max(1, int(params[key] * scale))
+    return CorpusGenerator(seed=seed, **params)
+
+# Runs the benchmark over generated corpora, and returns the results as a JSON-serializable dict
+def run_suite(corpora=None, seed=0, repeat=3, scale=1.0, label=None):
+    results = []
+    for name in corpora or CORPORA:
+        results.append(bench_source(name, corpus(name, seed, scale).generate(), repeat))
+    return {
+        "label": label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "repeat": repeat,
+        "scale": scale,
+        "results": results
+    }
+
+# Returns a text table of the results of a suite
+def report(suite):
+    lines = [f"{'corpus':<12} {'KiB':>8} {'tokens':>9} {'nodes':>9} {'lex ms':>9} {'tok/s':>11} {'lex peak KiB':>13} {'parse ms':>9} {'nodes/s':>11} {'parse peak KiB':>15}"]
+    for result in suite["results"]:
+        lex, parse = result["lex"], result["parse"]
+        lines.append(f"{result['name']:<12} {result['bytes'] / 1024:>8.0f} {result['tokens']:>9} {result['nodes']:>9} "
+                     f"{lex['best_s'] * 1000:>9.1f} {lex['tokens_per_s']:>11.0f} {lex['peak_bytes'] / 1024:>13.0f} "
+                     f"{parse['best_s'] * 1000:>9.1f} {parse['nodes_per_s']:>11.0f} {parse['peak_bytes'] / 1024:>15.0f}")
+    return "\n".join(lines)
+
+# Returns the lines describing phases of a suite slower than in a baseline suite by more than 'threshold'
+def compare(baseline, suite, threshold=0.1):
+    previous = {result["name"]: result for result in baseline["results"]}
+    lines = []
+    for result in suite["results"]:
+        old = previous.get(result["name"])
+        if old is None:
+            continue
+        for phase in ["lex", "parse"]:
+            ratio = result[phase]["best_s"] / old[phase]["best_s"]
+            if ratio > 1 + threshold:
+                lines.append(f"{result['name']}.{phase}: {ratio:.2f}x slower ({old[phase]['best_s'] * 1000:.1f} ms -> {result[phase]['best_s'] * 1000:.1f} ms)")
+    return lines
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the Solar IR lexer and parser over generated corpora.")
+    parser.add_argument("corpora", nargs="*", help=f"corpora to run among {', '.join(CORPORA)}, all by default")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0, help="factor applied to the size of every corpus")
+    parser.add_argument("--label", help="name of the measured version, saved with the results")
+    parser.add_argument("--output", default="bench_results.json", help="JSON file receiving the results")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--dump", help="directory to write the generated corpora to")
+    args = parser.parse_args()
+    for name in args.corpora:
+        if name not in CORPORA:
+            parser.error(f"unknown corpus '{name}'")
+
+    if args.dump:
+        for name in args.corpora or CORPORA:
+            with open(f"{args.dump}/{name}.sir", "w", encoding="utf8") as file:
+                file.write(corpus(name, args.seed, args.scale).generate())
+
+    suite = run_suite(args.corpora, args.seed, args.repeat, args.scale, args.label)
+    print(report(suite))
+    with open(args.output, "w", encoding="utf8") as file:
+        json.dump(suite, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as file:
+            regressions = compare(json.load(file), suite)
+        print("\n".join(regressions) if regressions else "No regressions")
@@ -0,0 +1,1077 @@
+from bisect import bisect_right
+
+import sirinstr
+from sirparser import *
+from siropt import ExprTyper, register_types, program_consts, const_value
+from sirtarget import MERCURY
+
+# Calling convention, as seen by the code generator
+class _Convention:
+    def __init__(self, name, callee_cleans, return_slot):
+        self.name = name
+        self.callee_cleans = callee_cleans # Callee pops its arguments when returning
+        self.return_slot = return_slot # Return value is passed in a stack slot reserved by the caller, instead of a register
+
+# Virtual register, allocated to a machine register or a stack slot
+class _VReg:
+    def __init__(self, id, name=None):
+        self.id = id
+        self.name = name
+
+    def __repr__(self):
+        return f"%{self.name or self.id}"
+
+# Instruction of the linear IR lowered from a function, before register allocation.
+# 'srcs' holds virtual registers or immediates (integers and symbols), 'arg' depends on 'op'.
+class _Instr:
+    def __init__(self, op, dst=None, srcs=None, arg=None):
+        self.op = op
+        self.dst = dst
+        self.srcs = srcs or []
+        self.arg = arg
+
+    def __repr__(self):
+        return f"Instr({self.op}, {self.dst}, {self.srcs}, {self.arg})"
+
+# Live interval of a virtual register over the positions of the linear IR
+class _Interval:
+    def __init__(self, vreg, start, end):
+        self.vreg = vreg
+        self.start = start
+        self.end = end
+        self.register = None
+        self.slot = None
+
+# Writer batching assembly lines into large writes to a stream
+class _AsmWriter:
+    def __init__(self, stream, buffer_size=1 << 16):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.size = 0
+
+    def line(self, text):
+        self.buffer.append(text)
+        self.size += len(text) + 1
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+            self.size = 0
+
+# Code generator lowering a Solar IR program to Mercury assembly.
+# Every function is lowered to a linear IR over virtual registers, which are assigned machine
+# registers by linear scan allocation. Values living across a call are kept in callee-saved
+# registers, and virtual registers are only spilled to the stack when no register is left.
+#
+# Machine registers are one word wide, so wider SIR values are held in one virtual register per
+# word and computed word by word, least significant first. Expressions are only computed up to
+# the words their consumer keeps: a word1 assignment of 'a + 1' computes one word, while a
+# comparison of it computes the carry as well. Words known to be zero, like the upper words of
+# narrower operands, fold away. Multiplications, divisions and shifts by a variable amount of
+# several words are computed by loops, one bit at a time.
+#
+# Arguments and values returned in a slot take as many stack words as their type, least
+# significant first, and values wider than a register are always returned in a slot.
+class MercuryCodeGen:
+    CALLER_SAVED = ["r0", "r1", "r2", "r3"]
+    CALLEE_SAVED = ["r4", "r5"]
+    SCRATCH = ["r6", "r7"] # Reserved to reload spilled values and immediates
+    RETURN_REGISTER = "r0"
+
+    CONVENTIONS = {
+        None: _Convention(None, callee_cleans=True, return_slot=False), # Compiler's own convention
+        "C": _Convention("C", callee_cleans=False, return_slot=True),
+        "MS": _Convention("MS", callee_cleans=True, return_slot=True)
+    }
+
+    # Operators whose low word only depends on the low words of their operands
+    LOW_WORD_OPS = {
+        "+": "add", "-": "sub", "*": "mul",
+        "&": "and", "|": "or", "^": "xor",
+        "~&": "nand", "~|": "nor", "~^": "xnor"
+    }
+    UNSIGNED_OPS = {"/": "divu", "%": "modu", ">>": "shr", "/$": "divu", "%$": "modu", ">>$": "shr"}
+    SIGNED_OPS = {"/$": "divs", "%$": "mods", ">>$": "sar"}
+    DIVISIONS = ["divu", "modu", "divs", "mods"]
+    BRANCHES = {
+        "==": "beq", "!=": "bne",
+        ">": "bgtu", "<": "bltu", ">=": "bgeu", "<=": "bleu",
+        ">$": "bgt", "<$": "blt", ">=$": "bge", "<=$": "ble"
+    }
+    INVERSE_RELATIONS = {
+        "==": "!=", "!=": "==",
+        ">": "<=", "<": ">=", ">=": "<", "<=": ">",
+        ">$": "<=$", "<$": ">=$", ">=$": "<$", "<=$": ">$"
+    }
+
+    def __init__(self, program, target=MERCURY, instr=None):
+        if target.words("ptr") != 1:
+            self.__error(f"The Mercury backend expects a one word ptr, got '{target.ptr_type}'")
+        self.program = program
+        self.target = target
+        self.word_mask = target.mask("word1")
+        self.consts = program_consts(program)
+        self.functions = {funct.name: funct for funct in program.function_decls}
+        self.global_labels = set()
+        for directive in program.data_directives:
+            self.global_labels.update(datum.name for datum in directive.data if isinstance(datum, LabelNode))
+        self.strings = [] # (label, bytes) of anonymous string literals
+        self.tables = [] # (label, labels) of switch jump tables
+        self.spills = 0
+        self.data_words = 0
+        self.instr = instr or sirinstr.active()
+
+    def __error(self, text):
+        raise Exception(f"[CODEGEN]: An error occured while generating code.\n{text}")
+
+    # Writes the assembly of the whole program to a file
+    def emit_file(self, path):
+        with open(path, "w", encoding="utf8") as stream:
+            self.emit(stream)
+
+    # Writes the assembly of the whole program to a text stream, one function at a time
+    def emit(self, stream):
+        with self.instr.phase("codegen"):
+            self.__emit(stream)
+        if self.instr.enabled:
+            self.instr.count("codegen", "functions", len(self.program.function_decls))
+            self.instr.count("codegen", "spills", self.spills)
+            self.instr.count("codegen", "data bytes", self.data_words * self.target.word_bits // 8)
+
+    def __emit(self, stream):
+        self.out = _AsmWriter(stream)
+        for name in self.program.imports:
+            self.out.line(f".extern {name}")
+        for name, weak in self.program.exports:
+            self.out.line(f".{'weak' if weak else 'global'} {name}")
+
+        self.out.line(".text")
+        for funct in self.program.function_decls:
+            self.__function(funct)
+            self.out.flush()
+
+        self.out.line(".data")
+        for directive in self.program.data_directives:
+            self.__data(directive, None)
+        for funct in self.program.function_decls:
+            if funct.staticdata:
+                self.__data(funct.staticdata, funct.name)
+        for label, data in self.strings:
+            self.out.line(f"{label}:")
+            self.out.line(f"    .word {', '.join(str(x) for x in data + [0])}")
+            self.data_words += len(data) + 1
+        for label, targets in self.tables:
+            self.out.line(f"{label}:")
+            for i in range(0, len(targets), 16):
+                self.out.line(f"    .word {', '.join(targets[i:i + 16])}")
+            self.data_words += len(targets)
+        self.out.flush()
+
+    ## Lowering ##
+
+    def __function(self, funct):
+        if funct.convention not in MercuryCodeGen.CONVENTIONS:
+            self.__error(f"Function '{funct.name}': Unknown calling convention '{funct.convention}'")
+
+        self.funct = funct
+        self.conv = MercuryCodeGen.CONVENTIONS[funct.convention]
+        self.return_words = self.__slot_words(self.conv, funct.type)
+        self.regs = register_types(funct)
+        self.typer = ExprTyper(self.regs, {name: value for name, value in self.consts.items() if name not in self.regs}, self.target)
+        self.typer.annotate_block(funct.stmts)
+        self.static_labels = set()
+        if funct.staticdata:
+            self.static_labels.update(datum.name for datum in funct.staticdata.data if isinstance(datum, LabelNode))
+
+        self.vregs = {} # Register name -> virtual registers of its words, least significant first
+        self.nvregs = 0
+        for name, type in self.regs.items():
+            self.vregs[name] = [self.__vreg(name if i == 0 else f"{name}.{i}") for i in range(self.target.words(type))]
+        self.nlabels = 0
+        self.code = []
+        self.args = {} # Argument vreg -> word offset among the arguments
+        self.arg_words = 0
+
+        for _, name in funct.fargs:
+            for vreg in self.vregs[name]:
+                self.args[vreg] = self.arg_words
+                self.code.append(_Instr("ldarg", vreg, arg=self.arg_words))
+                self.arg_words += 1
+        self.__block(funct.stmts)
+        if not self.code or self.code[-1].op not in ["ret", "tail", "jmp"]:
+            self.code.append(_Instr("ret"))
+
+        self.__allocate()
+        self.__emit_function()
+
+    # Returns the number of words of the stack slot a value of a type is returned in, or 0 if
+    # it is returned in a register. Values wider than a register are returned in a slot whatever
+    # the convention.
+    def __slot_words(self, conv, type):
+        if type is None:
+            return 0
+        words = self.target.words(type)
+        return words if conv.return_slot or words > 1 else 0
+
+    def __vreg(self, name=None):
+        self.nvregs += 1
+        return _VReg(self.nvregs, name)
+
+    # Returns the assembly label of a local label, or a new label if no name is given
+    def __label(self, name=None):
+        if name is None:
+            self.nlabels += 1
+            name = self.nlabels
+        return f".L{self.funct.name}.{name}"
+
+    def __block(self, stmts):
+        for stmt in stmts:
+            if isinstance(stmt, (EmptyStatement, DeclStatement)):
+                continue
+            elif isinstance(stmt, LabelNode):
+                self.code.append(_Instr("label", arg=self.__label(stmt.name)))
+            elif isinstance(stmt, GotoStatement):
+                self.code.append(_Instr("jmp", arg=self.__label(stmt.name)))
+            elif isinstance(stmt, DefStatement):
+                if stmt.name not in self.vregs:
+                    self.__error(f"Function '{self.funct.name}': Assignment to undeclared register '{stmt.name}'")
+                dsts = self.vregs[stmt.name]
+                if len(dsts) == 1:
+                    self.__move(dsts[0], self.__lower(stmt.expr, 1, dsts[0])[0])
+                else:
+                    self.__assign(dsts, self.__lower(stmt.expr, len(dsts)))
+            elif isinstance(stmt, MemWriteStatement):
+                base, offset = self.__address(stmt.addr_expr)
+                for i, value in enumerate(self.__lower(stmt.val_expr, self.target.words(stmt.type))):
+                    self.code.append(_Instr("st", srcs=[base, value], arg=offset + i))
+            elif isinstance(stmt, IfStatement):
+                self.__if(stmt)
+            elif isinstance(stmt, SwitchStatement):
+                self.__switch(stmt)
+            elif isinstance(stmt, CallStatement):
+                self.__call(stmt)
+            elif isinstance(stmt, JumpStatement):
+                self.__jump(stmt)
+            elif isinstance(stmt, ReturnStatement):
+                srcs = []
+                if self.funct.type is not None and stmt.expr is not None:
+                    srcs = self.__lower(stmt.expr, self.target.words(self.funct.type))
+                self.code.append(_Instr("ret", srcs=srcs))
+            else:
+                self.__error(f"Function '{self.funct.name}': Cannot lower statement '{stmt}'")
+
+    def __move(self, dst, src):
+        if src is dst:
+            return
+        if isinstance(src, _VReg):
+            self.code.append(_Instr("mov", dst, [src]))
+        else:
+            self.code.append(_Instr("li", dst, arg=src))
+
+    # Moves operands to virtual registers as if every move happened at once
+    def __assign(self, dsts, srcs):
+        srcs = [self.__copy(src) if src in dsts and src is not dst else src for dst, src in zip(dsts, srcs)]
+        for dst, src in zip(dsts, srcs):
+            self.__move(dst, src)
+
+    # Returns a new virtual register holding an operand
+    def __copy(self, src):
+        dst = self.__vreg()
+        self.__move(dst, src)
+        return dst
+
+    def __if(self, stmt):
+        words = self.target.words(self.target.wider(stmt.left.resolved_type, stmt.right.resolved_type))
+        left, right = self.__lower(stmt.left, words), self.__lower(stmt.right, words)
+        else_label = self.__label()
+        self.__branch(left, stmt.rel, right, else_label)
+        self.__block(stmt.if_block)
+        if stmt.else_block:
+            end_label = self.__label()
+            if not self.code or self.code[-1].op not in ["ret", "tail", "jmp"]:
+                self.code.append(_Instr("jmp", arg=end_label))
+            self.code.append(_Instr("label", arg=else_label))
+            self.__block(stmt.else_block)
+            self.code.append(_Instr("label", arg=end_label))
+        else:
+            self.code.append(_Instr("label", arg=else_label))
+
+    # Branches to a label unless a relation holds between two values of as many words.
+    # Words are compared from the most significant one, which is the only one compared as signed
+    # by signed relations, and words known to be equal are skipped.
+    def __branch(self, left, rel, right, false_label):
+        words = [i for i in reversed(range(len(left))) if not (left[i] is right[i] or (not isinstance(left[i], _VReg) and left[i] == right[i]))]
+        if not words:
+            if rel not in ["==", ">=", "<=", ">=$", "<=$"]:
+                self.code.append(_Instr("jmp", arg=false_label))
+            return
+
+        true_label = self.__label()
+        for i in words[:-1]:
+            if rel in ["==", "!="]:
+                self.code.append(_Instr("br", srcs=[left[i], right[i]], arg=("bne", false_label if rel == "==" else true_label)))
+                continue
+            # Strictly ordered words decide the relation, equal ones leave it to the next word
+            strict = rel.replace("=", "") if rel.endswith("$") and i == len(left) - 1 else rel.replace("=", "").rstrip("$")
+            reverse = strict.translate(str.maketrans("<>", "><"))
+            for relation, label in [(strict, true_label), (reverse, false_label)]:
+                mnemonic = MercuryCodeGen.BRANCHES[relation]
+                if not ((mnemonic == "bltu" and right[i] == 0) or (mnemonic == "bgtu" and left[i] == 0)): # Never taken
+                    self.code.append(_Instr("br", srcs=[left[i], right[i]], arg=(mnemonic, label)))
+
+        i = words[-1]
+        last = rel if rel.endswith("$") and i == len(left) - 1 else rel.rstrip("$")
+        self.code.append(_Instr("br", srcs=[left[i], right[i]], arg=(MercuryCodeGen.BRANCHES[MercuryCodeGen.INVERSE_RELATIONS[last]], false_label)))
+        if len(words) > 1:
+            self.code.append(_Instr("label", arg=true_label))
+
+    # Lowers a switch to a bounds check and a jump through a table of case labels
+    def __switch(self, stmt):
+        default_label, end_label = self.__label(), self.__label()
+        if stmt.cases:
+            low = stmt.cases[0][0]
+            span = stmt.cases[-1][0] - low + 1
+            if span > self.word_mask:
+                self.__error(f"Function '{self.funct.name}': Switch table of {span} entries does not fit in the address space")
+            words = self.target.words(stmt.expr.resolved_type)
+            index = self.__sub(self.__lower(stmt.expr, words), self.__split(low, words))
+            for word in index[1:]: # Values below the lowest case wrap around to the upper words
+                if word != 0:
+                    self.code.append(_Instr("br", srcs=[word, 0], arg=("bne", default_label)))
+            self.code.append(_Instr("br", srcs=[index[0], span], arg=("bgeu", default_label)))
+
+            labels = [self.__label() for _ in stmt.cases]
+            targets = [default_label] * span
+            for (value, _), label in zip(stmt.cases, labels):
+                targets[value - low] = label
+            table = f"{self.__label()}.table"
+            self.tables.append((table, targets))
+            self.code.append(_Instr("jtab", srcs=[index[0]], arg=(table, labels + [default_label])))
+
+            for (_, block), label in zip(stmt.cases, labels):
+                self.code.append(_Instr("label", arg=label))
+                self.__block(block)
+                if self.code[-1].op not in ["ret", "tail", "jmp"]:
+                    self.code.append(_Instr("jmp", arg=end_label))
+        self.code.append(_Instr("label", arg=default_label))
+        self.__block(stmt.default_block)
+        self.code.append(_Instr("label", arg=end_label))
+
+    # Calls receive the words of a value returned in a slot through one pop each
+    def __call(self, stmt):
+        if stmt.convention not in MercuryCodeGen.CONVENTIONS:
+            self.__error(f"Function '{self.funct.name}': Unknown calling convention '{stmt.convention}'")
+        conv = MercuryCodeGen.CONVENTIONS[stmt.convention]
+        symbol, srcs, words = self.__call_target(stmt)
+        dsts = []
+        if stmt.ret_register is not None:
+            if stmt.ret_register not in self.vregs:
+                self.__error(f"Function '{self.funct.name}': Call result assigned to undeclared register '{stmt.ret_register}'")
+            dsts = self.vregs[stmt.ret_register]
+
+        slot = self.__slot_words(conv, stmt.type)
+        self.code.append(_Instr("call", dsts[0] if dsts and not slot else None, srcs, arg=(conv, symbol, words, slot)))
+        for i in range(slot):
+            self.code.append(_Instr("pop", dsts[i] if i < len(dsts) else None))
+        for dst in dsts[max(slot, 1):]: # Upper words of a register wider than the result
+            self.__move(dst, 0)
+
+    def __jump(self, stmt):
+        if stmt.convention != self.funct.convention:
+            self.__error(f"Function '{self.funct.name}': Jump with convention '{stmt.convention}' from a function with convention '{self.funct.convention}'")
+        symbol, srcs, words = self.__call_target(stmt)
+        if not self.conv.callee_cleans and words != self.arg_words:
+            self.__error(f"Function '{self.funct.name}': Jump with convention '{stmt.convention}' must pass as many argument words as the function receives")
+        self.code.append(_Instr("tail", srcs=srcs, arg=(self.conv, symbol, words)))
+
+    # Returns the symbol of a direct call, or None, the operands of a call and its number of
+    # argument words. Arguments are passed at the width of the parameters of the called function
+    # if it is one of the program's, and at the width of their own type otherwise.
+    def __call_target(self, stmt):
+        callee = None
+        expr = stmt.funct_expr
+        if isinstance(expr, ConstExpression) and expr.const_node.type == ConstantNode.T_NAME and expr.const_node.data not in self.vregs and expr.const_node.data not in self.static_labels:
+            callee = self.functions.get(expr.const_node.data)
+
+        srcs = []
+        for i, arg in enumerate(stmt.args):
+            type = callee.fargs[i][0] if callee is not None and i < len(callee.fargs) else arg.resolved_type
+            srcs += self.__lower(arg, self.target.words(type))
+        target = self.__lower(expr, 1)[0]
+        if isinstance(target, str):
+            return target, srcs, len(srcs)
+        return None, [target] + srcs, len(srcs)
+
+    # Returns a (base, offset) pair for an address expression
+    def __address(self, expr):
+        offset = 0
+        if isinstance(expr, BinaryExpression) and expr.op in ["+", "-"]:
+            value = const_value(expr.right, self.typer.consts)
+            if value is not None:
+                offset = value if expr.op == "+" else -value
+                expr = expr.left
+        base = self.__lower(expr, 1)[0]
+        if not isinstance(base, _VReg):
+            base = self.__copy(base)
+        return base, offset
+
+    # Lowers an expression and returns the operands holding the low 'words' words of its value,
+    # least significant first. Words past the width of the expression's type are zero.
+    # 'dst' may receive the low word if the expression needs an instruction to compute it.
+    def __lower(self, expr, words, dst=None):
+        n = min(words, self.target.words(expr.resolved_type))
+        return self.__lower_words(expr, n, dst) + [0] * (words - n)
+
+    def __lower_words(self, expr, n, dst):
+        value = const_value(expr, self.typer.consts)
+        if value is not None:
+            return self.__split(value, n)
+
+        if isinstance(expr, ConstExpression):
+            node = expr.const_node
+            if node.type == ConstantNode.T_STRING:
+                label = f".Lstr{len(self.strings)}"
+                self.strings.append((label, list(node.data)))
+                return [label]
+            return self.__name(node.data)[:n]
+
+        elif isinstance(expr, MemReadExpression):
+            base, offset = self.__address(expr.addr_expr)
+            values = []
+            for i in range(n):
+                values.append(dst if i == 0 and dst is not None else self.__vreg())
+                self.code.append(_Instr("ld", values[-1], [base], arg=offset + i))
+            return values
+
+        elif isinstance(expr, UCastExpression):
+            return self.__lower(expr.expr, n, dst)
+
+        elif isinstance(expr, SCastExpression):
+            inner = self.target.words(expr.expr.resolved_type)
+            if n <= inner:
+                return self.__lower(expr.expr, n, dst)
+            values = self.__lower(expr.expr, inner, dst)
+            return values + [self.__op("sar", values[-1], self.target.word_bits - 1)] * (n - inner)
+
+        elif isinstance(expr, UnaryExpression):
+            if n == 1:
+                value = self.__lower(expr.value, 1)[0]
+                if isinstance(value, int):
+                    return [-value & self.word_mask]
+                dst = dst or self.__vreg()
+                self.code.append(_Instr("neg", dst, [value]))
+                return [dst]
+            return self.__sub([0] * n, self.__lower(expr.value, n))
+
+        elif isinstance(expr, BinaryExpression):
+            op = expr.op
+            width = self.target.words(expr.resolved_type)
+            if op in MercuryCodeGen.LOW_WORD_OPS:
+                left, right = self.__lower(expr.left, n), self.__lower(expr.right, n)
+                mnemonic = MercuryCodeGen.LOW_WORD_OPS[op]
+                if n > 1 and op in ["+", "-"]:
+                    return self.__add(left, right) if op == "+" else self.__sub(left, right)
+                elif n > 1 and op == "*":
+                    return self.__multiply(left, right)
+                return [self.__op(mnemonic, l, r, dst if i == 0 else None) for i, (l, r) in enumerate(zip(left, right))]
+            elif op == "<<":
+                left = self.__lower(expr.left, n)
+                return self.__shift(left, self.__lower(expr.right, self.target.words(expr.right.resolved_type)), "shl", dst)
+            elif op in [">>", ">>$"]:
+                left = self.__lower(expr.left, width)
+                amount = self.__lower(expr.right, self.target.words(expr.right.resolved_type))
+                return self.__shift(left, amount, "sar" if op == ">>$" else "shr", dst)[:n]
+            elif op in MercuryCodeGen.UNSIGNED_OPS:
+                left, right = self.__lower(expr.left, width), self.__lower(expr.right, width)
+                return self.__divide(left, right, op, dst)[:n]
+            self.__error(f"Function '{self.funct.name}': Unknown operator '{op}'")
+
+        self.__error(f"Function '{self.funct.name}': Cannot lower unknown expression '{expr}'")
+
+    # Resolves a name to the virtual registers of its words, or a symbol
+    def __name(self, name):
+        if name in self.vregs:
+            return self.vregs[name]
+        elif name in self.static_labels:
+            return [f"{self.funct.name}.{name}"]
+        elif name in self.global_labels or name in self.functions or name in self.program.imports:
+            return [name]
+        self.__error(f"Function '{self.funct.name}': Unknown name '{name}'")
+
+    # Returns the low words of an integer, least significant first
+    def __split(self, value, words):
+        return [(value >> (i * self.target.word_bits)) & self.word_mask for i in range(words)]
+
+    ## Multi-word arithmetic ##
+
+    # Returns an operand holding the result of a one word instruction, computing it when both
+    # operands are integers and skipping it when an operand makes it trivial
+    def __op(self, mnemonic, left, right, dst=None):
+        if isinstance(left, int) and isinstance(right, int) and not (mnemonic in MercuryCodeGen.DIVISIONS and right == 0):
+            return self.__fold(mnemonic, left, right)
+        if right == 0 and mnemonic in ["add", "sub", "or", "xor", "shl", "shr", "sar"]:
+            return left
+        elif left == 0 and mnemonic in ["add", "or", "xor"]:
+            return right
+        elif (left == 0 or right == 0) and mnemonic in ["and", "mul"]:
+            return 0
+        dst = dst or self.__vreg()
+        self.code.append(_Instr("bin", dst, [left, right], arg=mnemonic))
+        return dst
+
+    # Computes a one word instruction on integers, as the machine does
+    def __fold(self, mnemonic, left, right):
+        bits = self.target.word_bits
+        sign = lambda value: value - (1 << bits) if value >> (bits - 1) else value
+        if mnemonic in ["divs", "mods"]:
+            quotient = abs(sign(left)) // abs(sign(right))
+            if (sign(left) < 0) != (sign(right) < 0):
+                quotient = -quotient
+            result = quotient if mnemonic == "divs" else sign(left) - quotient * sign(right)
+        elif mnemonic == "shl":
+            result = left << right if right < bits else 0
+        elif mnemonic == "sar":
+            result = sign(left) >> right
+        else:
+            result = {
+                "add": lambda: left + right, "sub": lambda: left - right, "mul": lambda: left * right,
+                "divu": lambda: left // right, "modu": lambda: left % right,
+                "and": lambda: left & right, "or": lambda: left | right, "xor": lambda: left ^ right,
+                "nand": lambda: ~(left & right), "nor": lambda: ~(left | right), "xnor": lambda: ~(left ^ right),
+                "shr": lambda: left >> right
+            }[mnemonic]()
+        return result & self.word_mask
+
+    def __top_bit(self, value):
+        return self.__op("shr", value, self.target.word_bits - 1)
+
+    # Adds two values word by word. The carry out of 'a + b' is the top bit of
+    # '(a & b) | ((a | b) & ~sum)', and adding a carry to a sum only wraps around from all ones.
+    def __add(self, left, right):
+        result = []
+        carry = 0
+        for i, (a, b) in enumerate(zip(left, right)):
+            last = i == len(left) - 1
+            total = self.__op("add", a, b)
+            next_carry = 0
+            if not last and a != 0 and b != 0:
+                either = self.__op("and", self.__op("or", a, b), self.__op("nand", total, total))
+                next_carry = self.__top_bit(self.__op("or", self.__op("and", a, b), either))
+            if carry != 0:
+                with_carry = self.__op("add", total, carry)
+                if not last:
+                    next_carry = self.__op("or", next_carry, self.__top_bit(self.__op("and", total, self.__op("nand", with_carry, with_carry))))
+                total = with_carry
+            result.append(total)
+            carry = next_carry
+        return result
+
+    # Subtracts two values word by word. The borrow out of 'a - b' is the top bit of
+    # '(~a & b) | (~(a ^ b) & difference)', and subtracting a borrow only wraps around from zero.
+    def __sub(self, left, right):
+        result = []
+        borrow = 0
+        for i, (a, b) in enumerate(zip(left, right)):
+            last = i == len(left) - 1
+            total = self.__op("sub", a, b)
+            next_borrow = 0
+            if not last and b != 0:
+                above = self.__op("and", self.__op("xor", a, b), b)
+                next_borrow = self.__top_bit(self.__op("or", above, self.__op("and", self.__op("xnor", a, b), total)))
+            if borrow != 0:
+                with_borrow = self.__op("sub", total, borrow)
+                if not last:
+                    next_borrow = self.__op("or", next_borrow, self.__top_bit(self.__op("and", self.__op("xor", total, with_borrow), with_borrow)))
+                total = with_borrow
+            result.append(total)
+            borrow = next_borrow
+        return result
+
+    # Multiplies two values of several words by adding the left one, shifted, for each set bit of the right one
+    def __multiply(self, left, right):
+        words = len(left)
+        product = [self.__copy(0) for _ in range(words)]
+        left = [self.__copy(word) for word in left]
+        right = [self.__copy(word) for word in right]
+        count = self.__copy(words * self.target.word_bits)
+        loop_label, skip_label = self.__label(), self.__label()
+
+        self.code.append(_Instr("label", arg=loop_label))
+        self.code.append(_Instr("br", srcs=[self.__op("and", right[0], 1), 0], arg=("beq", skip_label)))
+        self.__assign(product, self.__add(product, left))
+        self.code.append(_Instr("label", arg=skip_label))
+        self.__assign(left, self.__shift_by(left, 1, "shl", 0))
+        self.__assign(right, self.__shift_by(right, 1, "shr", 0))
+        self.code.append(_Instr("bin", count, [count, 1], arg="sub"))
+        self.code.append(_Instr("br", srcs=[count, 0], arg=("bne", loop_label)))
+        return product
+
+    # Shifts a value by an amount of several words. Shifts by the width of the value or more
+    # leave zeros, or copies of the sign for arithmetic shifts, as the machine's shifts do.
+    def __shift(self, values, amount, mnemonic, dst=None):
+        words = len(values)
+        bits = words * self.target.word_bits
+        fill = self.__op("sar", values[-1], self.target.word_bits - 1) if mnemonic == "sar" else 0
+        if all(isinstance(word, int) for word in amount):
+            count = sum(word << (i * self.target.word_bits) for i, word in enumerate(amount))
+            return self.__shift_by(values, count, mnemonic, fill)
+        if words == 1 and all(word == 0 for word in amount[1:]):
+            return [self.__op(mnemonic, values[0], amount[0], dst)]
+
+        # Shift one bit at a time
+        result = [self.__copy(word) for word in values]
+        count = self.__copy(amount[0])
+        loop_label, fill_label, end_label = self.__label(), self.__label(), self.__label()
+        for word in amount[1:]:
+            if word != 0:
+                self.code.append(_Instr("br", srcs=[word, 0], arg=("bne", fill_label)))
+        self.code.append(_Instr("br", srcs=[count, bits], arg=("bgeu", fill_label)))
+        self.code.append(_Instr("label", arg=loop_label))
+        self.code.append(_Instr("br", srcs=[count, 0], arg=("beq", end_label)))
+        self.__assign(result, self.__shift_by(result, 1, mnemonic, fill))
+        self.code.append(_Instr("bin", count, [count, 1], arg="sub"))
+        self.code.append(_Instr("jmp", arg=loop_label))
+        self.code.append(_Instr("label", arg=fill_label))
+        self.__assign(result, [fill] * words)
+        self.code.append(_Instr("label", arg=end_label))
+        return result
+
+    # Shifts a value by a constant amount. 'fill' holds the words shifted in from the top.
+    def __shift_by(self, values, count, mnemonic, fill):
+        word_bits = self.target.word_bits
+        words = len(values)
+        if count >= words * word_bits:
+            return [0 if mnemonic == "shl" else fill] * words
+        skip, bits = divmod(count, word_bits)
+        if mnemonic == "shl":
+            word = lambda i: values[i] if i >= 0 else 0
+            return [self.__op("or", self.__op("shl", word(i - skip), bits), self.__op("shr", word(i - skip - 1), word_bits - bits) if bits else 0) for i in range(words)]
+        word = lambda i: values[i] if i < words else fill
+        return [self.__op("or", self.__op("shr", word(i + skip), bits), self.__op("shl", word(i + skip + 1), word_bits - bits) if bits else 0) for i in range(words)]
+
+    # Divides two values of several words, through a restoring division of their absolute
+    # values for signed operators
+    def __divide(self, left, right, op, dst=None):
+        if len(left) == 1:
+            mnemonic = MercuryCodeGen.SIGNED_OPS[op] if op in MercuryCodeGen.SIGNED_OPS else MercuryCodeGen.UNSIGNED_OPS[op]
+            return [self.__op(mnemonic, left[0], right[0], dst)]
+        modulo = op.startswith("%")
+        top = 1 << (self.target.word_bits - 1)
+        if op.endswith("$") and not all(isinstance(value[-1], int) and not value[-1] & top for value in [left, right]):
+            # |x| is (x ^ s) - s, where s has every bit set if x is negative
+            left_sign = self.__op("sar", left[-1], self.target.word_bits - 1)
+            right_sign = self.__op("sar", right[-1], self.target.word_bits - 1)
+            absolute = lambda value, sign: self.__sub([self.__op("xor", word, sign) for word in value], [sign] * len(value))
+            quotient, remainder = self.__divide_unsigned(absolute(left, left_sign), absolute(right, right_sign))
+            if modulo:
+                return absolute(remainder, left_sign)
+            return absolute(quotient, self.__op("xor", left_sign, right_sign))
+
+        if all(word == 0 for word in left[1:] + right[1:]):
+            return [self.__op("modu" if modulo else "divu", left[0], right[0], dst)] + [0] * (len(left) - 1)
+        quotient, remainder = self.__divide_unsigned(left, right)
+        return remainder if modulo else quotient
+
+    # Returns the quotient and remainder of an unsigned division, computed one bit at a time
+    def __divide_unsigned(self, left, right):
+        words = len(left)
+        quotient = [self.__copy(word) for word in left]
+        remainder = [self.__copy(0) for _ in range(words)]
+        count = self.__copy(words * self.target.word_bits)
+        loop_label, skip_label = self.__label(), self.__label()
+
+        # Shift the next bit of the dividend into the remainder, and subtract the divisor if it fits
+        self.code.append(_Instr("label", arg=loop_label))
+        self.__assign(quotient + remainder, self.__shift_by(quotient + remainder, 1, "shl", 0))
+        self.__branch(remainder, ">=", right, skip_label)
+        self.__assign(remainder, self.__sub(remainder, right))
+        self.code.append(_Instr("bin", quotient[0], [quotient[0], 1], arg="or"))
+        self.code.append(_Instr("label", arg=skip_label))
+        self.code.append(_Instr("bin", count, [count, 1], arg="sub"))
+        self.code.append(_Instr("br", srcs=[count, 0], arg=("bne", loop_label)))
+        return quotient, remainder
+
+    ## Register allocation ##
+
+    # Assigns a register or a stack slot to every virtual register by linear scan
+    def __allocate(self):
+        intervals = self.__intervals()
+        calls = [pos for pos, instr in enumerate(self.code) if instr.op == "call"]
+        free_caller = list(MercuryCodeGen.CALLER_SAVED)
+        free_callee = list(MercuryCodeGen.CALLEE_SAVED)
+        active = [] # Intervals holding a register, sorted by end
+        self.locations = {}
+        self.used_callee = []
+        self.nslots = 0
+
+        for interval in sorted(intervals.values(), key=lambda interval: (interval.start, interval.vreg.id)):
+            # Expire intervals ending before this one starts
+            while active and active[0].end <= interval.start:
+                expired = active.pop(0)
+                (free_callee if expired.register in MercuryCodeGen.CALLEE_SAVED else free_caller).append(expired.register)
+
+            index = bisect_right(calls, interval.start)
+            crosses_call = index < len(calls) and calls[index] < interval.end
+            pools = [free_callee] if crosses_call else [free_caller, free_callee]
+            pool = next((pool for pool in pools if pool), None)
+
+            if pool is not None:
+                interval.register = pool.pop(0)
+            else:
+                # Spill whichever interval ends last among those holding an allowed register
+                allowed = MercuryCodeGen.CALLEE_SAVED if crosses_call else MercuryCodeGen.CALLER_SAVED + MercuryCodeGen.CALLEE_SAVED
+                victim = next((other for other in reversed(active) if other.register in allowed), None)
+                if victim is not None and victim.end > interval.end:
+                    interval.register = victim.register
+                    victim.register = None
+                    active.remove(victim)
+                    self.__spill(victim)
+                else:
+                    self.__spill(interval)
+
+            if interval.register is not None:
+                if interval.register in MercuryCodeGen.CALLEE_SAVED and interval.register not in self.used_callee:
+                    self.used_callee.append(interval.register)
+                active.append(interval)
+                active.sort(key=lambda other: other.end)
+
+        for interval in intervals.values():
+            self.locations[interval.vreg] = interval
+
+    def __spill(self, interval):
+        self.spills += 1
+        if interval.vreg in self.args:
+            interval.slot = ("arg", self.args[interval.vreg]) # Arguments already live on the stack
+        else:
+            interval.slot = ("spill", self.nslots)
+            self.nslots += 1
+
+    # Computes the live interval of every virtual register from the liveness of the linear IR
+    def __intervals(self):
+        code = self.code
+        labels = {instr.arg: pos for pos, instr in enumerate(code) if instr.op == "label"}
+
+        # Split the code into basic blocks
+        leaders = {0}
+        for pos, instr in enumerate(code):
+            if instr.op == "label":
+                leaders.add(pos)
+            elif instr.op in ["br", "jmp", "jtab", "ret", "tail"] and pos + 1 < len(code):
+                leaders.add(pos + 1)
+        starts = sorted(leaders)
+        blocks = [(start, end) for start, end in zip(starts, starts[1:] + [len(code)])]
+        block_at = {start: i for i, (start, _) in enumerate(blocks)}
+
+        successors = []
+        uses, defs = [], []
+        for i, (start, end) in enumerate(blocks):
+            last = code[end - 1]
+            succ = []
+            if last.op in ["br", "jmp"]:
+                succ.append(block_at[labels[last.arg[1] if last.op == "br" else last.arg]])
+            elif last.op == "jtab":
+                succ.extend(block_at[labels[label]] for label in last.arg[1])
+            if last.op not in ["jmp", "jtab", "ret", "tail"] and i + 1 < len(blocks):
+                succ.append(i + 1)
+            successors.append(succ)
+
+            block_uses, block_defs = set(), set()
+            for instr in code[start:end]:
+                block_uses.update(src for src in instr.srcs if isinstance(src, _VReg) and src not in block_defs)
+                if instr.dst is not None:
+                    block_defs.add(instr.dst)
+            uses.append(block_uses)
+            defs.append(block_defs)
+
+        # Iterate liveness to a fixed point
+        live_in = [set() for _ in blocks]
+        live_out = [set() for _ in blocks]
+        changed = True
+        while changed:
+            changed = False
+            for i in reversed(range(len(blocks))):
+                out = set().union(*(live_in[succ] for succ in successors[i])) if successors[i] else set()
+                new_in = uses[i] | (out - defs[i])
+                if out != live_out[i] or new_in != live_in[i]:
+                    live_out[i], live_in[i] = out, new_in
+                    changed = True
+
+        intervals = {}
+        def extend(vreg, pos):
+            interval = intervals.get(vreg)
+            if interval is None:
+                intervals[vreg] = _Interval(vreg, pos, pos)
+            else:
+                interval.start = min(interval.start, pos)
+                interval.end = max(interval.end, pos)
+
+        for i, (start, end) in enumerate(blocks):
+            live = set(live_out[i])
+            for vreg in live:
+                extend(vreg, end)
+            for pos in reversed(range(start, end)):
+                instr = code[pos]
+                if instr.dst is not None:
+                    extend(instr.dst, pos)
+                    live.discard(instr.dst)
+                for src in instr.srcs:
+                    if isinstance(src, _VReg):
+                        extend(src, pos)
+                        live.add(src)
+                for vreg in live:
+                    extend(vreg, pos)
+        return intervals
+
+    ## Emission ##
+
+    def __emit_function(self):
+        funct = self.funct
+        frame = len(self.used_callee) + self.nslots
+        self.return_label = self.__label()
+        line = self.out.line
+
+        line(f"{funct.name}:")
+        line("    push fp")
+        line("    mov fp, sp")
+        if frame:
+            line(f"    sub sp, sp, {frame}")
+        for i, register in enumerate(self.used_callee):
+            line(f"    st [fp - {i + 1}], {register}")
+
+        for pos, instr in enumerate(self.code):
+            self.__emit_instr(instr, self.code[pos + 1] if pos + 1 < len(self.code) else None)
+
+        if not any(instr.op == "ret" for instr in self.code):
+            return # Every path ends in a jump
+        line(f"{self.return_label}:")
+        for i, register in enumerate(self.used_callee):
+            line(f"    ld {register}, [fp - {i + 1}]")
+        line("    mov sp, fp")
+        line("    pop fp")
+        line(f"    ret {self.arg_words}" if self.conv.callee_cleans and self.arg_words else "    ret")
+
+    # Returns the fp-relative memory operand of a stack slot
+    def __slot(self, slot):
+        kind, index = slot
+        if kind == "arg":
+            return f"[fp + {2 + index}]"
+        return f"[fp - {len(self.used_callee) + index + 1}]"
+
+    # Returns a register holding an operand, loading it into a scratch register if needed
+    def __reg(self, operand, scratch):
+        if isinstance(operand, _VReg):
+            location = self.locations[operand]
+            if location.register is not None:
+                return location.register
+            self.out.line(f"    ld {scratch}, {self.__slot(location.slot)}")
+            return scratch
+        self.out.line(f"    li {scratch}, {operand}")
+        return scratch
+
+    # Returns an operand usable as the last operand of an instruction, which may be an immediate
+    def __imm(self, operand, scratch):
+        if isinstance(operand, _VReg):
+            return self.__reg(operand, scratch)
+        return str(operand)
+
+    # Returns the register an instruction should write, and the store needed if it is spilled
+    def __dst(self, vreg):
+        location = self.locations[vreg]
+        if location.register is not None:
+            return location.register, None
+        scratch = MercuryCodeGen.SCRATCH[0]
+        return scratch, f"    st {self.__slot(location.slot)}, {scratch}"
+
+    def __mem(self, base, offset):
+        if offset == 0:
+            return f"[{base}]"
+        return f"[{base} + {offset}]" if offset > 0 else f"[{base} - {-offset}]"
+
+    def __emit_instr(self, instr, next):
+        line = self.out.line
+        s0, s1 = MercuryCodeGen.SCRATCH
+        op = instr.op
+
+        if op == "label":
+            line(f"{instr.arg}:")
+        elif op == "jmp":
+            if not (next is not None and next.op == "label" and next.arg == instr.arg):
+                line(f"    jmp {instr.arg}")
+        elif op == "br":
+            left = self.__reg(instr.srcs[0], s0)
+            right = self.__imm(instr.srcs[1], s1)
+            mnemonic, label = instr.arg
+            line(f"    cmp {left}, {right}")
+            line(f"    {mnemonic} {label}")
+        elif op == "jtab":
+            index = self.__reg(instr.srcs[0], s0)
+            line(f"    li {s1}, {instr.arg[0]}")
+            line(f"    add {s1}, {s1}, {index}")
+            line(f"    ld {s1}, [{s1}]")
+            line(f"    jmp {s1}")
+        elif op == "ldarg":
+            location = self.locations.get(instr.dst)
+            if location is not None and location.register is not None:
+                line(f"    ld {location.register}, [fp + {2 + instr.arg}]")
+        elif op in ["li", "mov", "neg", "bin", "ld"]:
+            if instr.dst not in self.locations:
+                return # Never used
+            dst, store = self.__dst(instr.dst)
+            if op == "li":
+                line(f"    li {dst}, {instr.arg}")
+            elif op == "mov":
+                src = self.__reg(instr.srcs[0], s0)
+                if src != dst:
+                    line(f"    mov {dst}, {src}")
+            elif op == "neg":
+                line(f"    neg {dst}, {self.__reg(instr.srcs[0], s0)}")
+            elif op == "bin":
+                left = self.__reg(instr.srcs[0], s0)
+                right = self.__imm(instr.srcs[1], s1)
+                line(f"    {instr.arg} {dst}, {left}, {right}")
+            else:
+                line(f"    ld {dst}, {self.__mem(self.__reg(instr.srcs[0], s0), instr.arg)}")
+            if store:
+                line(store)
+        elif op == "st":
+            base = self.__reg(instr.srcs[0], s0)
+            value = self.__reg(instr.srcs[1], s1)
+            line(f"    st {self.__mem(base, instr.arg)}, {value}")
+        elif op == "call":
+            self.__emit_call(instr)
+        elif op == "pop":
+            if instr.dst is not None and instr.dst in self.locations:
+                dst, store = self.__dst(instr.dst)
+                line(f"    pop {dst}")
+                if store:
+                    line(store)
+            else:
+                line("    add sp, sp, 1")
+        elif op == "ret":
+            if instr.srcs:
+                if self.return_words:
+                    for i, src in enumerate(instr.srcs):
+                        line(f"    st [fp + {2 + self.arg_words + i}], {self.__reg(src, s0)}")
+                else:
+                    value = self.__reg(instr.srcs[0], s0)
+                    if value != MercuryCodeGen.RETURN_REGISTER:
+                        line(f"    mov {MercuryCodeGen.RETURN_REGISTER}, {value}")
+            if next is not None:
+                line(f"    jmp {self.return_label}")
+        elif op == "tail":
+            self.__emit_tail(instr)
+
+    def __emit_call(self, instr):
+        line = self.out.line
+        conv, symbol, words, slot = instr.arg
+        target, args = (symbol, instr.srcs) if symbol is not None else (instr.srcs[0], instr.srcs[1:])
+
+        if slot:
+            line(f"    sub sp, sp, {slot}")
+        for arg in reversed(args):
+            line(f"    push {self.__reg(arg, MercuryCodeGen.SCRATCH[0])}")
+        line(f"    call {target if symbol is not None else self.__reg(target, MercuryCodeGen.SCRATCH[0])}")
+        if not conv.callee_cleans and words:
+            line(f"    add sp, sp, {words}")
+
+        # Values returned in a slot are read by the pop instructions following the call
+        if not slot and instr.dst is not None and instr.dst in self.locations:
+            dst, store = self.__dst(instr.dst)
+            if dst != MercuryCodeGen.RETURN_REGISTER:
+                line(f"    mov {dst}, {MercuryCodeGen.RETURN_REGISTER}")
+            if store:
+                line(store)
+
+    # Deletes the current frame and jumps to a function, passing arguments in place of our own
+    def __emit_tail(self, instr):
+        line = self.out.line
+        s0, s1 = MercuryCodeGen.SCRATCH
+        conv, symbol, words = instr.arg
+        target, args = (symbol, instr.srcs) if symbol is not None else (instr.srcs[0], instr.srcs[1:])
+        shift = self.arg_words - words # Distance between our arguments and the new ones
+
+        # Push the target and the new arguments while the frame is still valid
+        if symbol is None:
+            line(f"    push {self.__reg(target, s0)}")
+        for arg in reversed(args):
+            line(f"    push {self.__reg(arg, s0)}")
+
+        for i, register in enumerate(self.used_callee):
+            line(f"    ld {register}, [fp - {i + 1}]")
+        line(f"    ld {s0}, [fp + 1]") # Return address
+        line(f"    ld {s1}, [fp]") # Caller's frame pointer
+        if symbol is None:
+            line(f"    ld {MercuryCodeGen.RETURN_REGISTER}, [sp + {words}]")
+
+        # Caller-saved registers hold nothing past this point
+        copy = MercuryCodeGen.CALLER_SAVED[1]
+        for i in reversed(range(words)):
+            line(f"    ld {copy}, {self.__mem('sp', i)}")
+            line(f"    st {self.__mem('fp', 2 + shift + i)}, {copy}")
+        line(f"    st {self.__mem('fp', 1 + shift)}, {s0}")
+        line("    mov sp, fp")
+        if 1 + shift > 0:
+            line(f"    add sp, sp, {1 + shift}")
+        elif 1 + shift < 0:
+            line(f"    sub sp, sp, {-(1 + shift)}")
+        line(f"    mov fp, {s1}")
+        line(f"    jmp {symbol if symbol is not None else MercuryCodeGen.RETURN_REGISTER}")
+
+    ## Data ##
+
+    def __data(self, directive, funct_name):
+        line = self.out.line
+        static_labels = {datum.name for datum in directive.data if isinstance(datum, LabelNode)} if funct_name else set()
+
+        for datum in directive.data:
+            if isinstance(datum, LabelNode):
+                line(f"{funct_name}.{datum.name}:" if funct_name else f"{datum.name}:")
+            elif isinstance(datum, AlignNode):
+                line(f"    .align {self.target.words(datum.type.replace('align', 'word').replace('wordp', 'ptr'))}")
+            elif isinstance(datum, DatumNode):
+                count = const_value(datum.allocsize, self.consts)
+                if count is None or count < 1:
+                    self.__error(f"Datum allocation size must be a positive constant, got {count}")
+                words = self.target.words(datum.type)
+                self.data_words += count * words
+                if not datum.data:
+                    line(f"    .zero {count * words}")
+                    continue
+
+                values = []
+                for expr in datum.data:
+                    value = self.__data_value(expr, funct_name, static_labels)
+                    if isinstance(value, int):
+                        value &= self.target.mask(datum.type)
+                        values.append([(value >> (i * self.target.word_bits)) & self.word_mask for i in range(words)])
+                    else:
+                        values.append([value] + [0] * (words - 1))
+
+                if len(values) == 1 and words == 1:
+                    line(f"    .fill {count}, {values[0][0]}")
+                    continue
+                elements = [word for i in range(count) for word in values[i % len(values)]]
+                for i in range(0, len(elements), 16):
+                    line(f"    .word {', '.join(str(x) for x in elements[i:i + 16])}")
+
+    # Returns the value of a datum initializer, as an integer or a symbolic address
+    def __data_value(self, expr, funct_name, static_labels):
+        value = const_value(expr, self.consts)
+        if value is not None:
+            return value
+        if isinstance(expr, ConstExpression) and expr.const_node.type == ConstantNode.T_NAME:
+            name = expr.const_node.data
+            if name in static_labels:
+                return f"{funct_name}.{name}"
+            if name in self.global_labels or name in self.functions or name in self.program.imports:
+                return name
+            self.__error(f"Unknown name '{name}' in data initializer")
+        if isinstance(expr, BinaryExpression) and expr.op in ["+", "-"]:
+            offset = const_value(expr.right, self.consts)
+            if offset is not None:
+                return f"{self.__data_value(expr.left, funct_name, static_labels)}{expr.op}{offset}"
+        self.__error("Data initializer is neither a constant nor a label offset")
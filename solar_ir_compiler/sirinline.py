@@ -0,0 +1,326 @@
+import sirinstr
+from sirparser import *
+from siropt import (ExprTyper, register_types, program_consts, function_names, walk_stmts, walk_expr,
+                    stmt_exprs, map_stmt_exprs, copy_expr, copy_stmt, rename_expr)
+from sirtarget import MERCURY
+
+# Call graph of a program.
+# Only calls and jumps to a constant function name are edges. Functions whose name is used as a
+# value elsewhere are 'address_taken', as they may also be called indirectly.
+class CallGraph:
+    def __init__(self, program):
+        self.functions = {funct.name: funct for funct in program.function_decls}
+        self.calls = {name: [] for name in self.functions} # Caller -> [(statement, callee)]
+        self.callers = {name: set() for name in self.functions} # Callee -> callers
+        self.address_taken = set()
+
+        for funct in program.function_decls:
+            regs = register_types(funct)
+            for stmt in walk_stmts(funct.stmts):
+                exprs = stmt_exprs(stmt)
+                if isinstance(stmt, (CallStatement, JumpStatement)):
+                    callee = direct_callee(stmt, regs, self.functions)
+                    if callee is not None:
+                        self.calls[funct.name].append((stmt, callee))
+                        self.callers[callee].add(funct.name)
+                        exprs = stmt.args
+                for expr in exprs:
+                    for name in expr_free_names(expr, regs):
+                        if name in self.functions:
+                            self.address_taken.add(name)
+
+        self.recursive = set()
+        for scc in self.sccs():
+            if len(scc) > 1 or scc[0] in self.callees(scc[0]):
+                self.recursive.update(scc)
+
+    # Returns the names of the functions directly called by a function
+    def callees(self, name):
+        return {callee for _, callee in self.calls[name]}
+
+    # Returns whether a function can reach itself through direct calls
+    def is_recursive(self, name):
+        return name in self.recursive
+
+    # Returns the strongly connected components of the graph, callees before their callers
+    def sccs(self):
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        result = []
+
+        # Iterative Tarjan's algorithm, as call chains can be deeper than python's recursion limit
+        for root in self.functions:
+            if root in index:
+                continue
+            work = [(root, iter(sorted(self.callees(root))))]
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                name, children = work[-1]
+                child = next(children, None)
+                if child is not None:
+                    if child not in index:
+                        index[child] = lowlink[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(sorted(self.callees(child)))))
+                    elif child in on_stack:
+                        lowlink[name] = min(lowlink[name], index[child])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[name])
+                if lowlink[name] == index[name]:
+                    scc = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        scc.append(member)
+                        if member == name:
+                            break
+                    result.append(scc)
+        return result
+
+# Returns the name of the function called by a call or jump, or None if it is not a constant function
+def direct_callee(stmt, regs, functions):
+    expr = stmt.funct_expr
+    if isinstance(expr, ConstExpression) and expr.const_node.type == ConstantNode.T_NAME:
+        name = expr.const_node.data
+        if name in functions and name not in regs:
+            return name
+    return None
+
+# Returns the names of an expression that are not registers
+def expr_free_names(expr, regs):
+    return {node.const_node.data for node in walk_expr(expr)
+            if isinstance(node, ConstExpression) and node.const_node.type == ConstantNode.T_NAME and node.const_node.data not in regs}
+
+# Decision taken by the inliner for a call site
+class InlineDecision:
+    def __init__(self, caller, callee, inlined, reason):
+        self.caller = caller
+        self.callee = callee
+        self.inlined = inlined
+        self.reason = reason
+
+    def __repr__(self):
+        return f"{self.caller} -> {self.callee}: {'inlined' if self.inlined else 'kept'} ({self.reason})"
+
+# Inlining pass.
+# Replaces calls to small, non-recursive, non-exported functions by a copy of their body.
+# Registers and local labels of the copy are renamed, returns become assignments of the call's
+# result register followed by a goto past the copy. Static data of an inlined function is moved
+# to a global data directive, so that every copy and the original share the same storage.
+#
+# Functions are visited callees first, so that a function is measured after its own calls were
+# inlined. 'max_size' bounds the size of an inlined function, 'budget' bounds the total size
+# added to the program. Sizes count statements and expression nodes.
+class Inliner:
+    PREFIX = ".inl"
+
+    def __init__(self, program, target=MERCURY, max_size=24, budget=256):
+        self.program = program
+        self.target = target
+        self.max_size = max_size
+        self.budget = budget
+        self.decisions = []
+        self.consts = program_consts(program)
+        self.count = 0
+
+    # Runs the pass over every function and returns the number of inlined calls
+    @sirinstr.timed("inline")
+    def run(self):
+        self.graph = CallGraph(self.program)
+        self.functions = self.graph.functions
+        self.exports = {name for name, _ in self.program.exports}
+        self.global_names = set(self.functions) | set(self.program.imports) | set(self.consts)
+        for directive in self.program.data_directives:
+            self.global_names.update(datum.name for datum in directive.data if isinstance(datum, LabelNode))
+
+        for scc in self.graph.sccs():
+            for name in scc:
+                funct = self.functions[name]
+                self.regs = register_types(funct)
+                self.used_names = function_names(funct)
+                self.decls = {}
+                self.funct = funct
+                funct.stmts = self.__inline_block(funct.stmts)
+                if self.decls:
+                    funct.stmts = list(self.decls.values()) + funct.stmts
+        return sum(1 for decision in self.decisions if decision.inlined)
+
+    # Returns a text report of every decision
+    def report(self):
+        lines = [repr(decision) for decision in self.decisions]
+        inlined = sum(1 for decision in self.decisions if decision.inlined)
+        lines.append(f"{inlined} of {len(self.decisions)} calls inlined, {self.budget} of budget left")
+        return "\n".join(lines)
+
+    def __inline_block(self, stmts):
+        result = []
+        for stmt in stmts:
+            if isinstance(stmt, IfStatement):
+                stmt.if_block = self.__inline_block(stmt.if_block)
+                stmt.else_block = self.__inline_block(stmt.else_block)
+            elif isinstance(stmt, SwitchStatement):
+                stmt.cases = [(value, self.__inline_block(block)) for value, block in stmt.cases]
+                stmt.default_block = self.__inline_block(stmt.default_block)
+            elif isinstance(stmt, CallStatement):
+                callee = direct_callee(stmt, self.regs, self.functions)
+                if callee is not None:
+                    reason = self.__reject(stmt, self.functions[callee])
+                    self.decisions.append(InlineDecision(self.funct.name, callee, reason is None, reason or f"size {self.__size(self.functions[callee])}"))
+                    if reason is None:
+                        result.extend(self.__expand(stmt, self.functions[callee]))
+                        continue
+            result.append(stmt)
+        return result
+
+    # Returns why a call cannot be inlined, or None if it can
+    def __reject(self, call, callee):
+        if self.graph.is_recursive(callee.name):
+            return "recursive"
+        if callee.name in self.exports:
+            return "exported"
+        if call.convention != callee.convention:
+            return "convention mismatch"
+        if call.type != callee.type:
+            return "return type mismatch"
+        if len(call.args) != len(callee.fargs):
+            return "argument count mismatch"
+        size = self.__size(callee)
+        if size > self.max_size:
+            return f"too large, size {size} > {self.max_size}"
+        if size > self.budget:
+            return f"over budget, size {size} > {self.budget}"
+
+        # Globals read by the callee must not be shadowed by the caller's registers or static data
+        callee_regs = register_types(callee)
+        shadowing = set(self.regs) | self.__static_labels(self.funct)
+        for stmt in walk_stmts(callee.stmts):
+            for expr in stmt_exprs(stmt):
+                captured = expr_free_names(expr, callee_regs) & shadowing
+                if captured:
+                    return f"captures '{sorted(captured)[0]}'"
+        return None
+
+    def __size(self, funct):
+        return sum(1 + sum(1 for expr in stmt_exprs(stmt) for _ in walk_expr(expr)) for stmt in walk_stmts(funct.stmts))
+
+    def __static_labels(self, funct):
+        if funct.staticdata is None:
+            return set()
+        return {datum.name for datum in funct.staticdata.data if isinstance(datum, LabelNode)}
+
+    # Returns the statements replacing a call by a copy of the callee's body
+    def __expand(self, call, callee):
+        self.__promote_static_data(callee)
+        self.budget -= self.__size(callee)
+        self.count += 1
+
+        # Fresh names for the callee's registers and local labels
+        prefix = f"{Inliner.PREFIX}{self.count}."
+        callee_regs = register_types(callee)
+        registers = {name: self.__fresh(prefix + name) for name in callee_regs}
+        labels = {stmt.name: self.__fresh(prefix + stmt.name) for stmt in walk_stmts(callee.stmts) if isinstance(stmt, LabelNode)}
+        end_label = self.__fresh(prefix + "end")
+        for name, type in callee_regs.items():
+            self.decls.setdefault(type, DeclStatement(type)).names.append(registers[name])
+            self.regs[registers[name]] = type
+
+        stmts = [DefStatement(registers[name], arg) for (_, name), arg in zip(callee.fargs, call.args)]
+        typer = ExprTyper(callee_regs, {name: value for name, value in self.consts.items() if name not in callee_regs}, self.target)
+        body = self.__copy_block(callee.stmts, call, callee, typer, registers, labels, end_label)
+
+        # The goto of a final return falls through to the end label anyway
+        if body and isinstance(body[-1], GotoStatement) and body[-1].name == end_label:
+            body.pop()
+        stmts.extend(body)
+        if any(isinstance(stmt, GotoStatement) and stmt.name == end_label for stmt in walk_stmts(stmts)):
+            stmts.append(LabelNode(end_label))
+        return stmts
+
+    def __copy_block(self, stmts, call, callee, typer, registers, labels, end_label):
+        result = []
+        for stmt in stmts:
+            if isinstance(stmt, DeclStatement):
+                continue # Declared in the caller
+            if isinstance(stmt, ReturnStatement):
+                if call.ret_register is not None and stmt.expr is not None:
+                    value = rename_expr(copy_expr(stmt.expr), registers)
+                    if self.target.words(typer.type_of(stmt.expr)) > self.target.words(callee.type):
+                        value = UCastExpression(callee.type, value) # Truncated as a return would
+                    result.append(DefStatement(call.ret_register, value))
+                result.append(GotoStatement(end_label))
+                continue
+            if isinstance(stmt, JumpStatement):
+                # The jumped-to function returns to the call site in place of the callee
+                node = CallStatement(rename_expr(copy_expr(stmt.funct_expr), registers))
+                node.convention = stmt.convention
+                node.type = callee.type
+                node.ret_register = call.ret_register
+                node.args = [rename_expr(copy_expr(arg), registers) for arg in stmt.args]
+                result.extend([node, GotoStatement(end_label)])
+                continue
+
+            node = copy_stmt(stmt)
+            if isinstance(node, IfStatement):
+                node.left = rename_expr(node.left, registers)
+                node.right = rename_expr(node.right, registers)
+                node.if_block = self.__copy_block(stmt.if_block, call, callee, typer, registers, labels, end_label)
+                node.else_block = self.__copy_block(stmt.else_block, call, callee, typer, registers, labels, end_label)
+            elif isinstance(node, SwitchStatement):
+                node.expr = rename_expr(node.expr, registers)
+                node.cases = [(value, self.__copy_block(block, call, callee, typer, registers, labels, end_label)) for value, block in stmt.cases]
+                node.default_block = self.__copy_block(stmt.default_block, call, callee, typer, registers, labels, end_label)
+            else:
+                map_stmt_exprs(node, lambda expr: rename_expr(expr, registers))
+                if isinstance(node, (LabelNode, GotoStatement)):
+                    node.name = labels.get(node.name, node.name)
+                elif isinstance(node, DefStatement):
+                    node.name = registers.get(node.name, node.name)
+                elif isinstance(node, CallStatement) and node.ret_register is not None:
+                    node.ret_register = registers.get(node.ret_register, node.ret_register)
+            result.append(node)
+        return result
+
+    # Moves the static data of a function to a global data directive under unique names
+    def __promote_static_data(self, funct):
+        if funct.staticdata is None:
+            return
+        taken = set(self.global_names)
+        for other in self.program.function_decls:
+            taken |= function_names(other) | self.__static_labels(other)
+
+        mapping = {}
+        for name in self.__static_labels(funct):
+            promoted = f"{funct.name}.{name}"
+            while promoted in taken:
+                promoted += "_"
+            taken.add(promoted)
+            mapping[name] = promoted
+        self.global_names.update(mapping.values())
+
+        regs = register_types(funct)
+        local = {name: promoted for name, promoted in mapping.items() if name not in regs}
+        for stmt in walk_stmts(funct.stmts):
+            map_stmt_exprs(stmt, lambda expr: rename_expr(expr, local))
+        for datum in funct.staticdata.data:
+            if isinstance(datum, LabelNode):
+                datum.name = mapping[datum.name]
+            elif isinstance(datum, DatumNode):
+                datum.data = [rename_expr(expr, mapping) for expr in datum.data]
+                datum.allocsize = rename_expr(datum.allocsize, mapping)
+
+        self.program.data_directives.append(funct.staticdata)
+        funct.staticdata = None
+
+    def __fresh(self, name):
+        while name in self.used_names:
+            name += "_"
+        self.used_names.add(name)
+        return name
@@ -0,0 +1,190 @@
+import functools
+import json
+import os
+import time
+
+# Timed run of a phase of the pipeline, over an optional file
+class _Span:
+    __slots__ = ("phase", "file", "start", "wall", "cpu")
+
+    def __init__(self, phase, file, start):
+        self.phase = phase
+        self.file = file
+        self.start = start
+        self.wall = 0.0
+        self.cpu = 0.0
+
+# Context manager timing a phase into an instrumentation
+class _Phase:
+    __slots__ = ("instr", "span", "cpu")
+
+    def __init__(self, instr, name, file):
+        self.instr = instr
+        self.span = _Span(name, file, 0.0)
+
+    def __enter__(self):
+        self.cpu = time.process_time()
+        self.span.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, *exc):
+        self.span.wall = time.perf_counter() - self.span.start
+        self.span.cpu = time.process_time() - self.cpu
+        self.instr.spans.append(self.span)
+        return False
+
+# Context manager doing nothing, returned by disabled instrumentation
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+# Instrumentation of the compiler pipeline.
+# Records the wall and CPU time of phases, per file, and counters grouped by topic, such as
+# tokens by type or nodes by class. Results are exported as a text report or as Chrome
+# trace-event JSON, to be opened in chrome://tracing or Perfetto.
+#
+# Components time their work with 'phase' and count with 'count', and only compute costly
+# counters when 'enabled' is set. The shared DISABLED instance is used when instrumentation
+# is off, and does nothing.
+class Instrumentation:
+    enabled = True
+
+    def __init__(self):
+        self.spans = []
+        self.counters = {} # Group -> {key -> count}
+        self.origin = time.perf_counter()
+
+    # Returns a context manager timing a phase, optionally over a file
+    def phase(self, name, file=None):
+        return _Phase(self, name, file)
+
+    # Adds an amount to a counter
+    def count(self, group, key, amount=1):
+        counters = self.counters.setdefault(group, {})
+        counters[key] = counters.get(key, 0) + amount
+
+    # Adds the counts of a dictionary to the counters of a group
+    def count_all(self, group, counts):
+        counters = self.counters.setdefault(group, {})
+        for key, amount in counts.items():
+            counters[key] = counters.get(key, 0) + amount
+
+    # Returns a text report of the time spent in every phase, per file, and of every counter
+    def report(self):
+        lines = []
+        phases = {}
+        for span in self.spans:
+            total = phases.setdefault(span.phase, [0, 0.0, 0.0, {}])
+            total[0] += 1
+            total[1] += span.wall
+            total[2] += span.cpu
+            if span.file is not None:
+                file = total[3].setdefault(span.file, [0, 0.0, 0.0])
+                file[0] += 1
+                file[1] += span.wall
+                file[2] += span.cpu
+
+        lines.append(f"{'phase':<32} {'runs':>6} {'wall ms':>10} {'cpu ms':>10}")
+        for name, (runs, wall, cpu, files) in phases.items():
+            lines.append(f"{name:<32} {runs:>6} {wall * 1000:>10.2f} {cpu * 1000:>10.2f}")
+            for file, (runs, wall, cpu) in sorted(files.items(), key=lambda item: -item[1][1]):
+                lines.append(f"  {file:<30} {runs:>6} {wall * 1000:>10.2f} {cpu * 1000:>10.2f}")
+
+        for group, counters in self.counters.items():
+            lines.append("")
+            lines.append(f"{group}:")
+            for key, amount in sorted(counters.items(), key=lambda item: (-item[1], str(item[0]))):
+                lines.append(f"  {str(key):<30} {amount:>12}")
+        return "\n".join(lines)
+
+    # Returns the recorded phases and counters as a Chrome trace-event object
+    def trace(self):
+        pid = os.getpid()
+        events = []
+        end = 0.0
+        for span in self.spans:
+            start = (span.start - self.origin) * 1e6
+            end = max(end, start + span.wall * 1e6)
+            args = {"cpu_ms": span.cpu * 1000}
+            if span.file is not None:
+                args["file"] = span.file
+            events.append({"name": span.phase, "cat": "phase", "ph": "X", "ts": start, "dur": span.wall * 1e6,
+                           "pid": pid, "tid": 0, "args": args})
+        for group, counters in self.counters.items():
+            events.append({"name": group, "cat": "counter", "ph": "C", "ts": end, "pid": pid, "tid": 0,
+                           "args": {str(key): amount for key, amount in counters.items()}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    # Writes the Chrome trace-event JSON of the recorded phases and counters to a file
+    def save_trace(self, path):
+        with open(path, "w", encoding="utf8") as file:
+            json.dump(self.trace(), file)
+
+# Instrumentation recording nothing
+class _DisabledInstrumentation(Instrumentation):
+    enabled = False
+    NULL_PHASE = _NullPhase()
+
+    def phase(self, name, file=None):
+        return _DisabledInstrumentation.NULL_PHASE
+
+    def count(self, group, key, amount=1):
+        pass
+
+    def count_all(self, group, counts):
+        pass
+
+DISABLED = _DisabledInstrumentation()
+_active = DISABLED
+
+# Returns the instrumentation used by components created without an explicit one
+def active():
+    return _active
+
+# Makes an instrumentation, or a new one, the default of components, and returns it
+def enable(instr=None):
+    global _active
+    _active = instr or Instrumentation()
+    return _active
+
+# Turns the default instrumentation off
+def disable():
+    global _active
+    _active = DISABLED
+
+# Decorator timing a method as a phase of the active instrumentation.
+# Integer results, such as the number of rewrites of a pass, are counted under the phase name.
+def timed(name):
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            instr = _active
+            with instr.phase(name):
+                result = method(*args, **kwargs)
+            if instr.enabled and isinstance(result, int):
+                instr.count("results", name, result)
+            return result
+        return wrapper
+    return decorate
+
+# Yields every AST node reachable from a node, in no particular order
+def ast_nodes(root):
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (list, tuple)):
+            stack.extend(node)
+        elif type(node).__module__ == "sirparser":
+            yield node
+            stack.extend(value for value in _fields(node) if isinstance(value, (list, tuple)) or type(value).__module__ == "sirparser")
+
+# Returns the values of the fields of a node, held in slots or in its dictionary
+def _fields(node):
+    if hasattr(node, "__dict__"):
+        return vars(node).values()
+    return [getattr(node, name) for name in type(node).__slots__]
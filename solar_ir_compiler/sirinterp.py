@@ -0,0 +1,577 @@
+import struct
+
+from sirparser import *
+from siropt import ExprTyper, register_types, program_consts, const_value, walk_stmts, stmt_exprs, walk_expr
+from sirtarget import MERCURY
+
+# Compiled function, ready to be executed by an Interpreter.
+# Its body is a flat list of instructions. Every instruction is a closure taking the register
+# list of the frame and returning the index of the next instruction, or a negative value when
+# the frame ends. The last register of the frame holds the return value or the jump target.
+class _CompiledFunction:
+    def __init__(self, name, address, types):
+        self.name = name
+        self.address = address
+        self.types = types # Types of the formal arguments
+        self.masks = []
+        self.nregs = 0
+        self.code = []
+
+# Interpreter executing a parsed Solar IR program.
+# Memory is a flat bytearray laid out from the program's data directives, functions are
+# compiled once into closures and executed without walking the AST.
+# Imported names are resolved through 'hooks', a dictionary mapping names to python callables
+# receiving the interpreter followed by the call's arguments.
+class Interpreter:
+    END_RETURN = -1
+    END_JUMP = -2
+    DATA_BASE = 16 # Words left unused at the start of memory, so that 0 is never a valid label
+
+    def __init__(self, program, target=MERCURY, hooks=None, memory_words=1 << 16):
+        if target.word_bits % 8 != 0:
+            self.__error(f"Words of {target.word_bits} bits cannot be stored in a bytearray")
+        self.program = program
+        self.target = target
+        self.hooks = hooks or {}
+        self.word_bytes = target.word_bits // 8
+        self.ptr_mask = target.mask("ptr")
+        self.memory_words = min(memory_words, self.ptr_mask + 1)
+        self.memory = bytearray(self.memory_words * self.word_bytes)
+        self.view = memoryview(self.memory)
+        self.consts = program_consts(program)
+        self.globals = {} # Global label name -> address
+        self.functions = {} # Address -> compiled function or import hook
+        self.__accessors = {}
+
+        self.__layout()
+        self.__link()
+
+    def __error(self, text):
+        raise Exception(f"[INTERP]: An error occured while interpreting.\n{text}")
+
+    # Calls a function by name or address and returns its return value, or None
+    def call(self, funct, *args):
+        if isinstance(funct, str):
+            funct = self.address(funct)
+        try:
+            return self.__invoke(funct, list(args))
+        except RecursionError:
+            self.__error(f"Maximum call depth exceeded while calling '{funct}'")
+
+    # Returns the address of a global label, function or import
+    def address(self, name):
+        if name not in self.globals:
+            self.__error(f"Unknown global name '{name}'")
+        return self.globals[name]
+
+    # Reads a value of a given type from memory
+    def read(self, type, addr):
+        return self.__accessor(type)[0](addr & self.ptr_mask)
+
+    # Writes a value of a given type to memory
+    def write(self, type, addr, value):
+        self.__accessor(type)[1](addr & self.ptr_mask, value & self.target.mask(type))
+
+    # Reads a NUL-terminated string of word1 from memory
+    def read_string(self, addr):
+        chars = bytearray()
+        while True:
+            char = self.read("word1", addr)
+            if char == 0:
+                return chars.decode("utf8", errors="replace")
+            chars.append(char & 0xFF)
+            addr += 1
+
+    # Returns the (read, write) functions of a type, reading and writing whole words at an address
+    def __accessor(self, type):
+        words = self.target.words(type)
+        if words in self.__accessors:
+            return self.__accessors[words]
+
+        size = words * self.word_bytes
+        word_bytes = self.word_bytes
+        view = self.view
+        limit = len(self.memory) - size
+        error = self.__error
+        formats = {1: "<B", 2: "<H", 4: "<I", 8: "<Q"}
+
+        if size in formats:
+            packer = struct.Struct(formats[size])
+            unpack_from, pack_into = packer.unpack_from, packer.pack_into
+            def read(addr):
+                offset = addr * word_bytes
+                if offset > limit:
+                    error(f"Read of {words} words out of memory at address {addr}")
+                return unpack_from(view, offset)[0]
+            def write(addr, value):
+                offset = addr * word_bytes
+                if offset > limit:
+                    error(f"Write of {words} words out of memory at address {addr}")
+                pack_into(view, offset, value)
+        else: # Wider than struct supports
+            def read(addr):
+                offset = addr * word_bytes
+                if offset > limit:
+                    error(f"Read of {words} words out of memory at address {addr}")
+                return int.from_bytes(view[offset:offset + size], "little")
+            def write(addr, value):
+                offset = addr * word_bytes
+                if offset > limit:
+                    error(f"Write of {words} words out of memory at address {addr}")
+                view[offset:offset + size] = value.to_bytes(size, "little")
+
+        self.__accessors[words] = (read, write)
+        return read, write
+
+    ## Data layout ##
+
+    # Assigns addresses to every label, function and import, then fills data directives
+    def __layout(self):
+        self.local_labels = {} # Function name -> {label name -> address}
+        addr = Interpreter.DATA_BASE
+        pending = [] # (address, DatumNode, scope) to fill once every label is known
+
+        for directive in self.program.data_directives:
+            addr = self.__layout_directive(directive, addr, self.globals, pending, None)
+        for funct in self.program.function_decls:
+            labels = {}
+            if funct.staticdata:
+                addr = self.__layout_directive(funct.staticdata, addr, labels, pending, funct.name)
+            self.local_labels[funct.name] = labels
+
+        # Anonymous string literals used by function bodies
+        self.string_addresses = {}
+        for funct in self.program.function_decls:
+            for node in self.__string_constants(funct):
+                datum = DatumNode("word1")
+                datum.data = [ConstExpression(ConstantNode(ConstantNode.T_SCONST, x)) for x in node.const_node.data + [0]]
+                datum.allocsize = ConstExpression(ConstantNode(ConstantNode.T_SCONST, len(datum.data)))
+                self.string_addresses[id(node)] = addr
+                pending.append((addr, datum, None))
+                addr += len(datum.data)
+
+        # Functions and imports are given addresses past the data, which are never read
+        self.code_base = addr
+        for funct in self.program.function_decls:
+            self.globals[funct.name] = addr
+            addr += 1
+        for name in self.program.imports:
+            if name not in self.globals:
+                self.globals[name] = addr
+                addr += 1
+
+        if self.code_base > self.memory_words:
+            self.__error(f"Data segment of {self.code_base} words does not fit in {self.memory_words} words of memory")
+
+        self.typer = ExprTyper({}, self.consts, self.target)
+        for datum_addr, datum, scope in pending:
+            self.__fill_datum(datum_addr, datum, scope)
+
+    def __layout_directive(self, directive, addr, labels, pending, scope):
+        for datum in directive.data:
+            if isinstance(datum, LabelNode):
+                labels[datum.name] = addr
+            elif isinstance(datum, AlignNode):
+                boundary = self.target.words(datum.type.replace("align", "word").replace("wordp", "ptr"))
+                addr += -addr % boundary
+            elif isinstance(datum, DatumNode):
+                count = const_value(datum.allocsize, self.consts)
+                if count is None or count < 1:
+                    self.__error(f"Datum allocation size must be a positive constant, got {count}")
+                pending.append((addr, datum, scope))
+                addr += count * self.target.words(datum.type)
+        return addr
+
+    def __fill_datum(self, addr, datum, scope):
+        if not datum.data:
+            return # Uninitialised, memory is already zeroed
+        count = const_value(datum.allocsize, self.consts)
+        for expr in datum.data:
+            self.typer.annotate(expr)
+        values = [self.__compile_expr(expr, self.__data_scope(scope))([]) for expr in datum.data]
+        write = self.__accessor(datum.type)[1]
+        mask = self.target.mask(datum.type)
+        words = self.target.words(datum.type)
+        for i in range(count):
+            write(addr + i * words, values[i % len(values)] & mask)
+
+    def __string_constants(self, funct):
+        return [node for stmt in walk_stmts(funct.stmts) for expr in stmt_exprs(stmt) for node in walk_expr(expr)
+                if isinstance(node, ConstExpression) and node.const_node.type == ConstantNode.T_STRING]
+
+    ## Compilation ##
+
+    # Compiles every function and binds imports to their hooks
+    def __link(self):
+        for funct in self.program.function_decls:
+            self.functions[self.globals[funct.name]] = self.__compile_function(funct)
+        for name in self.program.imports:
+            addr = self.globals[name]
+            if addr not in self.functions:
+                self.functions[addr] = self.hooks.get(name) or self.__missing_hook(name)
+
+    def __missing_hook(self, name):
+        def hook(interp, *args):
+            self.__error(f"Imported function '{name}' was called without a hook")
+        return hook
+
+    # Returns a function resolving a name to ("reg", slot), ("const", value) or None
+    def __data_scope(self, funct_name):
+        locals = self.local_labels.get(funct_name, {})
+        def resolve(name):
+            if name in locals:
+                return ("const", locals[name])
+            if name in self.globals:
+                return ("const", self.globals[name])
+            if name in self.consts:
+                return ("const", self.consts[name])
+            return None
+        return resolve
+
+    def __compile_function(self, funct):
+        regs = register_types(funct)
+        slots = {}
+        compiled = _CompiledFunction(funct.name, self.globals[funct.name], [type for type, _ in funct.fargs])
+        for type, name in funct.fargs:
+            slots[name] = len(slots)
+        for name in regs:
+            if name not in slots:
+                slots[name] = len(slots)
+        compiled.nregs = len(slots) + 1 # Last register holds the return value or jump target
+        compiled.masks = [self.target.mask(type) for type in compiled.types]
+
+        data_scope = self.__data_scope(funct.name)
+        def resolve(name):
+            if name in slots:
+                return ("reg", slots[name])
+            return data_scope(name)
+
+        self.typer = ExprTyper(regs, {name: value for name, value in self.consts.items() if name not in regs}, self.target)
+        self.typer.annotate_block(funct.stmts)
+        self.resolve = resolve
+        self.slots = slots
+        self.regs = regs
+        self.funct = funct
+
+        # Flatten the body into (kind, ...) instructions, then resolve labels
+        self.flat = []
+        self.labels = {}
+        self.__flatten(funct.stmts)
+        self.flat.append(("return", None))
+
+        for index, instr in enumerate(self.flat):
+            compiled.code.append(self.__compile_instr(index, instr))
+        return compiled
+
+    def __flatten(self, stmts):
+        for stmt in stmts:
+            if isinstance(stmt, (EmptyStatement, DeclStatement)):
+                continue
+            elif isinstance(stmt, LabelNode):
+                self.labels[stmt.name] = len(self.flat)
+            elif isinstance(stmt, IfStatement):
+                branch = ["branch", stmt, None] # Jumps to the else block when the condition is false
+                self.flat.append(branch)
+                self.__flatten(stmt.if_block)
+                if stmt.else_block:
+                    skip = ["goto", None]
+                    self.flat.append(skip)
+                    branch[2] = len(self.flat)
+                    self.__flatten(stmt.else_block)
+                    skip[1] = len(self.flat)
+                else:
+                    branch[2] = len(self.flat)
+            elif isinstance(stmt, SwitchStatement):
+                switch = ["switch", stmt, [], None] # Case entry points, then the default's
+                self.flat.append(switch)
+                exits = []
+                for _, block in stmt.cases:
+                    switch[2].append(len(self.flat))
+                    self.__flatten(block)
+                    exits.append(["goto", None])
+                    self.flat.append(exits[-1])
+                switch[3] = len(self.flat)
+                self.__flatten(stmt.default_block)
+                for exit in exits:
+                    exit[1] = len(self.flat)
+            elif isinstance(stmt, GotoStatement):
+                self.flat.append(["goto", stmt.name])
+            elif isinstance(stmt, ReturnStatement):
+                self.flat.append(("return", stmt.expr))
+            else:
+                self.flat.append(("stmt", stmt))
+
+    def __compile_instr(self, index, instr):
+        kind = instr[0]
+        next = index + 1
+
+        if kind == "goto":
+            target = instr[1]
+            if isinstance(target, str):
+                if target not in self.labels:
+                    self.__error(f"Function '{self.funct.name}': Unknown local label '{target}'")
+                target = self.labels[target]
+            return lambda r: target
+
+        elif kind == "branch":
+            cond = self.__compile_cond(instr[1])
+            target = instr[2]
+            return lambda r: next if cond(r) else target
+
+        elif kind == "switch":
+            # Dense table indexed by the value's offset from the lowest case
+            value = self.__compile_expr(instr[1].expr)
+            mask = self.target.mask(instr[1].expr.resolved_type)
+            default = instr[3]
+            if not instr[1].cases:
+                return lambda r: default
+            low = instr[1].cases[0][0]
+            table = [default] * (instr[1].cases[-1][0] - low + 1)
+            for (case, _), target in zip(instr[1].cases, instr[2]):
+                table[case - low] = target
+            span = len(table)
+            def switch(r):
+                offset = (value(r) & mask) - low
+                return table[offset] if 0 <= offset < span else default
+            return switch
+
+        elif kind == "return":
+            end = Interpreter.END_RETURN
+            if instr[1] is None or self.funct.type is None:
+                def ret(r):
+                    r[-1] = None
+                    return end
+                return ret
+            value = self.__compile_expr(instr[1])
+            mask = self.target.mask(self.funct.type)
+            def ret(r):
+                r[-1] = value(r) & mask
+                return end
+            return ret
+
+        stmt = instr[1]
+        if isinstance(stmt, DefStatement):
+            if stmt.name not in self.slots:
+                self.__error(f"Function '{self.funct.name}': Assignment to undeclared register '{stmt.name}'")
+            slot = self.slots[stmt.name]
+            value = self.__compile_expr(stmt.expr)
+            mask = self.target.mask(self.regs[stmt.name])
+            def define(r):
+                r[slot] = value(r) & mask
+                return next
+            return define
+
+        elif isinstance(stmt, MemWriteStatement):
+            addr = self.__compile_expr(stmt.addr_expr)
+            value = self.__compile_expr(stmt.val_expr)
+            write = self.__accessor(stmt.type)[1]
+            mask = self.target.mask(stmt.type)
+            ptr_mask = self.ptr_mask
+            def memwrite(r):
+                write(addr(r) & ptr_mask, value(r) & mask)
+                return next
+            return memwrite
+
+        elif isinstance(stmt, CallStatement):
+            funct = self.__compile_expr(stmt.funct_expr)
+            args = [self.__compile_expr(arg) for arg in stmt.args]
+            invoke = self.__invoke
+            if stmt.ret_register is None:
+                def call(r):
+                    invoke(funct(r), [arg(r) for arg in args])
+                    return next
+                return call
+            slot = self.slots[stmt.ret_register]
+            mask = self.target.mask(self.regs[stmt.ret_register])
+            def call(r):
+                r[slot] = (invoke(funct(r), [arg(r) for arg in args]) or 0) & mask
+                return next
+            return call
+
+        elif isinstance(stmt, JumpStatement):
+            funct = self.__compile_expr(stmt.funct_expr)
+            args = [self.__compile_expr(arg) for arg in stmt.args]
+            end = Interpreter.END_JUMP
+            def jump(r):
+                r[-1] = (funct(r), [arg(r) for arg in args])
+                return end
+            return jump
+
+        self.__error(f"Function '{self.funct.name}': Cannot compile statement '{stmt}'")
+
+    # Calls a function by address, following jumps without growing the python stack
+    def __invoke(self, addr, args):
+        while True:
+            funct = self.functions.get(addr)
+            if funct is None:
+                self.__error(f"Call to address {addr}, which is not a function")
+            if not isinstance(funct, _CompiledFunction):
+                return funct(self, *args)
+
+            if len(args) != len(funct.types):
+                self.__error(f"Function '{funct.name}' expects {len(funct.types)} arguments, got {len(args)}")
+            r = [0] * funct.nregs
+            for i, arg in enumerate(args):
+                r[i] = arg & funct.masks[i]
+
+            code = funct.code
+            pc = 0
+            while pc >= 0:
+                pc = code[pc](r)
+
+            if pc == Interpreter.END_RETURN:
+                return r[-1]
+            addr, args = r[-1]
+
+    # Compiles an if statement's condition into a closure returning a bool
+    def __compile_cond(self, stmt):
+        left = self.__compile_expr(stmt.left)
+        right = self.__compile_expr(stmt.right)
+        rel = stmt.rel
+
+        if rel == "==":
+            return lambda r: left(r) == right(r)
+        elif rel == "!=":
+            return lambda r: left(r) != right(r)
+        elif rel == ">":
+            return lambda r: left(r) > right(r)
+        elif rel == "<":
+            return lambda r: left(r) < right(r)
+        elif rel == ">=":
+            return lambda r: left(r) >= right(r)
+        elif rel == "<=":
+            return lambda r: left(r) <= right(r)
+
+        # Signed relations compare at the width of the wider operand
+        type = self.target.wider(stmt.left.resolved_type, stmt.right.resolved_type)
+        sign = 1 << (self.target.bits(type) - 1)
+        signed_left = lambda r: (left(r) ^ sign) - sign
+        signed_right = lambda r: (right(r) ^ sign) - sign
+        if rel == ">$":
+            return lambda r: signed_left(r) > signed_right(r)
+        elif rel == "<$":
+            return lambda r: signed_left(r) < signed_right(r)
+        elif rel == ">=$":
+            return lambda r: signed_left(r) >= signed_right(r)
+        elif rel == "<=$":
+            return lambda r: signed_left(r) <= signed_right(r)
+        self.__error(f"Unknown relation '{rel}'")
+
+    # Compiles an expression into a closure taking the register list and returning its value.
+    # Values are always kept zero-extended and masked to the width of their type.
+    def __compile_expr(self, expr, resolve=None):
+        resolve = resolve or self.resolve
+
+        if isinstance(expr, ConstExpression):
+            node = expr.const_node
+            if node.type == ConstantNode.T_SCONST:
+                value = node.data & self.target.mask("word8")
+                return lambda r: value
+            elif node.type == ConstantNode.T_STRING:
+                value = self.string_addresses[id(expr)]
+                return lambda r: value
+            binding = resolve(node.data)
+            if binding is None:
+                self.__error(f"Unknown name '{node.data}'")
+            if binding[0] == "reg":
+                slot = binding[1]
+                return lambda r: r[slot]
+            value = binding[1] & self.target.mask("word8")
+            return lambda r: value
+
+        elif isinstance(expr, MemReadExpression):
+            addr = self.__compile_expr(expr.addr_expr, resolve)
+            read = self.__accessor(expr.type)[0]
+            ptr_mask = self.ptr_mask
+            return lambda r: read(addr(r) & ptr_mask)
+
+        elif isinstance(expr, UCastExpression):
+            value = self.__compile_expr(expr.expr, resolve)
+            mask = self.target.mask(expr.type)
+            return lambda r: value(r) & mask
+
+        elif isinstance(expr, SCastExpression):
+            value = self.__compile_expr(expr.expr, resolve)
+            mask = self.target.mask(expr.type)
+            sign = 1 << (self.target.bits(expr.expr.resolved_type) - 1)
+            return lambda r: ((value(r) ^ sign) - sign) & mask
+
+        elif isinstance(expr, UnaryExpression):
+            value = self.__compile_expr(expr.value, resolve)
+            mask = self.target.mask(expr.resolved_type)
+            return lambda r: -value(r) & mask
+
+        elif isinstance(expr, BinaryExpression):
+            return self.__compile_binary(expr, resolve)
+
+        self.__error(f"Cannot compile unknown expression '{expr}'")
+
+    def __compile_binary(self, expr, resolve):
+        left = self.__compile_expr(expr.left, resolve)
+        right = self.__compile_expr(expr.right, resolve)
+        type = expr.resolved_type
+        mask = self.target.mask(type)
+        sign = 1 << (self.target.bits(type) - 1)
+        op = expr.op
+        error = self.__error
+
+        # Operations on a constant right operand are common enough to avoid a call
+        if isinstance(expr.right, ConstExpression) and expr.right.const_node.type == ConstantNode.T_SCONST:
+            c = right(None)
+            if op == "+":
+                return lambda r: (left(r) + c) & mask
+            elif op == "-":
+                return lambda r: (left(r) - c) & mask
+            elif op == "&":
+                return lambda r: left(r) & c
+            elif op == "<<":
+                if c >= self.target.bits(type):
+                    return lambda r: 0
+                return lambda r: (left(r) << c) & mask
+            elif op == ">>":
+                return lambda r: left(r) >> c
+
+        if op == "+":
+            return lambda r: (left(r) + right(r)) & mask
+        elif op == "-":
+            return lambda r: (left(r) - right(r)) & mask
+        elif op == "*":
+            return lambda r: (left(r) * right(r)) & mask
+        elif op in ["/", "%", "/$", "%$"]:
+            signed = op.endswith("$")
+            modulo = op.startswith("%")
+            def divide(r):
+                a, b = left(r), right(r)
+                if b == 0:
+                    error("Division by zero")
+                if signed:
+                    a, b = (a ^ sign) - sign, (b ^ sign) - sign
+                    q = abs(a) // abs(b)
+                    if (a < 0) != (b < 0):
+                        q = -q
+                    return (a - q * b if modulo else q) & mask
+                return a % b if modulo else a // b
+            return divide
+        elif op == "&":
+            return lambda r: left(r) & right(r)
+        elif op == "|":
+            return lambda r: left(r) | right(r)
+        elif op == "^":
+            return lambda r: left(r) ^ right(r)
+        elif op == "~&":
+            return lambda r: ~(left(r) & right(r)) & mask
+        elif op == "~|":
+            return lambda r: ~(left(r) | right(r)) & mask
+        elif op == "~^":
+            return lambda r: ~(left(r) ^ right(r)) & mask
+        elif op == "<<":
+            bits = self.target.bits(type)
+            def shift_left(r):
+                a, b = left(r), right(r)
+                return (a << b) & mask if b < bits else 0
+            return shift_left
+        elif op == ">>":
+            return lambda r: left(r) >> right(r)
+        elif op == ">>$":
+            return lambda r: (((left(r) ^ sign) - sign) >> right(r)) & mask
+        error(f"Unknown operator '{op}'")
@@ -1,3 +1,30 @@
+import sirinstr
+
+# Problem found in source code while reading tokens, parsing or checking a program.
+# 'code' identifies the kind of problem, 'offset' is the index of the character it was found at,
+# or -1 for problems found in a program tree, which holds no source positions.
+class Diagnostic:
+    def __init__(self, code, message, offset=-1, linenum=-1, linepos=-1, filename=None):
+        self.code = code
+        self.message = message
+        self.offset = offset
+        self.linenum = linenum
+        self.linepos = linepos
+        self.filename = filename
+
+    def __str__(self):
+        location = f"{self.linenum},{self.linepos}: " if self.linenum >= 0 else ""
+        if self.filename is not None:
+            location = f"{self.filename}:{location}"
+        return f"{location}[{self.code}] {self.message}"
+
+    def __repr__(self):
+        return f"Diagnostic({self.code}, {repr(self.message)}, {self.offset})"
+
+# Raised to stop reading or parsing at a problem that has been recorded as a diagnostic
+class _RecoverableError(Exception):
+    pass
+
 # Class representing a Solar IR token.
 # Exposes token types.
 class Token:
@@ -23,12 +50,13 @@ class Token:
     T_SIGNED = "T_SIGN" # $
     T_EOF = "EOF"
     
-    def __init__(self, type, value, linenum=-1, linepos=-1, **kwargs):
+    def __init__(self, type, value, linenum=-1, linepos=-1, offset=-1, **kwargs):
         self.type = type
         self.value = value
         self.extra = kwargs
         self.linenum = linenum
         self.linepos = linepos
+        self.offset = offset
     
     def __str__(self):
         value = self.value
@@ -44,9 +72,12 @@ class Token:
         return self.__str__()
 
 # Class representing an active Lexer.
-# Expects source code to be passed to its constructor
+# Expects source code to be passed to its constructor, and optionally the name of its file and
+# the instrumentation recording its work (the active one by default).
+# By default, the first invalid token raises an exception. In recovery mode, every problem is
+# recorded in 'diagnostics', the offending characters are skipped and reading goes on.
 class Lexer:
-    PUNCTUATOR_CHARS = "(){}[];:,=!<>+-*/%&!^~!#?$"
+    PUNCTUATOR_CHARS = "(){}[];:,=!<>+-*/%&|^~!#?$"
     BASE_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
     KEYWORDS = [
         ("align1", Token.T_ALIGN),  ("align2", Token.T_ALIGN), ("align4", Token.T_ALIGN),   ("align8", Token.T_ALIGN),   ("alignp", Token.T_ALIGN),
@@ -78,15 +109,37 @@ class Lexer:
         "o": "word8"
     }
     
-    def __init__(self, text):
+    def __init__(self, text, filename=None, instr=None, recover=False):
         self.text = text
         self.pos = 0
-        self.current_char = self.text[self.pos]
+        self.current_char = self.text[self.pos] if self.text else None
         self.linenum = 1
         self.linepos = 1
+        self.filename = filename
+        self.instr = instr or sirinstr.active()
+        self.recover = recover
+        self.diagnostics = []
+        self.token_pos = 0 # First character of the token being read
+        self.skipped_pos = -1 # Character following the last one skipped
+
+    # Reports a problem at a (linenum, linepos, pos) start, the current character by default.
+    # In recovery mode, a run of invalid characters is only reported once.
+    def __error(self, code, text, start=None):
+        linenum, linepos, pos = start or self.__start()
+        if not self.recover:
+            raise Exception(f"[LEXER]: An error occured while reading tokens.\n{linenum},{linepos}: {text}")
+        if pos != self.skipped_pos:
+            self.diagnostics.append(Diagnostic(code, text, pos, linenum, linepos, self.filename))
+            self.instr.count("diagnostics", code)
+        raise _RecoverableError()
 
-    def __error(self, text):
-        raise Exception(f"[LEXER]: An error occured while reading tokens.\n{text}")
+    # Returns the position of the current character
+    def __start(self):
+        return (self.linenum, self.linepos, self.pos)
+
+    # Returns the position of the previous character
+    def __previous(self):
+        return (self.linenum, self.linepos-1, self.pos-1)
     
     # Advance the current character by one and update current_chair, pos
     def __advance(self, num=1):
@@ -113,12 +166,12 @@ class Lexer:
     def __read_name(self):
         name = ""
         if not self.current_char:
-            self.__error(f"{self.linenum},{self.linepos}: Expected name, got EOF")
+            self.__error("L001", "Expected name, got EOF")
         
         if not ((self.current_char.isalpha() and self.current_char.isascii()) or self.current_char in "_.@"):
-            self.__error(f"{self.linenum},{self.linepos}: Invalid name starting character '{self.current_char}'")
+            self.__error("L002", f"Invalid name starting character '{self.current_char}'")
         
-        start = (self.linenum, self.linepos)
+        start = self.__start()
         
         while self.current_char.isalnum() or self.current_char in "_.@":
             name += self.current_char
@@ -137,12 +190,12 @@ class Lexer:
         if not equals_keyword and name.startswith("@"):
             name = name[1:]
             
-        return Token(equals_keyword if equals_keyword else Token.T_NAME, name, start[0], start[1])
+        return Token(equals_keyword if equals_keyword else Token.T_NAME, name, start[0], start[1], start[2])
         
     # Extract an integer in a specified base
     def __read_integer(self, base):
         if not (2 <= base <= len(Lexer.BASE_CHARS)):
-            self.__error(f"{self.linenum},{self.linepos}: Invalid integer base '{base}'")
+            self.__error("L003", f"Invalid integer base '{base}'")
             
         chars = Lexer.BASE_CHARS[0:base]
         
@@ -153,12 +206,17 @@ class Lexer:
             self.__advance()
         
         if self.current_char and self.current_char.isalpha():
-            self.__error(f"{self.linenum},{self.linepos}: Integer '{num_string}' cannot be followed by alphabetic '{self.current_char}'.")
+            self.__error("L004", f"Integer '{num_string}' cannot be followed by alphabetic '{self.current_char}'.")
+        
+        if not num_string:
+            self.__error("L011", f"Expected digits of base {base}, got '{self.current_char or 'EOF'}'.")
         
         return int(num_string, base=base)
         
     # Read a single character or escape sequence
     def __read_char(self):
+        if self.current_char == None:
+            self.__error("L012", "Expected character, got EOF.")
         char = self.current_char
         
         # Check for escape sequence
@@ -197,9 +255,9 @@ class Lexer:
     def __read_string(self):
         string = []
         while self.current_char != "\"":
-            string.extend(bytes(chr(self.__read_char()), encoding = "utf-8"))
             if self.current_char == None:
-                self.__error(f"{self.linenum},{self.linepos-1}: Expected closing double quote while parsing string, got '{self.current_char or 'EOF'}'.")
+                self.__error("L005", f"Expected closing double quote while parsing string, got '{self.current_char or 'EOF'}'.", self.__previous())
+            string.extend(bytes(chr(self.__read_char()), encoding = "utf-8"))
             
         return string
     
@@ -211,28 +269,35 @@ class Lexer:
                 punct_matches.append(punct)
         
         if len(punct_matches) == 0:
-            self.__error(f"{self.linenum},{self.linepos}: Invalid punctuator '{self.__peek(10)}{'{...}' if self.pos+10 < len(self.text) else '{EOF}'}'.")
+            self.__error("L006", f"Invalid punctuator '{self.__peek(10)}{'{...}' if self.pos+10 < len(self.text) else '{EOF}'}'.")
         
         list.sort(punct_matches, key = lambda punct: len(punct[0]), reverse = True)
         punct = punct_matches[0]
         
-        start = (self.linenum, self.linepos)
+        start = self.__start()
         
         [self.__advance() for _ in range(len(punct[0]))]
         
-        return Token(punct[1], punct[0].strip(), start[0], start[1])
+        return Token(punct[1], punct[0].strip(), start[0], start[1], start[2])
     
     def __get_next_token(self):
         while self.current_char is not None:
+            self.token_pos = self.pos
             
             # Ignore any comments
             if self.__peek(2) == "/*":
-                comment_start = (self.linenum, self.linepos)
+                comment_start = self.__start()
                 while self.__peek(2) != "*/":
+                    if self.current_char == "\n":
+                        self.linenum += 1
+                        self.linepos = 0
                     self.__advance()
+                    self.skipped_pos = self.pos
                     if self.current_char == None:
-                        self.__error(f"{comment_start[0]},{comment_start[1]}: Comment unclosed at end of file")
+                        self.__error("L007", "Comment unclosed at end of file", comment_start)
                 del comment_start
+                self.__advance(2)
+                continue
             
             # Ignore any whitespace that isn't part of another structure
             elif self.current_char.isspace():
@@ -241,11 +306,11 @@ class Lexer:
             
             # Try parsing an integer if a digit is detected
             elif self.current_char.isdigit():
-                start = (self.linenum, self.linepos)
+                start = self.__start()
                 
                 base = 10
                 if self.current_char == '0':
-                    if self.text[self.pos] and self.text[self.pos].isalpha():
+                    if self.__peek(2)[1:].isalpha():
                         self.__advance()
                         if self.current_char == "b":
                             base = 2
@@ -254,32 +319,32 @@ class Lexer:
                         elif self.current_char == "x":
                             base = 16
                         else:
-                            self.__error(f"{self.linenum},{self.linepos-1}: Invalid base prefix '0{self.current_char}'")
+                            self.__error("L008", f"Invalid base prefix '0{self.current_char}'", self.__previous())
                         self.__advance()
                 
                 num = self.__read_integer(base)
                 
-                return Token(Token.T_INT, num, start[0], start[1], wasChar = False)
+                return Token(Token.T_INT, num, start[0], start[1], start[2], wasChar = False)
             
             # Try parsing a character
             elif (self.current_char == "'"):
-                start = (self.linenum, self.linepos)
+                start = self.__start()
                 self.__advance()
                 char_int = self.__read_char()
                 
                 # Check that it is closed by a single quote
                 if self.current_char != "'":
-                    self.__error(f"{self.linenum},{self.linepos-1}: Expected closing single quote while parsing character, got '{self.current_char or 'EOF'}'.")
+                    self.__error("L009", f"Expected closing single quote while parsing character, got '{self.current_char or 'EOF'}'.", self.__previous())
                 self.__advance()
-                return Token(Token.T_CHAR, char_int, start[0], start[1], wasChar = True)
+                return Token(Token.T_CHAR, char_int, start[0], start[1], start[2], wasChar = True)
             
             # Try parsing a string
             elif (self.current_char == '"'):
-                start = (self.linenum, self.linepos)
+                start = self.__start()
                 self.__advance()
                 utf8string = self.__read_string()
                 self.__advance()
-                return Token(Token.T_STR, utf8string, start[0], start[1])
+                return Token(Token.T_STR, utf8string, start[0], start[1], start[2])
             
             # Try parsing a name if a letter, _, ., or @ is encountered.
             elif (self.current_char.isalpha() and self.current_char.isascii()) or self.current_char in "_.@":
@@ -291,18 +356,44 @@ class Lexer:
             
             # Otherwise, no valid token was found
             else:
-                self.__error(f"{self.linenum},{self.linepos}: Unknown token start symbol '{self.current_char}'") 
+                self.__error("L010", f"Unknown token start symbol '{self.current_char}'") 
             
             self.__advance()
         
-        return Token(Token.T_EOF, None, self.linenum, self.linepos)
+        return Token(Token.T_EOF, None, self.linenum, self.linepos, self.pos)
+    
+    # Reads the next valid token. Tokens in error are dropped, and reading resumes at the character
+    # their problem was found at, or after their first character if it cannot start a token.
+    def __recovering_next_token(self):
+        while True:
+            try:
+                return self.__get_next_token()
+            except _RecoverableError:
+                if self.pos == self.token_pos:
+                    if self.current_char == "\n":
+                        self.linenum += 1
+                        self.linepos = 0
+                    self.__advance()
+                    self.skipped_pos = self.pos
     
     def lex(self):
         tokens = []
-        while True:
-            token = self.__get_next_token()
-            tokens.append(token)
-            if token.type == Token.T_EOF:
-                return tokens
+        with self.instr.phase("lex", self.filename):
+            while True:
+                if self.recover:
+                    token = self.__recovering_next_token()
+                else:
+                    token = self.__get_next_token()
+                tokens.append(token)
+                if token.type == Token.T_EOF:
+                    break
+
+        if self.instr.enabled:
+            counts = {}
+            for token in tokens:
+                counts[token.type] = counts.get(token.type, 0) + 1
+            self.instr.count_all("tokens by type", counts)
+            self.instr.count("lexer", "source bytes", len(self.text.encode("utf8")))
+        return tokens
             
     
\ No newline at end of file
@@ -0,0 +1,838 @@
+import sirinstr
+from sirparser import *
+from sirtarget import MERCURY
+
+COMMUTATIVE_OPS = ["+", "*", "&", "|", "^", "~&", "~|", "~^"]
+MAX_FOLDED_SHIFT = 1024 # Constant left shifts by more bits are not computed
+
+# Returns a constant expression holding a name
+def name_expr(name):
+    return ConstExpression(ConstantNode(ConstantNode.T_NAME, name))
+
+# Returns a constant expression holding an integer of a given type.
+# Integer literals are word8, so narrower types are expressed through an unsigned cast.
+def int_expr(value, type="word8"):
+    const = ConstExpression(ConstantNode(ConstantNode.T_SCONST, value))
+    if type == "word8":
+        return const
+    return UCastExpression(type, const)
+
+# Returns a deep copy of an expression
+def copy_expr(expr):
+    if isinstance(expr, ConstExpression):
+        data = expr.const_node.data
+        return ConstExpression(ConstantNode(expr.const_node.type, list(data) if isinstance(data, list) else data))
+    elif isinstance(expr, MemReadExpression):
+        return MemReadExpression(expr.type, copy_expr(expr.addr_expr))
+    elif isinstance(expr, UCastExpression):
+        return UCastExpression(expr.type, copy_expr(expr.expr))
+    elif isinstance(expr, SCastExpression):
+        return SCastExpression(expr.type, copy_expr(expr.expr))
+    elif isinstance(expr, BinaryExpression):
+        return BinaryExpression(copy_expr(expr.left), expr.op, copy_expr(expr.right))
+    elif isinstance(expr, UnaryExpression):
+        return UnaryExpression(expr.op, copy_expr(expr.value))
+    raise Exception(f"[OPT]: Cannot copy unknown expression '{expr}'")
+
+# Returns a deep copy of a statement, including the blocks of if statements
+def copy_stmt(stmt):
+    if isinstance(stmt, EmptyStatement):
+        return EmptyStatement()
+    elif isinstance(stmt, DeclStatement):
+        node = DeclStatement(stmt.type)
+        node.names = list(stmt.names)
+        return node
+    elif isinstance(stmt, DefStatement):
+        return DefStatement(stmt.name, copy_expr(stmt.expr))
+    elif isinstance(stmt, MemWriteStatement):
+        return MemWriteStatement(stmt.type, copy_expr(stmt.addr_expr), copy_expr(stmt.val_expr))
+    elif isinstance(stmt, IfStatement):
+        node = IfStatement(copy_expr(stmt.left), stmt.rel, copy_expr(stmt.right))
+        node.if_block = [copy_stmt(x) for x in stmt.if_block]
+        node.else_block = [copy_stmt(x) for x in stmt.else_block]
+        return node
+    elif isinstance(stmt, SwitchStatement):
+        node = SwitchStatement(copy_expr(stmt.expr))
+        node.cases = [(value, [copy_stmt(x) for x in block]) for value, block in stmt.cases]
+        node.default_block = [copy_stmt(x) for x in stmt.default_block]
+        return node
+    elif isinstance(stmt, LabelNode):
+        return LabelNode(stmt.name)
+    elif isinstance(stmt, GotoStatement):
+        return GotoStatement(stmt.name)
+    elif isinstance(stmt, JumpStatement):
+        node = JumpStatement(copy_expr(stmt.funct_expr))
+        node.convention = stmt.convention
+        node.args = [copy_expr(arg) for arg in stmt.args]
+        return node
+    elif isinstance(stmt, CallStatement):
+        node = CallStatement(copy_expr(stmt.funct_expr))
+        node.convention = stmt.convention
+        node.type = stmt.type
+        node.ret_register = stmt.ret_register
+        node.args = [copy_expr(arg) for arg in stmt.args]
+        return node
+    elif isinstance(stmt, ReturnStatement):
+        node = ReturnStatement()
+        node.expr = copy_expr(stmt.expr) if stmt.expr is not None else None
+        return node
+    raise Exception(f"[OPT]: Cannot copy unknown statement '{stmt}'")
+
+# Returns the direct subexpressions of an expression
+def sub_exprs(expr):
+    if isinstance(expr, MemReadExpression):
+        return [expr.addr_expr]
+    elif isinstance(expr, (UCastExpression, SCastExpression)):
+        return [expr.expr]
+    elif isinstance(expr, BinaryExpression):
+        return [expr.left, expr.right]
+    elif isinstance(expr, UnaryExpression):
+        return [expr.value]
+    return []
+
+# Yields an expression and all of its subexpressions
+def walk_expr(expr):
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(sub_exprs(node))
+
+# Returns every name read by an expression
+def expr_names(expr):
+    return {node.const_node.data for node in walk_expr(expr) if isinstance(node, ConstExpression) and node.const_node.type == ConstantNode.T_NAME}
+
+# Renames in place the names of an expression found in a mapping, and returns the expression
+def rename_expr(expr, mapping):
+    for node in walk_expr(expr):
+        if isinstance(node, ConstExpression) and node.const_node.type == ConstantNode.T_NAME and node.const_node.data in mapping:
+            node.const_node.data = mapping[node.const_node.data]
+    return expr
+
+# Returns whether an expression reads memory
+def expr_reads_memory(expr):
+    return any(isinstance(node, MemReadExpression) for node in walk_expr(expr))
+
+# Returns a hashable key identifying an expression by structure.
+# Operands of commutative operators are ordered so that 'a + b' and 'b + a' share a key.
+def expr_key(expr):
+    if isinstance(expr, ConstExpression):
+        data = expr.const_node.data
+        return ("C", expr.const_node.type, tuple(data) if isinstance(data, list) else data)
+    elif isinstance(expr, MemReadExpression):
+        return ("M", expr.type, expr_key(expr.addr_expr))
+    elif isinstance(expr, UCastExpression):
+        return ("U", expr.type, expr_key(expr.expr))
+    elif isinstance(expr, SCastExpression):
+        return ("S", expr.type, expr_key(expr.expr))
+    elif isinstance(expr, BinaryExpression):
+        left, right = expr_key(expr.left), expr_key(expr.right)
+        if expr.op in COMMUTATIVE_OPS and repr(right) < repr(left):
+            left, right = right, left
+        return ("B", expr.op, left, right)
+    elif isinstance(expr, UnaryExpression):
+        return ("N", expr.op, expr_key(expr.value))
+    raise Exception(f"[OPT]: Cannot key unknown expression '{expr}'")
+
+# Returns the expressions evaluated by a statement, in evaluation order.
+# Nested blocks are not included.
+def stmt_exprs(stmt):
+    if isinstance(stmt, DefStatement):
+        return [stmt.expr]
+    elif isinstance(stmt, MemWriteStatement):
+        return [stmt.addr_expr, stmt.val_expr]
+    elif isinstance(stmt, IfStatement):
+        return [stmt.left, stmt.right]
+    elif isinstance(stmt, (JumpStatement, CallStatement)):
+        return [stmt.funct_expr] + stmt.args
+    elif isinstance(stmt, ReturnStatement):
+        return [stmt.expr] if stmt.expr is not None else []
+    elif isinstance(stmt, SwitchStatement):
+        return [stmt.expr]
+    return []
+
+# Replaces every expression evaluated by a statement with fn(expr)
+def map_stmt_exprs(stmt, fn):
+    if isinstance(stmt, DefStatement):
+        stmt.expr = fn(stmt.expr)
+    elif isinstance(stmt, MemWriteStatement):
+        stmt.addr_expr = fn(stmt.addr_expr)
+        stmt.val_expr = fn(stmt.val_expr)
+    elif isinstance(stmt, IfStatement):
+        stmt.left = fn(stmt.left)
+        stmt.right = fn(stmt.right)
+    elif isinstance(stmt, (JumpStatement, CallStatement)):
+        stmt.funct_expr = fn(stmt.funct_expr)
+        stmt.args = [fn(arg) for arg in stmt.args]
+    elif isinstance(stmt, ReturnStatement):
+        if stmt.expr is not None:
+            stmt.expr = fn(stmt.expr)
+    elif isinstance(stmt, SwitchStatement):
+        stmt.expr = fn(stmt.expr)
+
+# Returns the blocks nested in a statement
+def sub_blocks(stmt):
+    if isinstance(stmt, IfStatement):
+        return [stmt.if_block, stmt.else_block]
+    elif isinstance(stmt, SwitchStatement):
+        return [block for _, block in stmt.cases] + [stmt.default_block]
+    return []
+
+# Yields every statement of a block, including those of nested blocks
+def walk_stmts(stmts):
+    for stmt in stmts:
+        yield stmt
+        for block in sub_blocks(stmt):
+            yield from walk_stmts(block)
+
+# Returns a dictionary of the registers of a function and their types
+def register_types(funct):
+    regs = {name: type for type, name in funct.fargs}
+    for stmt in walk_stmts(funct.stmts):
+        if isinstance(stmt, DeclStatement):
+            for name in stmt.names:
+                regs[name] = stmt.type
+        elif isinstance(stmt, CallStatement) and stmt.ret_register and stmt.type:
+            regs.setdefault(stmt.ret_register, stmt.type)
+    return regs
+
+# Returns every name used within a function, to avoid collisions with generated names
+def function_names(funct):
+    names = {name for _, name in funct.fargs}
+    for stmt in walk_stmts(funct.stmts):
+        if isinstance(stmt, DeclStatement):
+            names.update(stmt.names)
+        elif isinstance(stmt, DefStatement):
+            names.add(stmt.name)
+        elif isinstance(stmt, CallStatement) and stmt.ret_register:
+            names.add(stmt.ret_register)
+        elif isinstance(stmt, (LabelNode, GotoStatement)):
+            names.add(stmt.name)
+        for expr in stmt_exprs(stmt):
+            names.update(expr_names(expr))
+    return names
+
+# Returns the integer value of a constant expression, or None if it is not constant.
+# 'consts' maps the names of const directives to their values.
+def const_value(expr, consts={}):
+    if isinstance(expr, ConstExpression):
+        if expr.const_node.type == ConstantNode.T_SCONST:
+            return expr.const_node.data
+        if expr.const_node.type == ConstantNode.T_NAME:
+            return consts.get(expr.const_node.data)
+        return None
+    elif isinstance(expr, UnaryExpression) and expr.op == "-":
+        value = const_value(expr.value, consts)
+        return -value if value is not None else None
+    elif isinstance(expr, BinaryExpression):
+        left, right = const_value(expr.left, consts), const_value(expr.right, consts)
+        if left is None or right is None:
+            return None
+        if expr.op == "+":
+            return left + right
+        elif expr.op == "-":
+            return left - right
+        elif expr.op == "*":
+            return left * right
+        elif expr.op == "&":
+            return left & right
+        elif expr.op == "|":
+            return left | right
+        elif expr.op == "^":
+            return left ^ right
+        elif expr.op == "<<" and 0 <= right <= MAX_FOLDED_SHIFT:
+            return left << right
+    return None
+
+# Returns a dictionary of the const directives of a program that evaluate to integers
+def program_consts(program):
+    consts = {}
+    for name, expr in program.const_directives:
+        value = const_value(expr, consts)
+        if value is not None:
+            consts[name] = value
+    return consts
+
+# Class resolving the type of expressions within a function.
+# Registers have their declared type, const directives and integer literals are word8,
+# and any other name (labels, functions, imports) is a ptr.
+class ExprTyper:
+    def __init__(self, regs, consts, target=MERCURY):
+        self.regs = regs
+        self.consts = consts
+        self.target = target
+
+    def type_of(self, expr):
+        if isinstance(expr, ConstExpression):
+            if expr.const_node.type == ConstantNode.T_SCONST:
+                return "word8"
+            elif expr.const_node.type == ConstantNode.T_STRING:
+                return "ptr"
+            name = expr.const_node.data
+            if name in self.regs:
+                return self.regs[name]
+            return "word8" if name in self.consts else "ptr"
+        elif isinstance(expr, (MemReadExpression, UCastExpression, SCastExpression)):
+            return expr.type
+        elif isinstance(expr, BinaryExpression):
+            return self.target.wider(self.type_of(expr.left), self.type_of(expr.right))
+        elif isinstance(expr, UnaryExpression):
+            return self.type_of(expr.value)
+        raise Exception(f"[OPT]: Cannot type unknown expression '{expr}'")
+
+    # Types an expression and all of its subexpressions in a single walk, stores the type of every
+    # node in its 'resolved_type' and returns the type of the expression.
+    # Backends annotate the expressions of a function before lowering it, then read the width of
+    # any node back without typing its subexpressions again. They do so even after a TypeChecker
+    # run, as passes running in between add and replace nodes.
+    def annotate(self, expr):
+        if isinstance(expr, BinaryExpression):
+            type = self.target.wider(self.annotate(expr.left), self.annotate(expr.right))
+        elif isinstance(expr, UnaryExpression):
+            type = self.annotate(expr.value)
+        else:
+            for sub in sub_exprs(expr):
+                self.annotate(sub)
+            type = self.type_of(expr)
+        expr.resolved_type = type
+        return type
+
+    # Annotates every expression of a block, including those of nested blocks
+    def annotate_block(self, stmts):
+        for stmt in walk_stmts(stmts):
+            for expr in stmt_exprs(stmt):
+                self.annotate(expr)
+
+# Class computing how many low words of the value of every expression are used.
+# Assignments, writes and returns truncate their value to their type, and the low words of
+# additions, subtractions, multiplications, bitwise operators, negations, left shifts (of their
+# left operand) and unsigned casts only depend on the low words of their operands, so a value
+# only consumed through those is needed up to the words its consumer keeps. Every other use,
+# such as comparisons, divisions, right shifts, arguments and addresses, reads the whole value.
+class WordDemand:
+    LOW_WORD_OPS = ["+", "-", "*", "&", "|", "^", "~&", "~|", "~^"]
+
+    def __init__(self, typer, target=MERCURY):
+        self.typer = typer
+        self.target = target
+
+    # Returns the expressions evaluated by a statement, with the number of words used by it
+    def stmt_demands(self, stmt, funct_type):
+        words = lambda expr: self.target.words(self.typer.type_of(expr))
+        if isinstance(stmt, DefStatement):
+            return [(stmt.expr, self.target.words(self.typer.regs[stmt.name]) if stmt.name in self.typer.regs else words(stmt.expr))]
+        elif isinstance(stmt, MemWriteStatement):
+            return [(stmt.addr_expr, self.target.words("ptr")), (stmt.val_expr, self.target.words(stmt.type))]
+        elif isinstance(stmt, ReturnStatement) and stmt.expr is not None and funct_type is not None:
+            return [(stmt.expr, self.target.words(funct_type))]
+        return [(expr, words(expr)) for expr in stmt_exprs(stmt)]
+
+    # Stores in 'demands' the words used of an expression and of its subexpressions, by id.
+    # Subexpressions of the expressions whose id is in 'whole' are computed at their full width.
+    def expr(self, expr, words, demands, whole=()):
+        type = self.typer.type_of(expr)
+        words = min(words, self.target.words(type))
+        demands[id(expr)] = max(words, demands.get(id(expr), 0))
+        if id(expr) in whole:
+            words = self.target.words(type)
+
+        if isinstance(expr, MemReadExpression):
+            self.expr(expr.addr_expr, self.target.words("ptr"), demands, whole)
+        elif isinstance(expr, UCastExpression):
+            self.expr(expr.expr, words, demands, whole)
+        elif isinstance(expr, SCastExpression):
+            inner = self.target.words(self.typer.type_of(expr.expr))
+            self.expr(expr.expr, inner if self.target.words(expr.type) > inner else words, demands, whole)
+        elif isinstance(expr, UnaryExpression):
+            self.expr(expr.value, words, demands, whole)
+        elif isinstance(expr, BinaryExpression):
+            if expr.op in WordDemand.LOW_WORD_OPS:
+                self.expr(expr.left, words, demands, whole)
+                self.expr(expr.right, words, demands, whole)
+            elif expr.op == "<<":
+                self.expr(expr.left, words, demands, whole)
+                self.expr(expr.right, self.target.words("word8"), demands, whole)
+            else:
+                self.expr(expr.left, self.target.words("word8"), demands, whole)
+                self.expr(expr.right, self.target.words("word8"), demands, whole)
+
+    # Returns the narrowest type holding a number of words, or 'type' if it is not wider
+    def narrowed(self, type, words):
+        if words >= self.target.words(type):
+            return type
+        return next(narrow for narrow in self.target.TYPES if self.target.words(narrow) >= words)
+
+# Strength reduction pass.
+# Rewrites multiplications, divisions and modulos by constants into shifts, masks and additions.
+# Operators compute at the width of the wider operand, with narrower operands zero-extended,
+# and signed operators read that width as two's complement. Rewrites keep that width by typing
+# every constant they introduce, so the result is bit-for-bit identical.
+class StrengthReduction:
+    def __init__(self, program, target=MERCURY):
+        self.program = program
+        self.target = target
+        self.reductions = 0
+        self.consts = program_consts(program)
+
+    # Runs the pass over every function and returns the number of rewritten operators
+    @sirinstr.timed("strength-reduction")
+    def run(self):
+        for funct in self.program.function_decls:
+            regs = register_types(funct)
+            consts = {name: value for name, value in self.consts.items() if name not in regs}
+            self.typer = ExprTyper(regs, consts, self.target)
+            for stmt in walk_stmts(funct.stmts):
+                map_stmt_exprs(stmt, self.__reduce)
+        return self.reductions
+
+    def __reduce(self, expr):
+        if isinstance(expr, MemReadExpression):
+            expr.addr_expr = self.__reduce(expr.addr_expr)
+        elif isinstance(expr, (UCastExpression, SCastExpression)):
+            expr.expr = self.__reduce(expr.expr)
+        elif isinstance(expr, UnaryExpression):
+            expr.value = self.__reduce(expr.value)
+        elif isinstance(expr, BinaryExpression):
+            expr.left = self.__reduce(expr.left)
+            expr.right = self.__reduce(expr.right)
+            if expr.op in ["*", "/", "%", "/$", "%$"]:
+                reduced = self.__reduce_binary(expr)
+                if reduced is not None:
+                    self.reductions += 1
+                    return reduced
+        return expr
+
+    # Returns the rewritten expression, or None if no cheaper form is known
+    def __reduce_binary(self, expr):
+        type = self.typer.type_of(expr)
+        bits = self.target.bits(type)
+        mask = self.target.mask(type)
+
+        x = expr.left
+        c = self.__const(expr.right)
+        if c is None and expr.op == "*":
+            x = expr.right
+            c = self.__const(expr.left)
+        if c is None:
+            return None
+        c &= mask
+
+        if expr.op == "*":
+            if c == 0:
+                return int_expr(0, type)
+            elif c == 1:
+                return self.__widen(x, type)
+            elif self.__log2(c) is not None:
+                return self.__shl(x, self.__log2(c), type)
+            elif self.__log2(mask + 1 - c) is not None: # Negative power of two
+                return UnaryExpression("-", self.__shl(x, self.__log2(mask + 1 - c), type))
+            elif not self.__is_leaf(x): # Decompositions below evaluate x twice
+                return None
+            elif bin(c).count("1") == 2: # 2^a + 2^b
+                high = c.bit_length() - 1
+                low = self.__log2(c & -c)
+                return BinaryExpression(self.__shl(x, high, type), "+", self.__shl(copy_expr(x), low, type))
+            elif self.__log2(c + 1) is not None: # 2^k - 1
+                return BinaryExpression(self.__shl(x, self.__log2(c + 1), type), "-", self.__widen(copy_expr(x), type))
+            return None
+
+        elif expr.op in ["/", "%"]:
+            k = self.__log2(c)
+            if k is None:
+                return None
+            if expr.op == "/":
+                return self.__widen(x, type) if k == 0 else BinaryExpression(x, ">>", int_expr(k, type))
+            return BinaryExpression(x, "&", int_expr(c - 1, type))
+
+        # Signed operators read the divisor as a two's complement value
+        divisor = c - (mask + 1) if c >> (bits - 1) else c
+        k = self.__log2(abs(divisor))
+        if k is None or k >= bits - 1:
+            return None
+        if k > 0 and not self.__is_leaf(x): # Rounding below evaluates x twice
+            return None
+
+        if expr.op == "/$":
+            if k == 0:
+                quotient = self.__widen(x, type)
+            else:
+                quotient = BinaryExpression(self.__biased(x, k, type), ">>$", int_expr(k, type))
+            return UnaryExpression("-", quotient) if divisor < 0 else quotient
+
+        # Remainder keeps the sign of the dividend, whatever the sign of the divisor
+        if k == 0:
+            return int_expr(0, type)
+        rounded = BinaryExpression(self.__biased(x, k, type), "&", int_expr(mask & ~((1 << k) - 1), type))
+        return BinaryExpression(self.__widen(copy_expr(x), type), "-", rounded)
+
+    # Returns the value of a constant operand, including constants narrowed by a cast
+    def __const(self, expr):
+        if isinstance(expr, (UCastExpression, SCastExpression)):
+            value = self.__const(expr.expr)
+            if value is None or self.target.words(expr.type) > self.target.words(self.typer.type_of(expr.expr)):
+                return None
+            return value & self.target.mask(expr.type)
+        return const_value(expr, self.typer.consts)
+
+    # Returns 'x + bias', where bias is 2^k - 1 if x is negative and 0 otherwise.
+    # Adding it before an arithmetic shift rounds towards zero like signed division.
+    def __biased(self, x, k, type):
+        bits = self.target.bits(type)
+        sign = BinaryExpression(copy_expr(x), ">>$", int_expr(bits - 1, type))
+        bias = BinaryExpression(sign, ">>", int_expr(bits - k, type))
+        return BinaryExpression(x, "+", bias)
+
+    def __shl(self, x, k, type):
+        if k == 0:
+            return self.__widen(x, type)
+        return BinaryExpression(x, "<<", int_expr(k, type))
+
+    # Zero-extends x to a type if it is narrower, like an operator would
+    def __widen(self, x, type):
+        if self.target.words(self.typer.type_of(x)) < self.target.words(type):
+            return UCastExpression(type, x)
+        return x
+
+    def __is_leaf(self, expr):
+        return isinstance(expr, ConstExpression)
+
+    def __log2(self, value):
+        if value > 0 and value & (value - 1) == 0:
+            return value.bit_length() - 1
+        return None
+
+# Candidate expression for common subexpression elimination
+class _Candidate:
+    def __init__(self, expr, key):
+        self.expr = expr
+        self.key = key
+        self.names = expr_names(expr)
+        self.reads_memory = expr_reads_memory(expr)
+        self.reuses = 0
+        self.words = 0 # Words used by the widest use of the expression
+        self.temp = None
+
+# Common subexpression elimination pass.
+# Computes an expression once into a register temporary and reuses it while it stays available.
+# An expression stops being available when a register it reads is assigned, and when memory is
+# written by a memory write or a call if it reads memory.
+# LOCAL scope only reuses expressions within straight-line code, while GLOBAL scope also reuses
+# expressions computed before an if statement in its blocks, and after it if both blocks keep them.
+class CommonSubexpressionElimination:
+    S_LOCAL = "LOCAL"
+    S_GLOBAL = "GLOBAL"
+    TEMP_PREFIX = ".cse"
+
+    def __init__(self, program, target=MERCURY, scope=S_GLOBAL):
+        self.program = program
+        self.target = target
+        self.scope = scope
+        self.eliminated = 0
+        self.consts = program_consts(program)
+
+    # Runs the pass over every function and returns the number of eliminated expressions
+    @sirinstr.timed("cse")
+    def run(self):
+        for funct in self.program.function_decls:
+            self.__function(funct)
+        return self.eliminated
+
+    def __function(self, funct):
+        regs = register_types(funct)
+        consts = {name: value for name, value in self.consts.items() if name not in regs}
+        self.typer = ExprTyper(regs, consts, self.target)
+        self.occurrences = {} # id(expr) -> candidate
+        self.generated = {} # id(stmt) -> candidates first computed by the statement
+
+        self.__analyze_block(funct.stmts, {})
+
+        # Temporaries only keep the words their uses read, so that a sum of a word1 register and
+        # a word8 literal assigned to word1 registers is held in a word1 temporary
+        reused = {key for key, candidate in self.occurrences.items() if candidate.reuses > 0}
+        demand = WordDemand(self.typer, self.target)
+        demands = {}
+        for stmt in walk_stmts(funct.stmts):
+            for expr, words in demand.stmt_demands(stmt, funct.type):
+                demand.expr(expr, words, demands, reused)
+        for key in reused:
+            candidate = self.occurrences[key]
+            candidate.words = max(candidate.words, demands[key])
+
+        # Name and declare the temporaries of every reused candidate
+        used_names = function_names(funct)
+        decls = {}
+        count = 0
+        for candidates in self.generated.values():
+            for candidate in candidates:
+                if candidate.reuses == 0:
+                    continue
+                while f"{CommonSubexpressionElimination.TEMP_PREFIX}{count}" in used_names:
+                    count += 1
+                candidate.temp = f"{CommonSubexpressionElimination.TEMP_PREFIX}{count}"
+                count += 1
+                self.eliminated += candidate.reuses
+                type = demand.narrowed(self.typer.type_of(candidate.expr), candidate.words)
+                if type not in decls:
+                    decls[type] = DeclStatement(type)
+                decls[type].names.append(candidate.temp)
+
+        if decls:
+            funct.stmts = list(decls.values()) + self.__rewrite_block(funct.stmts)
+
+    # Finds the first computation and the reuses of every expression in a block.
+    # 'avail' maps expression keys to available candidates and is updated in place.
+    def __analyze_block(self, stmts, avail):
+        for stmt in stmts:
+            generated = []
+            for expr in stmt_exprs(stmt):
+                self.__analyze_expr(expr, avail, generated)
+            self.generated[id(stmt)] = generated
+
+            if isinstance(stmt, DefStatement):
+                self.__kill(avail, name=stmt.name)
+            elif isinstance(stmt, MemWriteStatement):
+                self.__kill(avail, memory=True)
+            elif isinstance(stmt, CallStatement):
+                self.__kill(avail, name=stmt.ret_register, memory=True)
+            elif isinstance(stmt, (LabelNode, GotoStatement, JumpStatement, ReturnStatement)):
+                avail.clear() # Labels are reached from unknown gotos, code after a transfer from labels
+            elif isinstance(stmt, (IfStatement, SwitchStatement)):
+                branches = []
+                for block in sub_blocks(stmt):
+                    branch_avail = dict(avail) if self.scope == CommonSubexpressionElimination.S_GLOBAL else {}
+                    self.__analyze_block(block, branch_avail)
+                    branches.append(branch_avail)
+                merged = {key: candidate for key, candidate in branches[0].items()
+                          if all(other.get(key) is candidate for other in branches[1:])}
+                avail.clear()
+                if self.scope == CommonSubexpressionElimination.S_GLOBAL:
+                    avail.update(merged)
+
+    def __analyze_expr(self, expr, avail, generated):
+        if isinstance(expr, ConstExpression):
+            return
+        key = expr_key(expr)
+        if key in avail:
+            candidate = avail[key]
+            candidate.reuses += 1
+            self.occurrences[id(expr)] = candidate
+            return
+        for sub in sub_exprs(expr):
+            self.__analyze_expr(sub, avail, generated)
+        candidate = _Candidate(expr, key)
+        avail[key] = candidate
+        self.occurrences[id(expr)] = candidate
+        generated.append(candidate)
+
+    def __kill(self, avail, name=None, memory=False):
+        for key, candidate in list(avail.items()):
+            if (name is not None and name in candidate.names) or (memory and candidate.reads_memory):
+                del avail[key]
+
+    # Rewrites a block, computing reused candidates into their temporaries
+    def __rewrite_block(self, stmts):
+        result = []
+        for stmt in stmts:
+            for candidate in self.generated.get(id(stmt), []):
+                if candidate.temp is not None:
+                    result.append(DefStatement(candidate.temp, self.__rewrite_subs(candidate.expr)))
+            map_stmt_exprs(stmt, self.__rewrite_expr)
+            if isinstance(stmt, IfStatement):
+                stmt.if_block = self.__rewrite_block(stmt.if_block)
+                stmt.else_block = self.__rewrite_block(stmt.else_block)
+            elif isinstance(stmt, SwitchStatement):
+                stmt.cases = [(value, self.__rewrite_block(block)) for value, block in stmt.cases]
+                stmt.default_block = self.__rewrite_block(stmt.default_block)
+            result.append(stmt)
+        return result
+
+    def __rewrite_expr(self, expr):
+        candidate = self.occurrences.get(id(expr))
+        if candidate is not None and candidate.temp is not None:
+            return name_expr(candidate.temp)
+        return self.__rewrite_subs(expr)
+
+    def __rewrite_subs(self, expr):
+        if isinstance(expr, MemReadExpression):
+            expr.addr_expr = self.__rewrite_expr(expr.addr_expr)
+        elif isinstance(expr, (UCastExpression, SCastExpression)):
+            expr.expr = self.__rewrite_expr(expr.expr)
+        elif isinstance(expr, BinaryExpression):
+            expr.left = self.__rewrite_expr(expr.left)
+            expr.right = self.__rewrite_expr(expr.right)
+        elif isinstance(expr, UnaryExpression):
+            expr.value = self.__rewrite_expr(expr.value)
+        return expr
+
+# Tail call pass.
+# Turns calls whose result is immediately returned into jumps, which reuse the caller's frame,
+# and turns jumps of a function to itself into loops back to the start of its body.
+# Calls are only turned into jumps when they use the function's own convention and return type.
+class TailCallElimination:
+    CALLER_CLEANUP_CONVENTIONS = ["C"] # Jumps must keep the argument words under these conventions
+    LOOP_LABEL = ".tailrec"
+    TEMP_PREFIX = ".tail"
+
+    def __init__(self, program, target=MERCURY):
+        self.program = program
+        self.target = target
+        self.jumps = 0
+        self.loops = 0
+        self.rewritten = 0 # A call turned into a jump, then into a loop, counts once
+        self.consts = program_consts(program)
+        self.functions = {funct.name: funct for funct in program.function_decls}
+
+    # Runs the pass over every function and returns the number of rewritten calls and jumps
+    @sirinstr.timed("tail-calls")
+    def run(self):
+        for funct in self.program.function_decls:
+            self.regs = register_types(funct)
+            self.typer = ExprTyper(self.regs, {name: value for name, value in self.consts.items() if name not in self.regs}, self.target)
+            self.funct = funct
+            self.new_jumps = set()
+            funct.stmts = self.__tail_calls(funct.stmts, True)
+            self.__self_jumps(funct)
+        return self.rewritten
+
+    # Rewrites the tail calls of a block.
+    # 'tail' tells whether the end of the block returns from the function.
+    def __tail_calls(self, stmts, tail):
+        result = []
+        skip = False
+        for i, stmt in enumerate(stmts):
+            last = i == len(stmts) - 1
+            if skip: # Return made unreachable by a jump
+                skip = False
+                continue
+            if isinstance(stmt, IfStatement):
+                stmt.if_block = self.__tail_calls(stmt.if_block, tail and last)
+                stmt.else_block = self.__tail_calls(stmt.else_block, tail and last)
+            elif isinstance(stmt, SwitchStatement):
+                stmt.cases = [(value, self.__tail_calls(block, tail and last)) for value, block in stmt.cases]
+                stmt.default_block = self.__tail_calls(stmt.default_block, tail and last)
+            elif isinstance(stmt, CallStatement) and self.__returns_result(stmt, stmts[i + 1] if not last else None, tail and last):
+                jump = JumpStatement(stmt.funct_expr)
+                jump.convention = stmt.convention
+                jump.args = stmt.args
+                self.jumps += 1
+                self.rewritten += 1
+                self.new_jumps.add(id(jump))
+                result.append(jump)
+                skip = not last
+                continue
+            result.append(stmt)
+        return result
+
+    # Returns whether a call is followed by a return of its result and can become a jump
+    def __returns_result(self, call, next, ends_function):
+        funct = self.funct
+        if call.convention != funct.convention or call.type != funct.type:
+            return False
+        if funct.convention in TailCallElimination.CALLER_CLEANUP_CONVENTIONS and self.__arg_words(call) != sum(self.target.words(self.regs[name]) for _, name in funct.fargs):
+            return False
+
+        if call.ret_register is None:
+            if funct.type is not None:
+                return False
+            return ends_function if next is None else isinstance(next, ReturnStatement) and next.expr is None
+
+        if not isinstance(next, ReturnStatement) or next.expr is None:
+            return False
+        expr = next.expr
+        if not (isinstance(expr, ConstExpression) and expr.const_node.type == ConstantNode.T_NAME and expr.const_node.data == call.ret_register):
+            return False
+        # The result must reach the return unchanged through its register
+        register_type = self.regs.get(call.ret_register)
+        return register_type is not None and self.target.words(register_type) >= self.target.words(call.type)
+
+    # Returns the number of argument words a call passes, as the backends lay them out: at the
+    # width of the parameters of the called function if it is one of the program's, and at the
+    # width of their own type otherwise
+    def __arg_words(self, call):
+        callee = None
+        expr = call.funct_expr
+        static_labels = set()
+        if self.funct.staticdata:
+            static_labels.update(datum.name for datum in self.funct.staticdata.data if isinstance(datum, LabelNode))
+        if isinstance(expr, ConstExpression) and expr.const_node.type == ConstantNode.T_NAME and expr.const_node.data not in self.regs and expr.const_node.data not in static_labels:
+            callee = self.functions.get(expr.const_node.data)
+        words = 0
+        for i, arg in enumerate(call.args):
+            type = callee.fargs[i][0] if callee is not None and i < len(callee.fargs) else self.typer.type_of(arg)
+            words += self.target.words(type)
+        return words
+
+    # Turns jumps of a function to itself into assignments of its arguments and a goto
+    def __self_jumps(self, funct):
+        if funct.name in self.regs:
+            return # The function's name is shadowed by a register
+        jumps = [stmt for stmt in walk_stmts(funct.stmts) if isinstance(stmt, JumpStatement) and self.__is_self(stmt)]
+        if not jumps:
+            return
+
+        used_names = function_names(funct)
+        label = TailCallElimination.LOOP_LABEL
+        while label in used_names:
+            label += "_"
+        self.temps = {}
+        self.used_names = used_names
+
+        funct.stmts = [LabelNode(label)] + self.__replace_jumps(funct.stmts, label)
+        decls = {}
+        for name, type in self.temps.values():
+            decls.setdefault(type, DeclStatement(type)).names.append(name)
+        funct.stmts = list(decls.values()) + funct.stmts
+
+    def __is_self(self, jump):
+        expr = jump.funct_expr
+        return (jump.convention == self.funct.convention
+                and len(jump.args) == len(self.funct.fargs)
+                and isinstance(expr, ConstExpression) and expr.const_node.type == ConstantNode.T_NAME
+                and expr.const_node.data == self.funct.name)
+
+    def __replace_jumps(self, stmts, label):
+        result = []
+        for stmt in stmts:
+            if isinstance(stmt, IfStatement):
+                stmt.if_block = self.__replace_jumps(stmt.if_block, label)
+                stmt.else_block = self.__replace_jumps(stmt.else_block, label)
+            elif isinstance(stmt, SwitchStatement):
+                stmt.cases = [(value, self.__replace_jumps(block, label)) for value, block in stmt.cases]
+                stmt.default_block = self.__replace_jumps(stmt.default_block, label)
+            elif isinstance(stmt, JumpStatement) and self.__is_self(stmt):
+                result.extend(self.__assign_args(stmt.args))
+                result.append(GotoStatement(label))
+                self.loops += 1
+                if id(stmt) not in self.new_jumps:
+                    self.rewritten += 1
+                continue
+            result.append(stmt)
+        return result
+
+    # Returns the statements assigning new values to the formal arguments, as if all at once.
+    # Values reading an argument assigned before them are first computed into temporaries.
+    def __assign_args(self, args):
+        pending = []
+        for (type, name), arg in zip(self.funct.fargs, args):
+            if isinstance(arg, ConstExpression) and arg.const_node.type == ConstantNode.T_NAME and arg.const_node.data == name:
+                continue # Unchanged
+            pending.append((type, name, arg))
+
+        temps, stmts = [], []
+        for i, (type, name, arg) in enumerate(pending):
+            if expr_names(arg) & {other for _, other, _ in pending[:i]}:
+                temp = self.__temp(name, type)
+                temps.append(DefStatement(temp, arg))
+                stmts.append(DefStatement(name, name_expr(temp)))
+            else:
+                stmts.append(DefStatement(name, arg))
+        return temps + stmts
+
+    def __temp(self, name, type):
+        if name not in self.temps:
+            temp = f"{TailCallElimination.TEMP_PREFIX}.{name}"
+            while temp in self.used_names:
+                temp += "_"
+            self.used_names.add(temp)
+            self.temps[name] = (temp, type)
+        return self.temps[name][0]
@@ -1,4 +1,5 @@
-from sirlex import Token
+import sirinstr
+from sirlex import Token, Diagnostic, _RecoverableError
 
 class ProgramNode:
     def __init__(self):
@@ -115,99 +116,174 @@ class CallStatement:
 class ReturnStatement:
     def __init__(self):
         self.expr = None
+class SwitchStatement: # Produced by optimization passes, not by the parser
+    def __init__(self, expr=None):
+        self.expr = expr
+        self.cases = [] # (value, block) pairs, sorted by value
+        self.default_block = []
 
+# Expressions are the most numerous nodes, so their fields are slots rather than a dictionary.
+# They hold the type resolved by ExprTyper.annotate in 'resolved_type', None until annotated.
 class ConstExpression:
+    __slots__ = ("const_node", "resolved_type")
     def __init__(self, const_node):
         self.const_node = const_node
+        self.resolved_type = None
 class MemReadExpression:
+    __slots__ = ("type", "addr_expr", "resolved_type")
     def __init__(self, type, addr_expr):
         self.type = type
         self.addr_expr = addr_expr
+        self.resolved_type = None
 class UCastExpression:
+    __slots__ = ("type", "expr", "resolved_type")
     def __init__(self, type, expr):
         self.type = type
         self.expr = expr
+        self.resolved_type = None
 class SCastExpression:
+    __slots__ = ("type", "expr", "resolved_type")
     def __init__(self, type, expr):
         self.type = type
         self.expr = expr
+        self.resolved_type = None
 class BinaryExpression:
+    __slots__ = ("left", "op", "right", "resolved_type")
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
         self.right = right
+        self.resolved_type = None
 class UnaryExpression:
+    __slots__ = ("op", "value", "resolved_type")
     def __init__(self, op, value):
         self.op = op
         self.value = value
-
+        self.resolved_type = None
+
+# Class representing an active parser.
+# Expects the tokens of a lexer, and optionally the name of their file and the instrumentation
+# recording its work (the active one by default).
+# By default, the first syntax error raises an exception. In recovery mode, every error is
+# recorded in 'diagnostics' and parsing resumes at the next ';', '}' or top level directive,
+# leaving out the statement, datum or directive in error. The returned program is then partial.
 class ASTParser:
-    def __init__(self, tokens):
+    # Keywords only found at the start of a top level directive
+    DIRECTIVE_KEYWORDS = ["const", "data", "export", "import"]
+
+    def __init__(self, tokens, filename=None, instr=None, recover=False):
         self.tokens = tokens
         self.pos = 0
         self.current_token = self.tokens[self.pos]
-
-    def __error(self, text):
-        raise Exception(f"[PARSER]: An error occured while parsing.\n{text}")
+        self.filename = filename
+        self.instr = instr or sirinstr.active()
+        self.recover = recover
+        self.diagnostics = []
+        self.error_pos = -1 # Token of the last diagnostic
+
+    # Reports an error at a token, the current one by default.
+    # In recovery mode, an error is only recorded once per token, as errors cascade from one
+    # construct to those enclosing it.
+    def __report(self, code, text, token=None):
+        token = token or self.current_token
+        if not self.recover:
+            raise Exception(f"[PARSER]: An error occured while parsing.\n{token.linenum},{token.linepos}: {text}")
+        if self.pos != self.error_pos:
+            self.error_pos = self.pos
+            self.diagnostics.append(Diagnostic(code, text, token.offset, token.linenum, token.linepos, self.filename))
+            self.instr.count("diagnostics", code)
+
+    # Reports an error and abandons the construct being parsed
+    def __error(self, code, text, token=None):
+        self.__report(code, text, token)
+        raise _RecoverableError()
+
+    # Returns the type of the token following the current one
+    def __peek(self):
+        if self.pos + 1 < len(self.tokens):
+            return self.tokens[self.pos+1].type
+        return Token.T_EOF
+
+    def __advance(self):
+        self.pos += 1
+        if self.pos < len(self.tokens):
+            self.current_token = self.tokens[self.pos]
+        else:
+            self.current_token = None
 
     # Assert that the next token is of a certain type
     def __eat(self, token_type, token_value=None):
         if self.current_token.type == token_type:
             if token_value and self.current_token.value != token_value:
-                self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: Expected '{token_value}' of type {token_type}, got '{self.current_token.value}'")
-            self.pos += 1
-            if self.pos < len(self.tokens):
-                self.current_token = self.tokens[self.pos]
-            else:
-                self.current_token = None
+                self.__error("P001", f"Expected '{token_value}' of type {token_type}, got '{self.current_token.value}'")
+            self.__advance()
         else:
-            self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: Expected type '{token_type}', got '{self.current_token.type}'")
+            self.__error("P002", f"Expected type '{token_type}', got '{self.current_token.type}'")
 
     # Tries parsing a top level program.
     # Returns a program node.
     def program(self):
+        with self.instr.phase("parse", self.filename):
+            node = self.__program()
+
+        if self.instr.enabled:
+            counts = {}
+            for child in sirinstr.ast_nodes(node):
+                counts[type(child).__name__] = counts.get(type(child).__name__, 0) + 1
+            self.instr.count_all("nodes by class", counts)
+        return node
+
+    def __program(self):
         node = ProgramNode()
 
-        while True:
-            token = self.current_token
-            if token.type == Token.T_EOF:
-                return node
-            
-            elif token.type == Token.T_KEYWORD:
-                if token.value == "data": # Try getting a data directive if 'data' appears
-                    node.data_directives.append(self.__data())
-                    
-                elif token.value == "const": # Try getting a const directive if 'const' appears
-                    self.__eat(Token.T_KEYWORD)
-                    name = self.current_token.value
-                    self.__eat(Token.T_NAME)
-                    self.__eat(Token.T_ASSIGN)
-                    value = self.__expr()
-                    self.__eat(Token.T_SEMICOLON)
-                    node.const_directives.append((name, value))
-                    
-                elif token.value == "import": # Try getting an import directive if 'import' appears
-                    self.__eat(Token.T_KEYWORD)
-                    node.imports.extend(self.__namelist())
-                    self.__eat(Token.T_SEMICOLON)
-                    
-                elif token.value == "export": # Try getting an export directive if 'export' appears
-                    self.__eat(Token.T_KEYWORD)
-                    isWeak = False
-                    if self.current_token.type == Token.T_KEYWORD and self.current_token.value == "weak":
-                        isWeak = True
-                        self.__eat(Token.T_KEYWORD)
-                    node.exports.extend(map(lambda name: (name, isWeak), self.__namelist()))
-                    self.__eat(Token.T_SEMICOLON)
+        while self.current_token.type != Token.T_EOF:
+            start = self.pos
+            try:
+                self.__directive(node)
+            except _RecoverableError: # Only raised in recovery mode
+                self.__synchronize(True)
+                if self.pos == start:
+                    self.__advance()
+        return node
+
+    # Parses a top level directive or function declaration into a program node
+    def __directive(self, node):
+        token = self.current_token
+        if token.type == Token.T_KEYWORD:
+            if token.value == "data": # Try getting a data directive if 'data' appears
+                node.data_directives.append(self.__data())
+                
+            elif token.value == "const": # Try getting a const directive if 'const' appears
+                self.__eat(Token.T_KEYWORD)
+                name = self.current_token.value
+                self.__eat(Token.T_NAME)
+                self.__eat(Token.T_ASSIGN)
+                value = self.__expr()
+                self.__eat(Token.T_SEMICOLON)
+                node.const_directives.append((name, value))
                 
-                elif token.value == "foreign": # Try getting a function declaration if 'foreign' appears
-                    node.function_decls.append(self.__functdecl())
+            elif token.value == "import": # Try getting an import directive if 'import' appears
+                self.__eat(Token.T_KEYWORD)
+                node.imports.extend(self.__namelist())
+                self.__eat(Token.T_SEMICOLON)
                 
-                else:
-                    self.__error(f"{token.linenum},{token.linepos}: Got unexpected keyword '{token.value}'")
-                    
-            else: # Otherwise it must be a function declaration
+            elif token.value == "export": # Try getting an export directive if 'export' appears
+                self.__eat(Token.T_KEYWORD)
+                isWeak = False
+                if self.current_token.type == Token.T_KEYWORD and self.current_token.value == "weak":
+                    isWeak = True
+                    self.__eat(Token.T_KEYWORD)
+                node.exports.extend(map(lambda name: (name, isWeak), self.__namelist()))
+                self.__eat(Token.T_SEMICOLON)
+            
+            elif token.value == "foreign": # Try getting a function declaration if 'foreign' appears
                 node.function_decls.append(self.__functdecl())
+            
+            else:
+                self.__error("P003", f"Got unexpected keyword '{token.value}'")
+                
+        else: # Otherwise it must be a function declaration
+            node.function_decls.append(self.__functdecl())
 
     def __functdecl(self):
         node = FunctionDeclNode()
@@ -246,7 +322,15 @@ class ASTParser:
         self.__eat(Token.T_KEYWORD, "data")
         self.__eat(Token.T_LBRACE)
         while not (self.current_token.type == Token.T_RBRACE):
-            node.data.append(self.__datum())
+            if not self.recover:
+                node.data.append(self.__datum())
+            elif self.__at_directive():
+                self.__report("P011", f"Expected '}}' closing data directive, got '{self.current_token.value or 'EOF'}'")
+                return node
+            else:
+                datum = self.__recovering(self.__datum)
+                if datum is not None:
+                    node.data.append(datum)
         self.__eat(Token.T_RBRACE)
         return node
 
@@ -275,9 +359,9 @@ class ASTParser:
             
             if self.current_token.type == Token.T_STR: # Get string
                 if type != "word1":
-                    self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: String in data declaration expected type 'word1', got type '{type}'")
+                    self.__error("P004", f"String in data declaration expected type 'word1', got type '{type}'")
                 if node.allocsize != None:
-                    self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: String in data declaration expected empty allocation size, got expression.")
+                    self.__error("P005", "String in data declaration expected empty allocation size, got expression.")
                 node.data.extend([ConstExpression(ConstantNode(ConstantNode.T_SCONST, x)) for x in self.current_token.value])
                 node.data.append(ConstExpression(ConstantNode(ConstantNode.T_SCONST, 0))) # Append a final 0
                 self.__eat(Token.T_STR)
@@ -289,7 +373,7 @@ class ASTParser:
             
             else:
                 if node.allocsize == None:
-                    self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: Datum allocation size must be explicitly stated, got empty allocation.")
+                    self.__error("P006", "Datum allocation size must be explicitly stated, got empty allocation.")
             
             if node.allocsize == None:
                 node.allocsize = ConstExpression(ConstantNode(ConstantNode.T_SCONST, max(1, len(node.data))))
@@ -298,7 +382,7 @@ class ASTParser:
             return node
         
         else:
-            self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: Got unexpected symbol '{self.current_token}'.")
+            self.__error("P007", f"Got unexpected symbol '{self.current_token}'.")
 
     def __label(self):
         name = self.current_token.value
@@ -319,7 +403,7 @@ class ASTParser:
             self.__eat(Token.T_STR)
             type = ConstantNode.T_STRING
         else:
-            self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: Expected constant, got '{self.current_token.type}'")
+            self.__error("P008", f"Expected constant, got '{self.current_token.type}'")
         return ConstantNode(type, value)
 
     def __conv(self):
@@ -334,12 +418,66 @@ class ASTParser:
         stmts = []
         self.__eat(Token.T_LBRACE)
         while self.current_token.type != Token.T_RBRACE:
-            stmts.append(self.__stmt())
+            if not self.recover:
+                stmts.append(self.__stmt())
+            elif self.__at_directive():
+                self.__report("P011", f"Expected '}}' closing block, got '{self.current_token.value or 'EOF'}'")
+                return stmts
+            else:
+                stmt = self.__recovering(self.__stmt)
+                if stmt is not None:
+                    stmts.append(stmt)
         self.__eat(Token.T_RBRACE)
         return stmts
 
+    ## Recovery ##
+
+    # Returns whether the current token ends the file or starts a top level directive,
+    # which never appear within a block or data directive
+    def __at_directive(self):
+        token = self.current_token
+        return token.type == Token.T_EOF or (token.type == Token.T_KEYWORD and token.value in ASTParser.DIRECTIVE_KEYWORDS)
+
+    # Parses a statement or datum, returning None if it is in error and has been skipped
+    def __recovering(self, parse):
+        try:
+            return parse()
+        except _RecoverableError:
+            self.__synchronize(False)
+            return None
+
+    # Skips the tokens of a construct in error, up to a point parsing can resume at:
+    # after the ';' or the braced blocks ending it, or at a top level directive. At the
+    # top level, a '}' closing the block being skipped is consumed and 'foreign' starts a
+    # function declaration. Within a block, a '}' closing it is left for the block to eat.
+    def __synchronize(self, top_level):
+        depth = 0
+        while not self.__at_directive():
+            token = self.current_token
+            if top_level and depth == 0 and token.type == Token.T_KEYWORD and token.value == "foreign":
+                return
+            if token.type == Token.T_SEMICOLON and depth == 0:
+                self.__advance()
+                return
+            if token.type == Token.T_LBRACE:
+                depth += 1
+            elif token.type == Token.T_RBRACE:
+                if depth == 0:
+                    if top_level:
+                        self.__advance()
+                    return
+                depth -= 1
+                if depth == 0:
+                    self.__advance()
+                    # An if block in error is skipped with its else block
+                    if self.current_token.type == Token.T_KEYWORD and self.current_token.value == "else":
+                        continue
+                    return
+            self.__advance()
+
     def __stmt(self):
         if self.current_token.type == Token.T_KEYWORD:
+            token = self.current_token
             keyword = self.current_token.value
             if keyword not in ["foreign"]:
                 self.__eat(Token.T_KEYWORD)
@@ -405,7 +543,7 @@ class ASTParser:
                         self.__eat(Token.T_TYPE)
                     self.__eat(Token.T_RPAR)
 
-                    if self.tokens[self.pos+1].type == Token.T_ASSIGN:
+                    if self.__peek() == Token.T_ASSIGN:
                         node.ret_register = self.current_token.value
                         self.__eat(Token.T_NAME)
                         self.__eat(Token.T_ASSIGN)
@@ -419,6 +557,7 @@ class ASTParser:
 
                     return node
                 elif self.current_token.type == Token.T_KEYWORD and self.current_token.value == "jump": # Function jump, explicit convention
+                    self.__eat(Token.T_KEYWORD)
                     node = JumpStatement()
                     node.convention = conv
 
@@ -430,6 +569,10 @@ class ASTParser:
                     self.__eat(Token.T_SEMICOLON)
                     
                     return node
+                else:
+                    self.__error("P009", f"Got unexpected token '{self.current_token}'.")
+            else:
+                self.__error("P003", f"Got unexpected keyword '{keyword}'", token)
             
         elif self.current_token.type == Token.T_LPAR: # Function call, default convention
             node = CallStatement()
@@ -440,7 +583,7 @@ class ASTParser:
                 self.__eat(Token.T_TYPE)
             self.__eat(Token.T_RPAR)
 
-            if self.tokens[self.pos+1].type == Token.T_ASSIGN:
+            if self.__peek() == Token.T_ASSIGN:
                 node.ret_register = self.current_token.value
                 self.__eat(Token.T_NAME)
                 self.__eat(Token.T_ASSIGN)
@@ -455,7 +598,7 @@ class ASTParser:
             return node
 
         elif self.current_token.type == Token.T_NAME:
-            if self.tokens[self.pos+1].type == Token.T_COLON: # Local label definition
+            if self.__peek() == Token.T_COLON: # Local label definition
                 return self.__label()
             
             name = self.current_token.value
@@ -467,7 +610,7 @@ class ASTParser:
                 self.__eat(Token.T_SEMICOLON)
                 return node
             else:
-                self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: Got unexpected token '{self.current_token}'.")
+                self.__error("P009", f"Got unexpected token '{self.current_token}'.")
                         
         elif self.current_token.type == Token.T_TYPE:
             type = self.current_token.value
@@ -486,15 +629,15 @@ class ASTParser:
                 return node
             elif self.current_token.type == Token.T_NAME: # Declaration
                 node = DeclStatement(type)
-                node.names.extend(self.__namelist)
+                node.names.extend(self.__namelist())
                 self.__eat(Token.T_SEMICOLON)
 
                 return node
             else:
-                self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: Got unexpected token '{self.current_token}'.")
+                self.__error("P009", f"Got unexpected token '{self.current_token}'.")
 
         else:
-            self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: Got unexpected token '{self.current_token}'.")
+            self.__error("P009", f"Got unexpected token '{self.current_token}'.")
 
     def __expr(self):
         unary_ops = ["-"]
@@ -504,12 +647,12 @@ class ASTParser:
             '&': 3, '~&': 3,
             '<<': 4, '>>': 4, '>>$': 4,
             '+': 5, '-': 5,
-            '*': 6, '/': 6, '/$': 6, '%': 6
+            '*': 6, '/': 6, '/$': 6, '%': 6, '%$': 6
         }
 
         def get_atom():
             if self.current_token.type == Token.T_EOF: # Error on end of file
-                self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: Expected expression, got EOF.")
+                self.__error("P010", "Expected expression, got EOF.")
             
             elif self.current_token.type in [Token.T_INT, Token.T_NAME, Token.T_STR]: # Get constant integer
                 return ConstExpression(self.__const())
@@ -543,7 +686,7 @@ class ASTParser:
                     return SCastExpression(type, expr)
                 
                 else:
-                    self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: Got unexpected token '{self.current_token}'.")
+                    self.__error("P009", f"Got unexpected token '{self.current_token}'.")
 
             elif self.current_token.type == Token.T_OP and self.current_token.value in unary_ops: # Get unary
                 op = self.current_token.value
@@ -552,7 +695,7 @@ class ASTParser:
                 return UnaryExpression(op, value)
 
             else:
-                self.__error(f"{self.current_token.linenum},{self.current_token.linepos}: Got unexpected token '{self.current_token}'.")
+                self.__error("P009", f"Got unexpected token '{self.current_token}'.")
 
         def get_expr(min_prec):
             result = get_atom()
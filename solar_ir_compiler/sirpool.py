@@ -0,0 +1,401 @@
+import sirinstr
+from sirparser import *
+from siropt import register_types, program_consts, function_names, const_value, expr_key, walk_stmts, stmt_exprs, walk_expr, sub_exprs, copy_expr
+from sirtarget import MERCURY
+
+# Block of read-only data: the datums following one or more labels up to the next label or
+# alignment, or a string literal of a function body
+class _Entry:
+    def __init__(self, module, scope, align=1):
+        self.module = module # Index of the program holding the entry
+        self.scope = scope # Function whose static data or body holds the entry, None for global data
+        self.align = align # Boundary in words the entry's address is a multiple of
+        self.labels = []
+        self.datums = []
+        self.literals = [] # String constant nodes
+        self.words = [] # Memory image, with 0 in place of symbolic values
+        self.symbols = [] # (word offset, expression key) of symbolic values
+        self.directive = None
+
+# Data pooling pass.
+# Merges identical read-only data found in the global data directives, in the static data of
+# every function and in the string literals of function bodies. Entries are keyed by their
+# packed memory image. NUL-terminated strings ending another string share its storage, so that
+# "lo" is laid out within "hello".
+#
+# A label is read-only when it is not exported and its name is only used as the address of
+# memory reads, alone or plus a constant, reading within the data up to the next label: never
+# written through, stored, passed, compared, indexed or used to initialize data or consts.
+# String literals are constants unless written through in their own function.
+#
+# The data of a directive is contiguous, so entries are only removed from the end of their
+# directive, where no other data follows them, and the data before them keeps its offsets.
+# Entries following a label that is not read-only stay, as they may be addressed through it.
+# Entries keep their alignment in the pool: an align directive before their labels, or the one
+# their offset from the last align directive implies for their widest datum.
+#
+# Merged entries are moved to a pool directive under fresh '.pool' labels and references are
+# renamed. 'modules' are other programs linked with 'program': data shared between several
+# programs is pooled in 'program', exported there and imported by the others.
+class DataPooling:
+    PREFIX = ".pool"
+
+    def __init__(self, program, target=MERCURY, modules=()):
+        self.programs = [program] + list(modules)
+        self.target = target
+        self.word_bytes = (target.word_bits + 7) // 8
+        self.merged = 0
+        self.saved = 0 # Words of data removed
+
+    # Runs the pass and returns the number of entries merged into another
+    @sirinstr.timed("data-pooling")
+    def run(self):
+        self.consts = [program_consts(program) for program in self.programs]
+        self.taken = set()
+        for program in self.programs:
+            self.taken.update(funct.name for funct in program.function_decls)
+            self.taken.update(program.imports)
+            self.taken.update(name for name, _ in program.const_directives)
+            for funct in program.function_decls:
+                self.taken |= function_names(funct)
+            for _, directive in self.__directives(program):
+                self.taken.update(datum.name for datum in directive.data if isinstance(datum, LabelNode))
+        self.count = 0
+        self.pools = {} # Module -> pool directive
+        self.renames = {} # (module, scope, label) -> pool label
+        self.removed = set() # ids of removed labels and datums
+
+        self.escaped = set() # (module, scope, label) and ids of written string literals
+        self.reads = {} # (module, scope, label) -> words from the label read by memory reads
+        entries = []
+        for module, program in enumerate(self.programs):
+            self.__find_escapes(module, program)
+        for module, program in enumerate(self.programs):
+            for scope, directive in self.__directives(program):
+                for entry in self.__entries(module, scope, directive):
+                    keys = [(module, scope, label) for label in entry.labels]
+                    if any(key in self.escaped or self.reads.get(key, 0) > len(entry.words) for key in keys):
+                        break # The data after an escaped label may be addressed through it
+                    entries.append(entry)
+            entries.extend(self.__literals(module, program))
+
+        # Entries left in their directive keep the entries before them in place in turn
+        entries = self.__trailing(entries)
+        while True:
+            clusters = [(cluster, members) for cluster, members in self.__clusters(entries) if len(members) > 1 or members[0].literals]
+            pooled = self.__trailing([entry for _, members in clusters for entry in members])
+            if len(pooled) == len(entries):
+                break
+            entries = pooled
+
+        for cluster, members in clusters:
+            self.__pool(cluster, members)
+
+        for module, program in enumerate(self.programs):
+            for funct in program.function_decls:
+                self.__rename(module, funct)
+            for _, directive in self.__directives(program):
+                directive.data = [datum for datum in directive.data if id(datum) not in self.removed]
+        return self.merged
+
+    # Yields the (scope, directive) pairs of a program
+    def __directives(self, program):
+        for directive in program.data_directives:
+            yield None, directive
+        for funct in program.function_decls:
+            if funct.staticdata is not None:
+                yield funct.name, funct.staticdata
+
+    def __static_labels(self, funct):
+        if funct.staticdata is None:
+            return set()
+        return {datum.name for datum in funct.staticdata.data if isinstance(datum, LabelNode)}
+
+    ## Analysis ##
+
+    # Records the labels and string literals of a program that may be written or compared
+    def __find_escapes(self, module, program):
+        for name, _ in program.exports:
+            self.escaped.add((module, None, name))
+        for other in self.programs:
+            if other is not program:
+                self.escaped.update((module, None, name) for name in other.imports)
+
+        consts = self.consts[module]
+        for funct in program.function_decls:
+            regs = register_types(funct)
+            static = self.__static_labels(funct)
+            def visit(expr, written=False):
+                if isinstance(expr, ConstExpression):
+                    if expr.const_node.type == ConstantNode.T_NAME and expr.const_node.data not in regs:
+                        name = expr.const_node.data
+                        self.escaped.add((module, funct.name if name in static else None, name))
+                    elif expr.const_node.type == ConstantNode.T_STRING and written:
+                        self.escaped.add(id(expr))
+                elif isinstance(expr, MemReadExpression):
+                    access = self.__access(expr.addr_expr, regs, consts)
+                    if access is None:
+                        visit(expr.addr_expr)
+                    else:
+                        name, offset = access
+                        key = (module, funct.name if name in static else None, name)
+                        self.reads[key] = max(self.reads.get(key, 0), offset + self.target.words(expr.type))
+                else:
+                    for sub in sub_exprs(expr):
+                        visit(sub, written)
+
+            for stmt in walk_stmts(funct.stmts):
+                if isinstance(stmt, MemWriteStatement):
+                    visit(stmt.addr_expr, True)
+                    visit(stmt.val_expr)
+                else:
+                    for expr in stmt_exprs(stmt):
+                        visit(expr)
+
+        for _, expr in program.const_directives:
+            for node in walk_expr(expr):
+                if isinstance(node, ConstExpression) and node.const_node.type == ConstantNode.T_NAME:
+                    self.escaped.add((module, None, node.const_node.data))
+
+        for scope, directive in self.__directives(program):
+            static = {datum.name for datum in directive.data if isinstance(datum, LabelNode)} if scope else set()
+            for datum in directive.data:
+                if isinstance(datum, DatumNode):
+                    for expr in datum.data:
+                        for node in walk_expr(expr):
+                            if isinstance(node, ConstExpression) and node.const_node.type == ConstantNode.T_NAME:
+                                name = node.const_node.data
+                                self.escaped.add((module, scope if name in static else None, name))
+
+    # Returns the (name, offset) of an address naming a label plus a constant offset, or None
+    def __access(self, addr, regs, consts):
+        offset = 0
+        if isinstance(addr, BinaryExpression) and addr.op in ["+", "-"]:
+            right = const_value(addr.right, consts)
+            left = const_value(addr.left, consts) if addr.op == "+" else None
+            if right is not None:
+                offset, addr = right if addr.op == "+" else -right, addr.left
+            elif left is not None:
+                offset, addr = left, addr.right
+            else:
+                return None
+        if (offset >= 0 and isinstance(addr, ConstExpression) and addr.const_node.type == ConstantNode.T_NAME
+                and addr.const_node.data not in regs and addr.const_node.data not in consts):
+            return addr.const_node.data, offset
+        return None
+
+    # Returns the entries of a data directive whose content is known
+    def __entries(self, module, scope, directive):
+        static = {datum.name for datum in directive.data if isinstance(datum, LabelNode)} if scope else set()
+        entries = []
+        implied = [] # Entries not right after an align directive
+        entry = None
+        boundary, offset = 1, 0 # Boundary of the last align directive and words laid out since, None if unknown
+        aligned = False
+        for datum in directive.data:
+            if isinstance(datum, LabelNode):
+                if entry is None or entry.datums:
+                    entry = _Entry(module, scope, boundary if aligned else self.__implied_align(boundary, offset))
+                    entry.directive = directive
+                    entries.append(entry)
+                    if not aligned:
+                        implied.append(entry)
+                    aligned = False
+                entry.labels.append(datum.name)
+            elif isinstance(datum, AlignNode):
+                entry = None
+                boundary, offset = self.target.words(datum.type.replace("align", "word").replace("wordp", "ptr")), 0
+                aligned = True
+            elif isinstance(datum, DatumNode):
+                if entry is not None:
+                    entry.datums.append(datum)
+                count = const_value(datum.allocsize, self.consts[module])
+                offset = offset + count * self.target.words(datum.type) if offset is not None and count is not None else None
+                aligned = False
+
+        # Alignment implied by the offset only matters up to the widest datum of the entry
+        for entry in implied:
+            if entry.datums:
+                entry.align = min(entry.align, max(self.target.words(datum.type) for datum in entry.datums))
+        return [entry for entry in entries if entry.datums and self.__image(entry, static)]
+
+    # Returns the largest alignment, up to an align directive's boundary, of an offset from it
+    def __implied_align(self, boundary, offset):
+        if offset is None:
+            return 1
+        align = boundary
+        while offset % align:
+            align //= 2
+        return align
+
+    # Fills the memory image of an entry, and returns whether its content is known
+    def __image(self, entry, static):
+        consts = self.consts[entry.module]
+        for datum in entry.datums:
+            count = const_value(datum.allocsize, consts)
+            if count is None or count < 1:
+                return False
+            words = self.target.words(datum.type)
+            if not datum.data:
+                entry.words.extend([0] * (count * words))
+                continue
+
+            values = []
+            for expr in datum.data:
+                value = const_value(expr, consts)
+                if value is None:
+                    names = {node.const_node.data for node in walk_expr(expr)
+                             if isinstance(node, ConstExpression) and node.const_node.type == ConstantNode.T_NAME}
+                    if names & static:
+                        return False # Static labels cannot be named from another directive
+                    values.append(expr_key(expr))
+                else:
+                    value &= self.target.mask(datum.type)
+                    values.append([(value >> (i * self.target.word_bits)) & self.target.mask("word1") for i in range(words)])
+            for i in range(count):
+                value = values[i % len(values)]
+                if isinstance(value, list):
+                    entry.words.extend(value)
+                else:
+                    entry.symbols.append((len(entry.words), value))
+                    entry.words.extend([0] * words)
+        return True
+
+    # Returns an entry for every string literal of a program's functions
+    def __literals(self, module, program):
+        entries = []
+        for funct in program.function_decls:
+            for stmt in walk_stmts(funct.stmts):
+                for expr in stmt_exprs(stmt):
+                    for node in walk_expr(expr):
+                        if isinstance(node, ConstExpression) and node.const_node.type == ConstantNode.T_STRING and id(node) not in self.escaped:
+                            entry = _Entry(module, funct.name)
+                            entry.literals.append(node)
+                            entry.words = list(node.const_node.data) + [0]
+                            entries.append(entry)
+        return entries
+
+    # Returns the key of an entry's content: its packed image, alignment and symbolic values.
+    # Symbolic values name globals of their own program, so they only match within it.
+    def __key(self, entry):
+        packed = b"".join(word.to_bytes(self.word_bytes, "little") for word in entry.words)
+        if entry.symbols:
+            return (packed, entry.align, entry.module, tuple(entry.symbols))
+        return (packed, entry.align)
+
+    def __is_string(self, entry):
+        return (not entry.symbols and entry.align == 1 and entry.words[-1] == 0
+                and all(datum.type == "word1" for datum in entry.datums))
+
+    # Returns the (cluster, members) pairs sharing storage among entries. A cluster is a list of
+    # (group, offset) pairs, groups being entries of equal content laid out at the offset.
+    def __clusters(self, entries):
+        groups = {}
+        for entry in entries:
+            groups.setdefault(self.__key(entry), []).append(entry)
+
+        # Strings sorted by reversed content follow the strings they end
+        clusters = []
+        strings = []
+        for group in groups.values():
+            (strings if self.__is_string(group[0]) else clusters).append(group)
+        clusters = [[(group, 0)] for group in clusters]
+        strings.sort(key=lambda group: group[0].words[::-1], reverse=True)
+        owner = None
+        for group in strings:
+            words = group[0].words
+            if owner is not None and owner[len(owner) - len(words):] == words:
+                clusters[-1].append((group, len(owner) - len(words)))
+            else:
+                clusters.append([(group, 0)])
+                owner = words
+        return [(cluster, [entry for group, _ in cluster for entry in group]) for cluster in clusters]
+
+    # Returns the entries only followed by other entries of the list in their directive
+    def __trailing(self, entries):
+        kept = {id(entry) for entry in entries}
+        owners = {id(datum): entry for entry in entries if entry.directive is not None for datum in entry.datums}
+        for directive in {id(entry.directive): entry.directive for entry in entries if entry.directive is not None}.values():
+            blocked = False
+            for datum in reversed(directive.data):
+                if isinstance(datum, DatumNode):
+                    owner = owners.get(id(datum))
+                    if owner is None or blocked:
+                        blocked = True
+                        if owner is not None:
+                            kept.discard(id(owner))
+        return [entry for entry in entries if id(entry) in kept]
+
+    ## Rewriting ##
+
+    # Lays out a cluster of (group, offset) pairs once in a pool, and redirects every member to it
+    def __pool(self, cluster, members):
+        modules = {entry.module for entry in members}
+        home = members[0].module if len(modules) == 1 else 0
+        if home not in self.pools:
+            self.pools[home] = DataDirectiveNode()
+            self.programs[home].data_directives.append(self.pools[home])
+        pool = self.pools[home]
+
+        owner = cluster[0][0][0]
+        labels = []
+        for group, offset in cluster:
+            label = self.__fresh()
+            labels.append((offset, label))
+            for entry in group:
+                for name in entry.labels:
+                    self.renames[(entry.module, entry.scope, name)] = label
+                for node in entry.literals:
+                    node.const_node = ConstantNode(ConstantNode.T_NAME, label)
+                if entry.module != home:
+                    if label not in self.programs[entry.module].imports:
+                        self.programs[entry.module].imports.append(label)
+                    if (label, False) not in self.programs[home].exports:
+                        self.programs[home].exports.append((label, False))
+                self.removed.update(id(datum) for datum in entry.datums)
+                if entry.directive is not None:
+                    self.removed.update(id(node) for node in entry.directive.data if isinstance(node, LabelNode) and node.name in entry.labels)
+
+        if owner.align > 1:
+            pool.data.append(AlignNode(f"align{owner.align}"))
+        if len(cluster) == 1 and not self.__is_string(owner) and owner.datums:
+            pool.data.append(LabelNode(labels[0][1]))
+            for datum in owner.datums:
+                node = DatumNode(datum.type)
+                node.allocsize = copy_expr(datum.allocsize)
+                node.data = [copy_expr(expr) for expr in datum.data]
+                pool.data.append(node)
+        else:
+            # Constant content, split into word1 datums at the offset of every label
+            labels.sort()
+            bounds = [offset for offset, _ in labels] + [len(owner.words)]
+            for i, (offset, label) in enumerate(labels):
+                pool.data.append(LabelNode(label))
+                if bounds[i + 1] > offset:
+                    node = DatumNode("word1")
+                    node.data = [ConstExpression(ConstantNode(ConstantNode.T_SCONST, word)) for word in owner.words[offset:bounds[i + 1]]]
+                    node.allocsize = ConstExpression(ConstantNode(ConstantNode.T_SCONST, len(node.data)))
+                    pool.data.append(node)
+
+        self.merged += len(members) - 1
+        self.saved += sum(len(entry.words) for entry in members) - len(owner.words)
+
+    def __fresh(self):
+        while f"{DataPooling.PREFIX}{self.count}" in self.taken:
+            self.count += 1
+        name = f"{DataPooling.PREFIX}{self.count}"
+        self.taken.add(name)
+        return name
+
+    # Renames the references of a function to pooled labels
+    def __rename(self, module, funct):
+        regs = register_types(funct)
+        static = self.__static_labels(funct)
+        for stmt in walk_stmts(funct.stmts):
+            for expr in stmt_exprs(stmt):
+                for node in walk_expr(expr):
+                    if isinstance(node, ConstExpression) and node.const_node.type == ConstantNode.T_NAME and node.const_node.data not in regs:
+                        name = node.const_node.data
+                        key = (module, funct.name if name in static else None, name)
+                        if key in self.renames:
+                            node.const_node.data = self.renames[key]
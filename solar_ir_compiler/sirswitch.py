@@ -0,0 +1,193 @@
+import sirinstr
+from sirparser import *
+from siropt import ExprTyper, register_types, program_consts, function_names, const_value, expr_key, int_expr, name_expr
+from sirtarget import MERCURY
+
+# Switch lowering pass.
+# Finds chains of ifs comparing the same expression against constants,
+#   if (x == K1) { ... } else { if (x == K2) { ... } else { ... } }
+# and replaces them by a multiway branch evaluating the expression once.
+#
+# Dense chains become a SwitchStatement, which backends lower to a jump table indexed by the
+# value's offset from the lowest case: SIR gotos only name labels, so the table itself is built
+# by the backend in its static data. Sparse chains become a balanced tree of '<' comparisons
+# ending in gotos to the case blocks, which is plain SIR.
+#
+# The pass introduces statements the other passes do not look through as well as ifs, so it is
+# meant to run after them, right before a backend.
+class SwitchLowering:
+    LABEL_PREFIX = ".sw"
+    TEMP_PREFIX = ".sw"
+
+    # 'min_cases' is the shortest chain worth lowering, 'min_density' the least fraction of the
+    # table's entries that must be cases, and 'max_table' the largest table built.
+    def __init__(self, program, target=MERCURY, min_cases=4, min_density=0.5, max_table=1024):
+        self.program = program
+        self.target = target
+        self.min_cases = min_cases
+        self.min_density = min_density
+        self.max_table = max_table
+        self.consts = program_consts(program)
+        self.tables = 0
+        self.trees = 0
+
+    # Runs the pass over every function and returns the number of lowered chains
+    @sirinstr.timed("switch-lowering")
+    def run(self):
+        for funct in self.program.function_decls:
+            self.regs = register_types(funct)
+            self.typer = ExprTyper(self.regs, {name: value for name, value in self.consts.items() if name not in self.regs}, self.target)
+            self.used_names = function_names(funct)
+            self.decls = {}
+            self.funct = funct
+            funct.stmts = self.__block(funct.stmts)
+            if self.decls:
+                funct.stmts = list(self.decls.values()) + funct.stmts
+        return self.tables + self.trees
+
+    def __block(self, stmts):
+        result = []
+        for stmt in stmts:
+            if isinstance(stmt, IfStatement):
+                chain = self.__chain(stmt)
+                if chain is not None:
+                    result.extend(self.__lower(*chain))
+                    continue
+                stmt.if_block = self.__block(stmt.if_block)
+                stmt.else_block = self.__block(stmt.else_block)
+            elif isinstance(stmt, SwitchStatement):
+                stmt.cases = [(value, self.__block(block)) for value, block in stmt.cases]
+                stmt.default_block = self.__block(stmt.default_block)
+            result.append(stmt)
+        return result
+
+    # Returns the (expression, cases, default block) of a chain of ifs starting at a statement,
+    # or None if it is too short. Cases are sorted (value, block) pairs, values being those the
+    # expression holds, zero-extended, when the case is taken.
+    def __chain(self, stmt):
+        match = self.__compare(stmt)
+        if match is None:
+            return None
+        expr, _ = match
+        key = expr_key(expr)
+        type = self.typer.type_of(expr)
+        holds = self.__value_mask(expr)
+
+        cases = {}
+        node = stmt
+        while True:
+            _, constant = match
+            width = self.target.wider(type, self.typer.type_of(constant))
+            value = const_value(constant, self.typer.consts) & self.target.mask(width)
+            # Values the expression cannot hold are never equal, and only the first equal case is taken
+            if value & ~holds == 0 and value not in cases:
+                cases[value] = node.if_block
+            if len(node.else_block) != 1 or not isinstance(node.else_block[0], IfStatement):
+                break
+            match = self.__compare(node.else_block[0])
+            if match is None or expr_key(match[0]) != key:
+                break
+            node = node.else_block[0]
+
+        if len(cases) < self.min_cases:
+            return None
+        return expr, sorted(cases.items()), node.else_block
+
+    # Returns the (expression, constant) compared for equality by an if, or None
+    def __compare(self, stmt):
+        if stmt.rel != "==":
+            return None
+        if const_value(stmt.right, self.typer.consts) is not None:
+            return stmt.left, stmt.right
+        if const_value(stmt.left, self.typer.consts) is not None:
+            return stmt.right, stmt.left
+        return None
+
+    def __lower(self, expr, cases, default_block):
+        cases = [(value, self.__block(block)) for value, block in cases]
+        default_block = self.__block(default_block)
+
+        span = cases[-1][0] - cases[0][0] + 1
+        if span <= self.max_table and len(cases) >= self.min_density * span:
+            self.tables += 1
+            switch = SwitchStatement(expr)
+            switch.cases = cases
+            switch.default_block = default_block
+            return [switch]
+
+        self.trees += 1
+        # The tree compares a register, so other expressions are computed once beforehand
+        result = []
+        if not (isinstance(expr, ConstExpression) and expr.const_node.type == ConstantNode.T_NAME and expr.const_node.data in self.regs):
+            type = self.__value_type(expr)
+            temp = self.__name(SwitchLowering.TEMP_PREFIX)
+            self.decls.setdefault(type, DeclStatement(type)).names.append(temp)
+            result.append(DefStatement(temp, expr))
+            expr = name_expr(temp)
+
+        labels = [self.__name(SwitchLowering.LABEL_PREFIX) for _ in cases]
+        default_label = self.__name(SwitchLowering.LABEL_PREFIX)
+        end_label = self.__name(SwitchLowering.LABEL_PREFIX)
+        result.extend(self.__tree(expr, [(value, label) for (value, _), label in zip(cases, labels)], default_label))
+
+        for (_, block), label in zip(cases, labels):
+            result.append(LabelNode(label))
+            result.extend(block)
+            if not block or not isinstance(block[-1], (GotoStatement, JumpStatement, ReturnStatement)):
+                result.append(GotoStatement(end_label))
+        result.append(LabelNode(default_label))
+        result.extend(default_block)
+        result.append(LabelNode(end_label))
+        return result
+
+    # Returns the narrowest type known to hold every value of an expression, so that masked
+    # values such as 'x & 31' are kept in a register no wider than needed
+    def __value_type(self, expr):
+        value = const_value(expr, self.typer.consts)
+        if value is not None and value >= 0:
+            return next((type for type in self.target.TYPES if value <= self.target.mask(type)), "word8")
+        type = self.typer.type_of(expr)
+        if isinstance(expr, UCastExpression):
+            inner = self.__value_type(expr.expr)
+            return inner if self.target.words(inner) < self.target.words(type) else type
+        elif isinstance(expr, BinaryExpression) and expr.op == "&":
+            left, right = self.__value_type(expr.left), self.__value_type(expr.right)
+            return left if self.target.words(left) < self.target.words(right) else right
+        return type
+
+    # Returns a mask of the bits an expression may have set, so that 'x & 7' is known to never
+    # equal 9 although its type holds it
+    def __value_mask(self, expr):
+        value = const_value(expr, self.typer.consts)
+        if value is not None and value >= 0:
+            return value
+        mask = self.target.mask(self.typer.type_of(expr))
+        if isinstance(expr, UCastExpression):
+            return mask & self.__value_mask(expr.expr)
+        elif isinstance(expr, BinaryExpression) and expr.op == "&":
+            return mask & self.__value_mask(expr.left) & self.__value_mask(expr.right)
+        return mask
+
+    # Returns the statements branching to the label of a register's value, by binary search
+    def __tree(self, register, cases, default_label):
+        if len(cases) <= 2:
+            stmts = [GotoStatement(default_label)]
+            for value, label in reversed(cases):
+                node = IfStatement(name_expr(register.const_node.data), "==", int_expr(value))
+                node.if_block = [GotoStatement(label)]
+                node.else_block = stmts
+                stmts = [node]
+            return stmts
+        middle = len(cases) // 2
+        node = IfStatement(name_expr(register.const_node.data), "<", int_expr(cases[middle][0]))
+        node.if_block = self.__tree(register, cases[:middle], default_label)
+        node.else_block = self.__tree(register, cases[middle:], default_label)
+        return [node]
+
+    def __name(self, prefix):
+        count = len(self.used_names)
+        while f"{prefix}{count}" in self.used_names:
+            count += 1
+        name = f"{prefix}{count}"
+        self.used_names.add(name)
+        return name
@@ -0,0 +1,40 @@
+# Class describing the machine Solar IR is lowered to.
+# Exposes the width of a word and of the ptr type, and helpers to size SIR types.
+class Target:
+    TYPES = ["word1", "word2", "word4", "word8"]
+    TYPE_WORDS = {
+        "word1": 1,
+        "word2": 2,
+        "word4": 4,
+        "word8": 8
+    }
+
+    def __init__(self, word_bits=16, ptr_type="word1"):
+        if ptr_type not in Target.TYPE_WORDS:
+            raise Exception(f"[TARGET]: Invalid ptr type '{ptr_type}', expected one of {', '.join(Target.TYPES)}")
+        self.word_bits = word_bits
+        self.ptr_type = ptr_type
+
+    # Number of words occupied by a type
+    def words(self, type):
+        if type == "ptr":
+            type = self.ptr_type
+        return Target.TYPE_WORDS[type]
+
+    # Number of bits occupied by a type
+    def bits(self, type):
+        return self.words(type) * self.word_bits
+
+    # Bit mask holding every bit of a type
+    def mask(self, type):
+        return (1 << self.bits(type)) - 1
+
+    # Returns the wider of two types, as selected by SIR operators
+    def wider(self, left, right):
+        return right if self.words(right) > self.words(left) else left
+
+    def __repr__(self):
+        return f"Target(WordBits={self.word_bits}, Ptr={self.ptr_type})"
+
+# Default target: Mercury, with 16 bit words and a one word address bus
+MERCURY = Target()
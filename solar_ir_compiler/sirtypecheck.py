@@ -0,0 +1,194 @@
+import sirinstr
+from sirparser import *
+from siropt import ExprTyper, register_types, program_consts, const_value, walk_stmts, sub_blocks
+from sirtarget import MERCURY
+
+# Type checking pass.
+# Resolves the type of every expression of the program's functions in one walk of each tree,
+# storing it in the 'resolved_type' of every node as ExprTyper.annotate does, and reports:
+#   - names that are not registers, labels, functions, imports or consts, and assignments to
+#     undeclared registers,
+#   - calls whose ret_register or expected result differs in width from what is returned, or
+#     passing a different number of arguments than the called function receives,
+#   - returns that do not match the type of their function,
+#   - implicit truncations of values assigned, written, returned or passed as arguments.
+#
+# A value is truncated when the narrowest type known to hold it is wider than its destination.
+# Integer literals hold in the narrowest type fitting them and arithmetic in the wider of its
+# operands, so 'x = x + 1' on a word1 register truncates nothing, while 'x = y' with a word2 'y'
+# does. Casts are explicit truncations and are never reported.
+#
+# The program is left unchanged apart from the annotations. Problems are recorded in
+# 'diagnostics', rather than raised, so that every one of them is reported. Backends do not
+# rely on the annotations of this pass: they annotate every function again when compiling it.
+class TypeChecker:
+    def __init__(self, program, target=MERCURY):
+        self.program = program
+        self.target = target
+        self.consts = program_consts(program)
+        self.functions = {funct.name: funct for funct in program.function_decls}
+        self.globals = set(self.functions) | set(program.imports) | {name for name, _ in program.const_directives}
+        for directive in program.data_directives:
+            self.globals.update(datum.name for datum in directive.data if isinstance(datum, LabelNode))
+        self.diagnostics = []
+
+    # Runs the pass over every function and returns the number of problems found
+    @sirinstr.timed("type-check")
+    def run(self):
+        for funct in self.program.function_decls:
+            self.funct = funct
+            self.regs = register_types(funct)
+            self.declared = {name for _, name in funct.fargs}
+            for stmt in walk_stmts(funct.stmts):
+                if isinstance(stmt, DeclStatement):
+                    self.declared.update(stmt.names)
+            self.typer = ExprTyper(self.regs, {name: value for name, value in self.consts.items() if name not in self.regs}, self.target)
+            self.names = set(self.globals)
+            if funct.staticdata is not None:
+                self.names.update(datum.name for datum in funct.staticdata.data if isinstance(datum, LabelNode))
+            self.__block(funct.stmts)
+        return len(self.diagnostics)
+
+    def __error(self, code, text):
+        self.diagnostics.append(Diagnostic(code, f"Function '{self.funct.name}': {text}"))
+
+    def __block(self, stmts):
+        for stmt in stmts:
+            self.__stmt(stmt)
+            for block in sub_blocks(stmt):
+                self.__block(block)
+
+    def __stmt(self, stmt):
+        if isinstance(stmt, DefStatement):
+            holds = self.__expr(stmt.expr)
+            if stmt.name not in self.regs:
+                self.__error("T002", f"Assignment to undeclared register '{stmt.name}'")
+            else:
+                self.__truncation(holds, self.regs[stmt.name], f"Assignment to {self.regs[stmt.name]} register '{stmt.name}'")
+
+        elif isinstance(stmt, MemWriteStatement):
+            self.__expr(stmt.addr_expr)
+            self.__truncation(self.__expr(stmt.val_expr), stmt.type, f"Write of a {stmt.type} value")
+
+        elif isinstance(stmt, IfStatement):
+            self.__expr(stmt.left)
+            self.__expr(stmt.right)
+
+        elif isinstance(stmt, SwitchStatement):
+            self.__expr(stmt.expr)
+
+        elif isinstance(stmt, (CallStatement, JumpStatement)):
+            self.__expr(stmt.funct_expr)
+            holds = [self.__expr(arg) for arg in stmt.args]
+            callee = self.__callee(stmt)
+            if isinstance(stmt, CallStatement):
+                self.__call_result(stmt, callee)
+            elif callee is not None and not self.__same_width(callee.type, self.funct.type):
+                self.__error("T005", f"Jump to '{callee.name}' returning {callee.type or 'nothing'} from a function returning {self.funct.type or 'nothing'}")
+            if callee is not None:
+                if len(stmt.args) != len(callee.fargs):
+                    self.__error("T006", f"Call to '{callee.name}' with {len(stmt.args)} arguments, expected {len(callee.fargs)}")
+                for i, (value, (type, name)) in enumerate(zip(holds, callee.fargs)):
+                    self.__truncation(value, type, f"Argument {i + 1} of '{callee.name}', {type} '{name}',")
+
+        elif isinstance(stmt, ReturnStatement):
+            if stmt.expr is None:
+                if self.funct.type is not None:
+                    self.__error("T007", f"Return without a value from a function returning {self.funct.type}")
+            else:
+                holds = self.__expr(stmt.expr)
+                if self.funct.type is None:
+                    self.__error("T007", "Return of a value from a function without return type")
+                else:
+                    self.__truncation(holds, self.funct.type, f"Return from a function returning {self.funct.type}")
+
+    # Checks the type of a call against its ret_register and the function it calls
+    def __call_result(self, stmt, callee):
+        if stmt.ret_register is not None:
+            # register_types gives undeclared registers the type of the call, but the spec
+            # (§4.2.8) requires a declared register of the same type
+            if stmt.ret_register not in self.declared:
+                self.__error("T002", f"Call result assigned to undeclared register '{stmt.ret_register}'")
+            elif stmt.type is None:
+                self.__error("T004", f"Call without return type assigned to register '{stmt.ret_register}'")
+            elif not self.__same_width(stmt.type, self.regs[stmt.ret_register]):
+                self.__error("T003", f"Call returning {stmt.type} assigned to {self.regs[stmt.ret_register]} register '{stmt.ret_register}'")
+        if callee is not None and stmt.type is not None and not self.__same_width(stmt.type, callee.type):
+            self.__error("T005", f"Call expecting {stmt.type} from '{callee.name}', which returns {callee.type or 'nothing'}")
+
+    # Returns the function of the program a call or jump names directly, or None
+    def __callee(self, stmt):
+        expr = stmt.funct_expr
+        if isinstance(expr, ConstExpression) and expr.const_node.type == ConstantNode.T_NAME and expr.const_node.data not in self.regs:
+            return self.functions.get(expr.const_node.data)
+        return None
+
+    def __same_width(self, left, right):
+        if left is None or right is None:
+            return left is right
+        return self.target.words(left) == self.target.words(right)
+
+    def __truncation(self, holds, type, text):
+        if self.target.words(holds) > self.target.words(type):
+            self.__error("T008", f"{text} implicitly truncates a {holds} value")
+
+    # Annotates an expression and its subexpressions with their types, and returns the
+    # narrowest type known to hold the expression's value
+    def __expr(self, expr):
+        if isinstance(expr, ConstExpression):
+            expr.resolved_type = self.typer.type_of(expr)
+            if expr.const_node.type == ConstantNode.T_NAME and expr.const_node.data not in self.regs and expr.const_node.data not in self.names:
+                self.__error("T001", f"Unknown name '{expr.const_node.data}'")
+            value = const_value(expr, self.typer.consts)
+            return self.__holding(value) if value is not None else expr.resolved_type
+
+        elif isinstance(expr, MemReadExpression):
+            self.__expr(expr.addr_expr)
+            expr.resolved_type = expr.type
+            return expr.type
+
+        elif isinstance(expr, UCastExpression):
+            holds = self.__expr(expr.expr)
+            expr.resolved_type = expr.type
+            return self.__narrower(holds, expr.type)
+
+        elif isinstance(expr, SCastExpression):
+            holds = self.__expr(expr.expr)
+            expr.resolved_type = expr.type
+            # Extending a value whose sign bit is known clear is a zero extension
+            if self.target.words(expr.type) > self.target.words(expr.expr.resolved_type) and holds == expr.expr.resolved_type:
+                return expr.type
+            return self.__narrower(holds, expr.type)
+
+        elif isinstance(expr, UnaryExpression):
+            self.__expr(expr.value)
+            expr.resolved_type = expr.value.resolved_type
+            value = const_value(expr, self.typer.consts)
+            return self.__holding(value) if value is not None else expr.resolved_type
+
+        elif isinstance(expr, BinaryExpression):
+            left, right = self.__expr(expr.left), self.__expr(expr.right)
+            expr.resolved_type = self.target.wider(expr.left.resolved_type, expr.right.resolved_type)
+            value = const_value(expr, self.typer.consts)
+            if value is not None:
+                return self.__holding(value)
+            if expr.op == "&":
+                return self.__narrower(left, right)
+            elif expr.op in ["/", "%", ">>"]:
+                return left
+            elif expr.op in ["+", "-", "*", "|", "^", "<<"]:
+                return self.target.wider(left, right)
+            return expr.resolved_type # Complemented and signed results may set every bit
+
+        raise Exception(f"[TYPES]: Cannot type unknown expression '{expr}'")
+
+    # Returns the narrowest type holding a constant, negative values being held as two's complement
+    def __holding(self, value):
+        for type in self.target.TYPES:
+            bits = self.target.bits(type)
+            if (0 <= value < (1 << bits)) or (-(1 << (bits - 1)) <= value < 0):
+                return type
+        return "word8"
+
+    def __narrower(self, left, right):
+        return left if self.target.words(left) < self.target.words(right) else right
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The compiler modules import each other by name, as when run from their own directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,250 @@
+import io
+import os
+import re
+
+from sirlex import Lexer
+from sirparser import ASTParser
+from sirinterp import Interpreter
+from sircodegen import MercuryCodeGen
+from sirtarget import MERCURY
+
+COMPILER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Returns the program parsed from Solar IR source text
+def parse(text):
+    return ASTParser(Lexer(text).lex()).program()
+
+# Returns the source text of a file of the compiler's directory
+def source(name):
+    with open(os.path.join(COMPILER_DIR, name), encoding="utf8") as file:
+        return file.read()
+
+# Returns the results of interpreting calls, given as (function, args) pairs, on a program.
+# Calls share the interpreter, so that they see the memory written by the previous ones.
+def interpret(program, calls, hooks={}):
+    interp = Interpreter(program, hooks=hooks)
+    return [interp.call(name, *args) for name, args in calls]
+
+# Checks that transforming a program keeps the results of interpreting calls on it.
+# 'transform' receives the parsed program, changes it in place and returns what it reports.
+def assert_preserved(text, calls, transform, hooks={}):
+    expected = interpret(parse(text), calls, hooks)
+    program = parse(text)
+    reported = transform(program)
+    assert interpret(program, calls, hooks) == expected
+    return reported
+
+# Simulator of the Mercury assembly emitted for a program, running functions as their callers
+# would. Words are 16 bits and data is laid out from DATA_BASE. Code is kept apart from memory,
+# at one address per instruction from CODE_BASE, and imports have no code. Machine shifts by a
+# word or more leave zeros, or the sign for 'sar'.
+class MercurySimulator:
+    DATA_BASE = 16
+    STACK_TOP = 0xFFF0
+    CODE_BASE = 0x100
+    RETURN_ADDRESS = 0 # Below any code
+    EXTERN_ADDRESS = 0xFFFF # Above any code, imports cannot be called
+    MAX_STEPS = 20_000_000
+    WORD_BITS = 16
+    REGISTERS = [f"r{i}" for i in range(8)] + ["fp", "sp"]
+    BRANCHES = ["beq", "bne", "bgtu", "bltu", "bgeu", "bleu", "bgt", "blt", "bge", "ble"]
+    OPERATIONS = {
+        "add": lambda left, right: left + right, "sub": lambda left, right: left - right,
+        "mul": lambda left, right: left * right, "divu": lambda left, right: left // right,
+        "modu": lambda left, right: left % right, "and": lambda left, right: left & right,
+        "or": lambda left, right: left | right, "xor": lambda left, right: left ^ right,
+        "nand": lambda left, right: ~(left & right), "nor": lambda left, right: ~(left | right),
+        "xnor": lambda left, right: ~(left ^ right), "shr": lambda left, right: left >> right
+    }
+
+    def __init__(self, program, target=MERCURY):
+        stream = io.StringIO()
+        MercuryCodeGen(program, target).emit(stream)
+        self.asm = stream.getvalue()
+        self.program = program
+        self.target = target
+        self.mask = (1 << MercurySimulator.WORD_BITS) - 1
+        self.memory = [0] * (1 << MercurySimulator.WORD_BITS)
+        self.code = []
+        self.labels = {}
+        self.steps = 0
+
+        section = None
+        address = MercurySimulator.DATA_BASE
+        words = [] # (address, operand) of initialized data
+        for line in self.asm.splitlines():
+            line = line.strip()
+            if not line or line.startswith((".global", ".weak")):
+                continue
+            if line.startswith(".extern"):
+                self.labels[line.split()[1]] = MercurySimulator.EXTERN_ADDRESS
+                continue
+            if line in [".text", ".data"]:
+                section = line
+            elif line.endswith(":"):
+                self.labels[line[:-1]] = MercurySimulator.CODE_BASE + len(self.code) if section == ".text" else address
+            elif section == ".text":
+                mnemonic, _, operands = line.partition(" ")
+                self.code.append((mnemonic, operands.split(", ") if operands else []))
+            else:
+                directive, _, operands = line.partition(" ")
+                if directive == ".align":
+                    address += -address % int(operands)
+                elif directive == ".zero":
+                    address += int(operands)
+                elif directive == ".fill":
+                    count, value = operands.split(", ")
+                    words += [(address + i, value) for i in range(int(count))]
+                    address += int(count)
+                elif directive == ".word":
+                    for value in operands.split(", "):
+                        words.append((address, value))
+                        address += 1
+                else:
+                    raise Exception(f"Unknown directive '{line}'")
+        for address, value in words:
+            self.memory[address] = self.__value(value)
+        # Operands are decoded once labels are known: registers stay names, memory operands
+        # become (register, offset) pairs and the others integers
+        self.code = [(mnemonic, [self.__decode(operand) for operand in operands]) for mnemonic, operands in self.code]
+
+    # Returns the address of a label
+    def address(self, label):
+        return self.labels[label]
+
+    # Returns the value of a type read at an address, as the interpreter would read it
+    def read(self, type, addr):
+        return sum(self.memory[addr + i] << (i * MercurySimulator.WORD_BITS) for i in range(self.target.words(type)))
+
+    # Calls a function of the program with integer arguments and returns its result, or None
+    def call(self, name, *args):
+        funct = next(funct for funct in self.program.function_decls if funct.name == name)
+        conv = MercuryCodeGen.CONVENTIONS[funct.convention]
+        slot = self.target.words(funct.type) if funct.type is not None and (conv.return_slot or self.target.words(funct.type) > 1) else 0
+        self.registers = {f"r{i}": 0 for i in range(8)}
+        self.registers["fp"] = 0
+        self.registers["sp"] = MercurySimulator.STACK_TOP - slot
+
+        pushed = []
+        for (type, _), value in zip(funct.fargs, args):
+            value &= self.target.mask(type)
+            pushed += [(value >> (i * MercurySimulator.WORD_BITS)) & self.mask for i in range(self.target.words(type))]
+        for word in reversed(pushed):
+            self.__push(word)
+        self.__push(MercurySimulator.RETURN_ADDRESS)
+        self.__run(self.labels[name])
+
+        if not conv.callee_cleans:
+            self.registers["sp"] += len(pushed)
+        if funct.type is None:
+            return None
+        if slot:
+            return self.read(funct.type, self.registers["sp"])
+        return self.registers["r0"]
+
+    def __run(self, address):
+        registers = self.registers
+        pc = address - MercurySimulator.CODE_BASE
+        flags = None
+        while True:
+            self.steps += 1
+            if self.steps > MercurySimulator.MAX_STEPS:
+                raise Exception("Simulation takes too many steps")
+            mnemonic, operands = self.code[pc]
+            pc += 1
+            if mnemonic == "push":
+                self.__push(self.__operand(operands[0]))
+            elif mnemonic == "pop":
+                registers[operands[0]] = self.memory[registers["sp"]]
+                registers["sp"] += 1
+            elif mnemonic in ["mov", "li"]:
+                registers[operands[0]] = self.__operand(operands[1])
+            elif mnemonic == "ld":
+                register, offset = operands[1]
+                registers[operands[0]] = self.memory[(registers[register] + offset) & self.mask]
+            elif mnemonic == "st":
+                register, offset = operands[0]
+                self.memory[(registers[register] + offset) & self.mask] = registers[operands[1]]
+            elif mnemonic == "neg":
+                registers[operands[0]] = -registers[operands[1]] & self.mask
+            elif mnemonic == "cmp":
+                flags = (registers[operands[0]], self.__operand(operands[1]))
+            elif mnemonic in MercurySimulator.BRANCHES:
+                left, right = flags
+                if mnemonic in ["bgt", "blt", "bge", "ble"]:
+                    left, right = self.__signed(left), self.__signed(right)
+                taken = {
+                    "beq": left == right, "bne": left != right,
+                    "bgtu": left > right, "bltu": left < right, "bgeu": left >= right, "bleu": left <= right,
+                    "bgt": left > right, "blt": left < right, "bge": left >= right, "ble": left <= right
+                }[mnemonic]
+                if taken:
+                    pc = operands[0] - MercurySimulator.CODE_BASE
+            elif mnemonic == "jmp":
+                pc = self.__operand(operands[0]) - MercurySimulator.CODE_BASE
+            elif mnemonic == "call":
+                target = self.__operand(operands[0])
+                self.__push(MercurySimulator.CODE_BASE + pc)
+                pc = target - MercurySimulator.CODE_BASE
+            elif mnemonic == "ret":
+                address = self.memory[registers["sp"]]
+                registers["sp"] += 1 + (operands[0] if operands else 0)
+                if address == MercurySimulator.RETURN_ADDRESS:
+                    return
+                pc = address - MercurySimulator.CODE_BASE
+            else:
+                left, right = registers[operands[1]], self.__operand(operands[2])
+                registers[operands[0]] = self.__compute(mnemonic, left, right) & self.mask
+            if not 0 <= pc < len(self.code):
+                raise Exception(f"Jump outside of the code, to {pc + MercurySimulator.CODE_BASE}")
+
+    def __compute(self, mnemonic, left, right):
+        bits = MercurySimulator.WORD_BITS
+        if mnemonic in ["divs", "mods"]:
+            left, right = self.__signed(left), self.__signed(right)
+            quotient = abs(left) // abs(right)
+            if (left < 0) != (right < 0):
+                quotient = -quotient
+            return quotient if mnemonic == "divs" else left - quotient * right
+        elif mnemonic == "shl":
+            return left << right if right < bits else 0
+        elif mnemonic == "sar":
+            return self.__signed(left) >> min(right, bits)
+        return MercurySimulator.OPERATIONS[mnemonic](left, right)
+
+    def __signed(self, value):
+        return value - (1 << MercurySimulator.WORD_BITS) if value >> (MercurySimulator.WORD_BITS - 1) else value
+
+    def __push(self, value):
+        self.registers["sp"] -= 1
+        self.memory[self.registers["sp"]] = value
+
+    # Returns the value of a decoded operand
+    def __operand(self, operand):
+        return self.registers[operand] if isinstance(operand, str) else operand
+
+    # Decodes a register, a memory operand, an integer or a symbol with an optional offset
+    def __decode(self, operand):
+        if operand in MercurySimulator.REGISTERS:
+            return operand
+        match = re.fullmatch(r"\[(\w+)(?: ([+-]) (\d+))?\]", operand)
+        if match is not None:
+            offset = int(match.group(3) or 0)
+            return (match.group(1), offset if match.group(2) != "-" else -offset)
+        return self.__value(operand)
+
+    def __value(self, operand):
+        match = re.fullmatch(r"(-?\d+)|([^+-]+)([+-]\d+)?", operand)
+        if match.group(1) is not None:
+            return int(match.group(1)) & self.mask
+        if match.group(2) not in self.labels:
+            raise Exception(f"Unknown symbol '{match.group(2)}'")
+        return (self.labels[match.group(2)] + int(match.group(3) or 0)) & self.mask
+
+# Checks that the Mercury code of a program returns what the interpreter does for calls, given as
+# (function, args) pairs, and returns the simulator
+def assert_compiled(text, calls):
+    expected = interpret(parse(text), calls)
+    simulator = MercurySimulator(parse(text))
+    assert [simulator.call(name, *args) for name, args in calls] == expected
+    return simulator
@@ -0,0 +1,31 @@
+import copy
+import json
+
+import sirbench
+from support import parse
+
+def test_corpora_are_deterministic_and_parse():
+    for name in sirbench.CORPORA:
+        text = sirbench.corpus(name, seed=3, scale=0.02).generate()
+        assert text == sirbench.corpus(name, seed=3, scale=0.02).generate()
+        assert sirbench.count_nodes(parse(text)) > 0
+    assert sirbench.corpus("mixed", seed=3, scale=0.02).generate() != sirbench.corpus("mixed", seed=4, scale=0.02).generate()
+
+def test_suite_report():
+    suite = json.loads(json.dumps(sirbench.run_suite(["functions", "strings"], seed=1, repeat=1, scale=0.02, label="test")))
+    assert (suite["label"], suite["seed"], suite["repeat"]) == ("test", 1, 1)
+    assert [result["name"] for result in suite["results"]] == ["functions", "strings"]
+    for result in suite["results"]:
+        assert result["tokens"] > 0 and result["nodes"] > 0
+        assert set(result["lex"]) == {"best_s", "mean_s", "tokens_per_s", "bytes_per_s", "peak_bytes"}
+        assert set(result["parse"]) == {"best_s", "mean_s", "nodes_per_s", "tokens_per_s", "peak_bytes"}
+    assert len(sirbench.report(suite).splitlines()) == 3
+
+def test_compare():
+    suite = sirbench.run_suite(["functions"], repeat=1, scale=0.02)
+    slower = copy.deepcopy(suite)
+    slower["results"][0]["parse"]["best_s"] *= 2
+    assert sirbench.compare(suite, suite) == []
+    lines = sirbench.compare(suite, slower)
+    assert len(lines) == 1 and lines[0].startswith("functions.parse: 2.00x slower")
+    assert sirbench.compare(slower, suite) == []
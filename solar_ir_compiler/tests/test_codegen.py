@@ -0,0 +1,212 @@
+import random
+
+from sirparser import *
+from support import parse, source, interpret, assert_compiled, MercurySimulator
+
+TYPES = ["word1", "word2", "word4", "word8"]
+OPERATORS = ["+", "-", "*", "&", "|", "^", "~&", "~|", "~^", "/", "%", "/$", "%$", "<<", ">>", ">>$"]
+RELATIONS = ["==", "!=", "<", ">", "<=", ">=", "<$", ">$", "<=$", ">=$"]
+
+# Values around the edges of every width, as two's complement and as unsigned numbers
+def edge_values(type):
+    bits = 16 * {"word1": 1, "word2": 2, "word4": 4, "word8": 8}[type]
+    mask = (1 << bits) - 1
+    return [0, 1, 2, 7, 0xFFFF, 0x10000, (1 << (bits - 1)) - 1, 1 << (bits - 1), mask - 6, mask]
+
+def test_literal_arithmetic_on_word1_registers():
+    text = """
+    (word1) less(word1 a, word1 b) {
+        if (a + 1 < b) {
+            return 1;
+        }
+        return 0;
+    }
+    (word1) third(word1 a) { return (a - 1) / 3; }
+    (word1) signed(word1 a, word1 b) {
+        if (a - 1 <$ b) {
+            return (a - 1) >> 4;
+        }
+        return a * 3 + 1;
+    }
+    """
+    values = [0, 1, 2, 0x7FFF, 0x8000, 0xFFFE, 0xFFFF]
+    calls = [(name, [a, b]) for name in ["less", "signed"] for a in values for b in values]
+    assert_compiled(text, calls + [("third", [a]) for a in values])
+
+def test_wide_operators():
+    functions = []
+    calls = []
+    for type in TYPES:
+        for op in OPERATORS:
+            name = f"f{len(functions)}"
+            right = {"<<": "(b & 127)", ">>": "(b & 127)", ">>$": "(b & 127)", "/": "(b | 4)", "%": "(b | 4)", "/$": "(b | 4)", "%$": "(b | 4)"}.get(op, "b")
+            functions.append(f"({type}) {name}({type} a, {type} b) {{ return a {op} {right}; }}")
+            values = edge_values(type)
+            calls += [(name, [a, b]) for a in values[::2] for b in values[1::2]]
+    assert_compiled("\n".join(functions), calls)
+
+def test_wide_comparisons():
+    functions = []
+    calls = []
+    for left, right in [("word1", "word8"), ("word2", "word2"), ("word4", "word2"), ("word8", "word8")]:
+        for rel in RELATIONS:
+            name = f"f{len(functions)}"
+            functions.append(f"(word1) {name}({left} a, {right} b) {{ if (a {rel} b) {{ return 1; }} return 0; }}")
+            calls += [(name, [a, b]) for a in edge_values(left) for b in edge_values(right)[::3]]
+    assert_compiled("\n".join(functions), calls)
+
+def test_wide_casts_and_memory():
+    text = """
+    data { align4; buf: word1[16]{0}; }
+    (word8) f(word2 a, word4 b) {
+        word8 x;
+        word4[buf] = b;
+        word2[buf + 4] = a;
+        x = word8$(word2[buf + 4]) + word4$(word1(b)) - word8(word4[buf]);
+        word8[buf + 8] = x << 9;
+        return word8[buf + 8] ^ word2$(x);
+    }
+    """
+    calls = [("f", [a, b]) for a in edge_values("word2") for b in edge_values("word4")[::2]]
+    assert_compiled(text, calls)
+
+def test_wide_calls_under_every_convention():
+    text = """
+    (word8) own(word8 x, word2 y) { return x * 3 - y; }
+    foreign C (word4) c(word2 x, word4 y) { return x - y; }
+    foreign MS (word2) ms(word1 x, word2 y) { return x * y; }
+    foreign C (word1) f(word4 a, word1 b) {
+        word8 x;
+        word4 y;
+        word2 z;
+        (word8) x = own(a + 1, b);
+        foreign C (word4) y = c(a, x);
+        foreign MS (word2) z = ms(b, y + 1);
+        return x + y + z;
+    }
+    """
+    calls = [("f", [a, b]) for a in edge_values("word4")[::2] for b in edge_values("word1")[::3]]
+    assert_compiled(text, calls)
+
+def test_wide_tail_calls():
+    text = """
+    (word4) sum(word4 n, word8 acc) {
+        if (n == 0) {
+            return acc;
+        }
+        jump sum(n - 1, acc + n * 65537);
+    }
+    foreign MS (word2) count(word2 n, word2 acc) {
+        if (n == 0) {
+            return acc;
+        }
+        foreign MS jump count(n - 1, acc + 3);
+    }
+    (word4) twice(word4 n) { jump sum(n, n); }
+    """
+    calls = [("sum", [n, 70000]) for n in [0, 1, 5, 40]] + [("count", [n, 0]) for n in [0, 7, 300]]
+    simulator = assert_compiled(text, calls + [("twice", [n]) for n in [0, 3, 40]])
+    # A function only leaving through a jump has no epilogue
+    assert "ret" not in simulator.asm.split("twice:")[1]
+
+def test_switch_on_wide_value():
+    program = """
+    (word1) f(word4 x) {
+        word4 y;
+        y = x;
+        switch;
+        return 0;
+    }
+    """
+    # Switches are built by passes, so this one is attached to the parsed function directly
+    def build():
+        tree = parse(program.replace("switch;", ""))
+        funct = tree.function_decls[0]
+        switch = SwitchStatement(ConstExpression(ConstantNode(ConstantNode.T_NAME, "y")))
+        for value in range(65534, 65540):
+            ret = ReturnStatement()
+            ret.expr = ConstExpression(ConstantNode(ConstantNode.T_SCONST, value - 65530))
+            switch.cases.append((value, [ret]))
+        funct.stmts.insert(2, switch)
+        return tree
+
+    values = [0, 1, 65533, 65534, 65535, 65536, 65539, 65540, 1 << 20, 0xFFFFFFFF]
+    simulator = MercurySimulator(build())
+    assert [simulator.call("f", x) for x in values] == interpret(build(), [("f", [x]) for x in values])
+
+def test_testfile():
+    assert_compiled(source("testfile.sir"), [("fib", [n]) for n in [1, 2, 10, 24]])
+
+# Random programs over registers of every width, their memory and calls
+def random_program(seed):
+    rand = random.Random(seed)
+    regs = {f"v{i}": rand.choice(TYPES) for i in range(5)}
+    params = {"a": rand.choice(TYPES), "b": rand.choice(TYPES)}
+    names = list(regs) + list(params)
+
+    def atom():
+        choice = rand.random()
+        if choice < 0.6:
+            return rand.choice(names)
+        elif choice < 0.8:
+            return str(rand.choice([0, 1, 3, 15, 16, 255, 0xFFFF, 0x10000, rand.getrandbits(40)]))
+        return f"{rand.choice(TYPES)}[buf + ({rand.choice(names)} & 7)]"
+
+    def expr(depth=0):
+        if depth > 2 or rand.random() < 0.3:
+            return atom()
+        if rand.random() < 0.15:
+            return f"{rand.choice(TYPES)}{rand.choice(['', '$'])}({expr(depth + 1)})"
+        op = rand.choice(OPERATORS)
+        left, right = expr(depth + 1), expr(depth + 1)
+        if op in ["/", "%", "/$", "%$"]:
+            right = f"({right} | 1)"
+        elif op in ["<<", ">>", ">>$"] and rand.random() < 0.7:
+            right = f"({right} & 63)"
+        return f"({left} {op} {right})"
+
+    def block(count, depth):
+        lines = []
+        for _ in range(count):
+            choice = rand.random()
+            if choice < 0.5:
+                lines.append(f"{rand.choice(list(regs))} = {expr()};")
+            elif choice < 0.65:
+                lines.append(f"{rand.choice(TYPES)}[buf + ({expr()} & 7)] = {expr()};")
+            elif choice < 0.85 and depth < 2:
+                lines.append(f"if ({expr()} {rand.choice(RELATIONS)} {expr()}) {{")
+                lines += block(rand.randint(1, 3), depth + 1)
+                lines.append("} else {")
+                lines += block(rand.randint(0, 2), depth + 1)
+                lines.append("}")
+            else:
+                name = rand.choice(list(regs))
+                lines.append(f"foreign C ({regs[name]}) {name} = g{TYPES.index(regs[name])}({expr()}, {expr()});")
+        return lines
+
+    helpers = "\n".join(f"foreign C ({type}) g{i}({type} x, word4 y) {{ return x * 3 - y; }}" for i, type in enumerate(TYPES))
+    decls = " ".join(f"{type} {name}; {name} = {rand.getrandbits(20)};" for name, type in regs.items())
+    body = "\n".join(block(rand.randint(4, 8), 0))
+    args = ", ".join(f"{type} {name}" for name, type in params.items())
+    text = f"""
+    data {{ align8; buf: word1[32]{{0}}; }}
+    {helpers}
+    ({rand.choice(TYPES)}) f({args}) {{
+        {decls}
+        {body}
+        return {' + '.join(names)};
+    }}
+    """
+    return text, [rand.getrandbits(64) for _ in params]
+
+def test_random_programs():
+    compiled = 0
+    for seed in range(30):
+        text, args = random_program(seed)
+        try:
+            assert_compiled(text, [("f", args)])
+            compiled += 1
+        except Exception as e:
+            if "Division by zero" not in str(e):
+                raise
+    assert compiled > 20
@@ -0,0 +1,115 @@
+from sirinline import CallGraph, Inliner
+from siropt import walk_stmts
+from sirparser import *
+from support import parse, interpret, assert_preserved, MercurySimulator
+
+# 'main' has a register named as one of 'lookup', which inlining must keep apart
+PROGRAM = """
+export main;
+data { table: word1[4]{10, 20, 30, 40}; }
+(word1) clamp(word1 x, word1 top) {
+    if (x > top) {
+        return top;
+    }
+    return x;
+}
+(word2) widen(word1 x) { return x * 3; }
+(word1) count()
+data { n: word1{0}; }
+{
+    word1[n] = word1[n] + 1;
+    return word1[n];
+}
+(word1) lookup(word1 i) {
+    word1 j;
+    j = i & 3;
+    loop:
+    if (j > 3) {
+        j = j - 4;
+        goto loop;
+    }
+    return word1[table + j];
+}
+(word1) forward(word1 x) { jump clamp(x, 100); }
+(word1) fact(word1 n) {
+    word1 r;
+    if (n <= 1) {
+        return 1;
+    }
+    (word1) r = fact(n - 1);
+    return n * r;
+}
+(word1) main(word1 a, word1 b) {
+    word1 x, y, z, j;
+    word2 w;
+    j = 9;
+    (word1) x = clamp(a, b);
+    (word1) y = clamp(a + 1, x);
+    (word2) w = widen(b);
+    (word1) z = count();
+    (word1) z = count();
+    (word1) x = lookup(x + z);
+    (word1) y = forward(y + j);
+    (word1) z = fact(a & 7);
+    return x + y + z + w;
+}
+"""
+CALLS = [("main", [a, b]) for a in [0, 5, 200, 0xFFFF] for b in [0, 3, 150]] + [("count", [])]
+
+def inline(program):
+    return Inliner(program).run()
+
+def test_inlining_keeps_results():
+    assert assert_preserved(PROGRAM, CALLS, inline) == 7
+
+def test_inlining_keeps_results_once_compiled():
+    program = parse(PROGRAM)
+    inline(program)
+    simulator = MercurySimulator(program)
+    assert [simulator.call(name, *args) for name, args in CALLS] == interpret(parse(PROGRAM), CALLS)
+
+def test_inlined_static_data_is_shared():
+    program = parse(PROGRAM)
+    inline(program)
+    count = next(funct for funct in program.function_decls if funct.name == "count")
+    assert count.staticdata is None
+    assert any(datum.name == "count.n" for directive in program.data_directives for datum in directive.data if isinstance(datum, LabelNode))
+
+def test_inliner_decisions():
+    inliner = Inliner(parse(PROGRAM))
+    inliner.run()
+    reasons = {(decision.caller, decision.callee): decision.reason for decision in inliner.decisions if not decision.inlined}
+    assert reasons == {("main", "fact"): "recursive", ("fact", "fact"): "recursive"}
+    assert inliner.report().endswith(f"7 of 9 calls inlined, {inliner.budget} of budget left")
+
+    assert Inliner(parse(PROGRAM), max_size=5).run() == 2 # widen and forward
+    assert Inliner(parse(PROGRAM), budget=0).run() == 0
+
+def test_inliner_keeps_exported_functions_and_captured_names():
+    text = """
+    export f;
+    data { g: word1{4}; }
+    (word1) f(word1 x) { return x + word1[g]; }
+    (word1) h(word1 x) { return x + word1[g]; }
+    (word1) main(word1 g) {
+        word1 a;
+        (word1) a = f(g);
+        (word1) a = h(a);
+        return a;
+    }
+    """
+    inliner = Inliner(parse(text))
+    assert inliner.run() == 0
+    assert [decision.reason for decision in inliner.decisions] == ["exported", "captures 'g'"]
+
+def test_call_graph():
+    graph = CallGraph(parse(PROGRAM + "(word1) alpha(word1 n) { word1 r; (word1) r = beta(n); return r; }"
+                                      "(word1) beta(word1 n) { word1 r; (word1) r = alpha(n); return r; }"
+                                      "(word1) take() { return clamp; }"))
+    assert graph.callees("main") == {"clamp", "widen", "count", "lookup", "forward", "fact"}
+    assert graph.callers["clamp"] == {"main", "forward"}
+    assert {name for name in graph.functions if graph.is_recursive(name)} == {"fact", "alpha", "beta"}
+    assert graph.address_taken == {"clamp"}
+    order = [name for scc in graph.sccs() for name in scc]
+    assert order.index("clamp") < order.index("forward") < order.index("main")
+    assert sorted(next(scc for scc in graph.sccs() if "alpha" in scc)) == ["alpha", "beta"]
@@ -0,0 +1,73 @@
+import json
+
+import sirinstr
+from sirlex import Lexer
+from sirparser import ASTParser
+from siropt import StrengthReduction
+from support import parse
+
+TEXT = "(word1) f(word1 x) { return x * word1(8) + x / word1(4); }"
+
+def test_phases_and_counters_are_reported():
+    instr = sirinstr.Instrumentation()
+    tokens = Lexer(TEXT, filename="a.sir", instr=instr).lex()
+    ASTParser(tokens, filename="a.sir", instr=instr).program()
+    with instr.phase("lex", "b.sir"):
+        pass
+    instr.count("custom", "x", 2)
+    instr.count("custom", "x")
+    instr.count_all("custom", {"y": 5})
+
+    assert [(span.phase, span.file) for span in instr.spans] == [("lex", "a.sir"), ("parse", "a.sir"), ("lex", "b.sir")]
+    assert instr.counters["tokens by type"]["NAME"] == 4
+    assert instr.counters["nodes by class"]["FunctionDeclNode"] == 1
+    assert instr.counters["custom"] == {"x": 3, "y": 5}
+
+    lines = instr.report().splitlines()
+    assert lines[0].split() == ["phase", "runs", "wall", "ms", "cpu", "ms"]
+    assert lines[1].split()[:2] == ["lex", "2"]
+    assert sorted(line.split()[0] for line in lines[2:4]) == ["a.sir", "b.sir"]
+    assert lines[4].split()[:2] == ["parse", "1"]
+    custom = lines.index("custom:")
+    assert [line.split() for line in lines[custom + 1:custom + 3]] == [["y", "5"], ["x", "3"]]
+
+def test_trace_events():
+    instr = sirinstr.Instrumentation()
+    with instr.phase("parse", "a.sir"):
+        pass
+    with instr.phase("codegen"):
+        pass
+    instr.count("codegen", "spills", 3)
+    trace = json.loads(json.dumps(instr.trace()))
+
+    assert trace["displayTimeUnit"] == "ms"
+    phases = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert [(event["name"], event["cat"]) for event in phases] == [("parse", "phase"), ("codegen", "phase")]
+    assert all({"ts", "dur", "pid", "tid"} <= set(event) and event["dur"] >= 0 for event in phases)
+    assert phases[0]["args"]["file"] == "a.sir" and "file" not in phases[1]["args"]
+    assert phases[0]["ts"] <= phases[1]["ts"]
+    counters = [event for event in trace["traceEvents"] if event["ph"] == "C"]
+    assert [(event["name"], event["args"]) for event in counters] == [("codegen", {"spills": 3})]
+
+def test_timed_passes_count_their_results():
+    programs = [parse(TEXT), parse(TEXT)]
+    instr = sirinstr.enable()
+    try:
+        assert StrengthReduction(programs[0]).run() == 2
+        StrengthReduction(programs[1]).run()
+    finally:
+        sirinstr.disable()
+    assert [span.phase for span in instr.spans] == ["strength-reduction"] * 2
+    assert instr.counters["results"] == {"strength-reduction": 4}
+    assert sirinstr.active() is sirinstr.DISABLED
+
+def test_disabled_instrumentation_records_nothing():
+    disabled = sirinstr.DISABLED
+    assert sirinstr.active() is disabled and not disabled.enabled
+    with disabled.phase("lex") as span:
+        assert span is None
+    disabled.count("group", "key")
+    disabled.count_all("group", {"key": 1})
+    Lexer(TEXT).lex()
+    StrengthReduction(parse(TEXT)).run()
+    assert disabled.spans == [] and disabled.counters == {}
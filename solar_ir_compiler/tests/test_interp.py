@@ -0,0 +1,85 @@
+import pytest
+
+from sirinterp import Interpreter
+from support import parse, source, interpret
+
+def run(text, name, *args, hooks={}):
+    return Interpreter(parse(text), hooks=hooks).call(name, *args)
+
+def test_arithmetic_takes_the_wider_operand_and_truncates_on_return():
+    assert run("(word1) f(word1 x) { return x + 1; }", "f", 0xFFFF) == 0
+    assert run("(word2) f(word1 x) { return x + 1; }", "f", 0xFFFF) == 0x10000
+    assert run("(word2) f(word1 x, word2 y) { return x * y; }", "f", 0xFFFF, 3) == 0x2FFFD
+    assert run("(word1) f(word1 x) { word1 y; y = x - 2; return y; }", "f", 1) == 0xFFFF
+
+def test_signed_operators():
+    assert run("(word1) f(word1 x, word1 y) { return x /$ y; }", "f", 0xFFF9, 2) == 0xFFFD # -7 / 2 rounds towards zero
+    assert run("(word1) f(word1 x, word1 y) { return x %$ y; }", "f", 0xFFF9, 2) == 0xFFFF
+    assert run("(word1) f(word1 x) { return x >>$ word1(4); }", "f", 0x8000) == 0xF800
+    assert run("(word1) f(word1 x) { return x >>$ 4; }", "f", 0x8000) == 0x0800 # Literals are word8
+    assert run("(word1) f(word1 x) { return x >> 4; }", "f", 0x8000) == 0x0800
+    assert run("(word2) f(word1 x) { return word2$(x); }", "f", 0x8000) == 0xFFFF8000
+    assert run("(word1) f(word1 x) { if (x <$ word1(0)) { return 1; } return 0; }", "f", 0x8000) == 1
+    assert run("(word1) f(word1 x) { if (x < 0) { return 1; } return 0; }", "f", 0x8000) == 0
+
+def test_shifts_by_the_width_or_more_leave_zero():
+    assert run("(word1) f(word1 x, word1 y) { return x << y; }", "f", 1, 16) == 0
+    assert run("(word2) f(word1 x, word1 y) { return x << y; }", "f", 1, 40) == 0
+
+def test_arguments_are_truncated_to_their_types():
+    assert run("(word2) f(word1 x) { return x; }", "f", 0x12345) == 0x2345
+
+def test_memory_is_little_endian():
+    text = """
+    data { buf: word1[4]{0}; }
+    (word1) f(word2 x) { word2[buf] = x; return word1[buf + 1]; }
+    """
+    interp = Interpreter(parse(text))
+    assert interp.call("f", 0x12345678) == 0x1234
+    assert interp.read("word1", interp.address("buf")) == 0x5678
+    assert interp.read("word2", interp.address("buf")) == 0x12345678
+
+def test_calls_share_memory():
+    text = """
+    data { counter: word1{0}; }
+    (word1) next() { word1[counter] = word1[counter] + 1; return word1[counter]; }
+    """
+    assert interpret(parse(text), [("next", [])] * 3) == [1, 2, 3]
+
+def test_static_data_belongs_to_its_function():
+    text = """
+    (word1) f()
+    data { x: word1{5}; }
+    { word1[x] = word1[x] + 1; return word1[x]; }
+    (word1) g()
+    data { x: word1{50}; }
+    { return word1[x]; }
+    """
+    assert interpret(parse(text), [("f", []), ("f", []), ("g", [])]) == [6, 7, 50]
+
+def test_deep_jumps_run_in_constant_stack():
+    text = """
+    (word2) count(word2 n, word2 acc) {
+        if (n == 0) {
+            return acc;
+        }
+        jump count(n - 1, acc + 2);
+    }
+    """
+    assert run(text, "count", 100000, 0) == 200000
+
+def test_imports_call_hooks():
+    printed = []
+    def printf(interp, fmt, value):
+        printed.append(interp.read_string(fmt).replace("%i", str(value)))
+        return 0
+    Interpreter(parse(source("testfile.sir")), hooks={"printf": printf}).call("main")
+    assert printed == [f"Fibonacci n25: {121393 & 0xFFFF}"]
+
+def test_errors():
+    with pytest.raises(Exception, match="Division by zero"):
+        run("(word1) f(word1 x) { return 1 / x; }", "f", 0)
+    with pytest.raises(Exception, match="was called without a hook"):
+        run("import g; (word1) f() { word1 x; (word1) x = g(); return x; }", "f")
+    with pytest.raises(Exception, match="expects 1 arguments, got 2"):
+        run("(word1) f(word1 x) { return x; }", "f", 1, 2)
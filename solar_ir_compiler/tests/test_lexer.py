@@ -0,0 +1,19 @@
+from sirlex import Lexer, Token
+
+def tokens(text):
+    return [(token.type, token.value) for token in Lexer(text).lex()]
+
+def test_comments_leave_no_token():
+    assert tokens("x /* a * b / c */ y") == [(Token.T_NAME, "x"), (Token.T_NAME, "y"), (Token.T_EOF, None)]
+    assert tokens("/**/") == [(Token.T_EOF, None)]
+
+def test_lines_are_counted_within_comments():
+    token = Lexer("/* one\ntwo\n */ x").lex()[0]
+    assert (token.linenum, token.linepos) == (3, 5)
+
+def test_bitwise_or_operators():
+    assert tokens("a | b ~| c") == [(Token.T_NAME, "a"), (Token.T_OP, "|"), (Token.T_NAME, "b"), (Token.T_OP, "~|"), (Token.T_NAME, "c"), (Token.T_EOF, None)]
+
+def test_integer_prefixes():
+    assert tokens("0x1F 0b101 0o17 0 10") == [(Token.T_INT, value) for value in [31, 5, 15, 0, 10]] + [(Token.T_EOF, None)]
+    assert tokens("0") == [(Token.T_INT, 0), (Token.T_EOF, None)]
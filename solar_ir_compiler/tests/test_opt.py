@@ -0,0 +1,178 @@
+import io
+
+from siropt import *
+from sircodegen import MercuryCodeGen
+from support import parse, source, interpret, assert_preserved, MercurySimulator
+
+SIGNED_INPUTS = [0, 1, 2, 5, 7, 100, 0x7FFF, 0x8000, 0x8001, 0xFFF9, 0xFFFF]
+
+def strength_reduction(program):
+    return StrengthReduction(program).run()
+
+def cse(program):
+    return CommonSubexpressionElimination(program).run()
+
+def local_cse(program):
+    return CommonSubexpressionElimination(program, scope=CommonSubexpressionElimination.S_LOCAL).run()
+
+def declared_types(funct):
+    return {name: stmt.type for stmt in walk_stmts(funct.stmts) if isinstance(stmt, DeclStatement) for name in stmt.names}
+
+def test_strength_reduction_keeps_results():
+    functions = []
+    calls = []
+    for type in ["word1", "word2"]:
+        for op in ["*", "/", "%", "/$", "%$"]:
+            for c in [1, 2, 3, 4, 7, 8, 10, 255, -1, -4, -16]:
+                for i, operand in enumerate(["x", "(x + 3)"]):
+                    name = f"f{len(functions)}"
+                    functions.append(f"({type}) {name}({type} x) {{ return {operand} {op} {type}({c}); }}")
+                    calls += [(name, [value]) for value in SIGNED_INPUTS]
+    reductions = assert_preserved("\n".join(functions), calls, strength_reduction)
+    assert reductions > 0
+
+def test_strength_reduction_of_signed_division_needs_a_leaf_dividend():
+    program = parse("(word1) f(word1 x) { return (x + 1) /$ word1(4); }")
+    assert strength_reduction(program) == 0
+    program = parse("(word1) f(word1 x) { return (x + 1) %$ word1(4); }")
+    assert strength_reduction(program) == 0
+    program = parse("(word1) f(word1 x) { return x /$ word1(4); }")
+    assert strength_reduction(program) == 1
+
+def test_cse_keeps_results():
+    text = """
+    data { buf: word1[4]{3, 4, 5, 6}; }
+    (word1) id(word1 x) { return x; }
+    (word1) f(word1 a, word1 b) {
+        word1 x, y, z;
+        x = a * b + 1;
+        if (a > b) {
+            y = a * b + 1;
+            a = a + 1;
+            z = a * b + 1;
+        } else {
+            y = word1[buf + (b & 3)] + a;
+            word1[buf + 1] = y;
+            z = word1[buf + (b & 3)] + a;
+        }
+        (word1) x = id(a * b + 1);
+        return x + y + z + (a * b + 1);
+    }
+    """
+    calls = [("f", [a, b]) for a in [0, 1, 3, 200] for b in [0, 1, 2, 7]]
+    assert assert_preserved(text, calls, cse) > 0
+    assert assert_preserved(text, calls, local_cse) > 0
+
+def test_cse_temporary_has_the_width_its_uses_keep():
+    program = parse("(word1) f(word1 a) { word1 x, y; x = a + 1; y = a + 1; return x ^ y; }")
+    assert cse(program) == 1
+    assert declared_types(program.function_decls[0])[".cse0"] == "word1"
+
+    # The temporary is emitted by the Mercury backend
+    MercuryCodeGen(program).emit(io.StringIO())
+
+def test_cse_temporary_keeps_compared_words():
+    text = """
+    (word1) f(word1 a) {
+        word1 x;
+        x = a + 1;
+        if (a + 1 > 65535) {
+            return x + 7;
+        }
+        return x;
+    }
+    """
+    program = parse(text)
+    assert cse(program) == 1
+    assert declared_types(program.function_decls[0])[".cse0"] == "word8"
+    assert_preserved(text, [("f", [value]) for value in [0, 1, 0xFFFE, 0xFFFF]], cse)
+
+def test_passes_keep_results_of_testfile():
+    def both(program):
+        return strength_reduction(program) + cse(program)
+    assert_preserved(source("testfile.sir"), [("fib", [n]) for n in [1, 2, 10, 20]], both)
+
+def test_const_value_leaves_huge_shifts_unfolded():
+    program = parse("(word8) f(word1 x) { return (1 << 118181610712) + x; }")
+    assert const_value(program.function_decls[0].stmts[0].expr.left) is None
+    assert const_value(parse("(word8) f() { return 3 << 4; }").function_decls[0].stmts[0].expr) == 48
+
+def tail_calls(program):
+    return TailCallElimination(program).run()
+
+TAIL_CALLS = """
+(word2) gcd(word2 a, word2 b) {
+    word2 r;
+    if (b == 0) {
+        return a;
+    }
+    (word2) r = gcd(b, a % b);
+    return r;
+}
+(word1) even(word1 n) {
+    word1 r;
+    if (n == 0) {
+        return 1;
+    }
+    (word1) r = odd(n - 1);
+    return r;
+}
+(word1) odd(word1 n) {
+    word1 r;
+    if (n == 0) {
+        return 0;
+    }
+    (word1) r = even(n - 1);
+    return r;
+}
+foreign C (word1) sum(word1 n, word1 acc) {
+    word1 r;
+    if (n == 0) {
+        return acc;
+    }
+    foreign C (word1) r = sum(n - 1, acc + n);
+    return r;
+}
+(word1) narrow(word1 n) {
+    word1 r;
+    if (n == 0) {
+        return 7;
+    }
+    foreign C (word1) r = sum(n, 0);
+    return r;
+}
+foreign C (word1) halve(word2 n) {
+    return n >> 1;
+}
+foreign C (word1) twice(word1 n) {
+    word1 r;
+    foreign C (word1) r = halve(n * 4);
+    return r;
+}
+"""
+TAIL_CALL_INPUTS = [("gcd", [a, b]) for a in [0, 12, 0x12345, 0xFFFFFFFF] for b in [0, 18, 0x10000]] + \
+    [(name, [n]) for name in ["even", "odd", "narrow"] for n in [0, 1, 6, 101]] + [("sum", [n, 3]) for n in [0, 10, 150]] + \
+    [("twice", [n]) for n in [0, 5, 0xFFFF]]
+
+def test_tail_calls_keep_results():
+    assert assert_preserved(TAIL_CALLS, TAIL_CALL_INPUTS, tail_calls) == 4 # Calls turned into jumps, then loops, count once
+
+def test_tail_calls_keep_results_once_compiled():
+    program = parse(TAIL_CALLS)
+    tail_calls(program)
+    simulator = MercurySimulator(program)
+    assert [simulator.call(name, *args) for name, args in TAIL_CALL_INPUTS] == interpret(parse(TAIL_CALLS), TAIL_CALL_INPUTS)
+
+def test_self_jumps_assign_arguments_at_once():
+    text = "(word1) f(word1 a, word1 b, word1 n) { if (n == 0) { return a * 10 + b; } jump f(b, a + b, n - 1); }"
+    program = parse(text)
+    assert tail_calls(program) == 1
+    assert not any(isinstance(stmt, JumpStatement) for stmt in walk_stmts(program.function_decls[0].stmts))
+    assert_preserved(text, [("f", [a, b, n]) for a in [0, 1, 5] for b in [1, 2] for n in [0, 1, 2, 9]], tail_calls)
+
+def test_tail_calls_keep_calls_of_other_conventions_and_types():
+    program = parse(TAIL_CALLS)
+    tail_calls(program)
+    for name in ["narrow", "twice"]: # Another convention, and a C call passing more argument words
+        funct = next(funct for funct in program.function_decls if funct.name == name)
+        assert any(isinstance(stmt, CallStatement) for stmt in walk_stmts(funct.stmts))
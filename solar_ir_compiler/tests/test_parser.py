@@ -0,0 +1,83 @@
+import pytest
+
+from sirlex import Lexer
+from sirparser import *
+
+# Source texts raising each diagnostic reachable from source
+DIAGNOSTICS = {
+    "L004": "(word1) f() { return 12ab; }",
+    "L005": 'data { s: word1[]"abc',
+    "L006": "(word1) f() { return 1 ~~ 2; }",
+    "L007": "(word1) f() { return 1; } /* open",
+    "L008": "(word1) f() { return 0q1; }",
+    "L009": "(word1) f() { return 'a; }",
+    "L010": "(word1) f() { return `; }",
+    "L011": "(word1) f() { return 0x; }",
+    "L012": "(word1) f() { return '",
+    "P002": "(word1) f() { return (1; }",
+    "P003": "pass;",
+    "P004": 'data { s: word2[]"abc"; }',
+    "P005": 'data { s: word1[4]"abc"; }',
+    "P006": "data { s: word1[]; }",
+    "P007": "data { s: ; }",
+    "P009": "(word1) f() { 3; }",
+    "P010": "(word1) f() { return",
+    "P011": "(word1) f() { return 1; const x = 1;",
+}
+RECOVERY_ONLY = ["P011"] # Without recovery, the construct is left at a later token
+
+# Returns the program and the diagnostics of a source text parsed in recovery mode
+def recover(text):
+    lexer = Lexer(text, recover=True)
+    parser = ASTParser(lexer.lex(), recover=True)
+    return parser.program(), lexer.diagnostics + parser.diagnostics
+
+@pytest.mark.parametrize("code", sorted(DIAGNOSTICS))
+def test_diagnostic_codes(code):
+    text = DIAGNOSTICS[code]
+    _, diagnostics = recover(text)
+    assert diagnostics[0].code == code
+
+    # Without recovery, the first problem raises with the same message
+    with pytest.raises(Exception) as error:
+        ASTParser(Lexer(text).lex()).program()
+    assert code in RECOVERY_ONLY or str(error.value).endswith(f"{diagnostics[0].linenum},{diagnostics[0].linepos}: {diagnostics[0].message}")
+
+def test_recovery_reports_every_problem_and_keeps_the_rest():
+    text = """
+    data { a: word1{1}; b: ; c: word1{3}; }
+    (word1) f(word1 x) {
+        x = x +;
+        if (x > 1) {
+            return 12ab;
+        } else {
+            return x;
+        }
+    }
+    (word1) g() { return 2; }
+    """
+    program, diagnostics = recover(text)
+    assert [diagnostic.code for diagnostic in diagnostics] == ["L004", "P007", "P009"]
+    assert [diagnostic.linenum for diagnostic in diagnostics] == [6, 2, 4]
+    assert [type(datum).__name__ for datum in program.data_directives[0].data] == ["LabelNode", "DatumNode", "LabelNode", "LabelNode", "DatumNode"]
+    assert [funct.name for funct in program.function_decls] == ["f", "g"]
+    assert len(program.function_decls[0].stmts) == 1 # The if, the assignment in error is dropped
+
+def test_unclosed_blocks_end_at_the_next_directive():
+    program, diagnostics = recover("(word1) f() { if (1) { return 1; \n data { a: word1{1}; }")
+    assert [diagnostic.code for diagnostic in diagnostics] == ["P011"]
+    assert len(program.data_directives) == 1
+
+# In recovery mode, 'data' within a block is taken for the next directive
+@pytest.mark.parametrize("text, code", [("else return 1;", "P003"), ("data return 1;", "P011"), ("foreign C 3; return 1;", "P009")])
+def test_statements_starting_with_an_unexpected_keyword_raise_without_recovery(text, code):
+    with pytest.raises(Exception, match=r"\[PARSER\].*\n1,\d+: Got unexpected"):
+        ASTParser(Lexer(f"(word1) f() {{ {text} }}").lex()).program()
+    program, diagnostics = recover(f"(word1) f() {{ {text} }}")
+    assert diagnostics[0].code == code
+    assert all(stmt is not None for funct in program.function_decls for stmt in funct.stmts)
+
+def test_diagnostic_text():
+    lexer = Lexer("\n  12ab", filename="x.sir", recover=True)
+    lexer.lex()
+    assert str(lexer.diagnostics[0]) == "x.sir:2,5: [L004] Integer '12' cannot be followed by alphabetic 'a'."
@@ -0,0 +1,110 @@
+from sirinterp import Interpreter
+from sirpool import DataPooling
+from sirparser import *
+from support import parse, interpret, assert_preserved
+
+def pool(program):
+    return DataPooling(program).run()
+
+def labels(program):
+    return [datum.name for directive in program.data_directives for datum in directive.data if isinstance(datum, LabelNode)]
+
+ALIGNED = """
+data { align2; a: word1{7}; b: word1[]"lo"; c: word2{74565}; d: word1[]"hello"; }
+(word1) f(word1 i) {
+    if (i == 0) { return word1[a]; }
+    if (i == 1) { return word1[b + 1]; }
+    if (i == 2) { return word2[c] >> 4; }
+    return word1[d + 3];
+}
+"""
+
+def test_pooling_keeps_the_offsets_of_the_data_left_in_place():
+    program = parse(ALIGNED)
+    before = Interpreter(parse(ALIGNED))
+    pool(program)
+    after = Interpreter(program)
+    assert after.address("c") - after.address("a") == before.address("c") - before.address("a") == 4
+    assert [after.call("f", i) for i in range(4)] == [before.call("f", i) for i in range(4)]
+
+def test_pooling_only_removes_trailing_entries():
+    text = """
+    data { a: word1[]"hello"; b: word1{1}; }
+    data { c: word1[]"hello"; d: word1[]"lo"; }
+    (word1) f() { return word1[a] + word1[b] + word1[c] + word1[d + 1]; }
+    """
+    program = parse(text)
+    assert pool(program) == 1 # 'd' is laid out within 'c', 'a' stays before 'b'
+    assert "a" in labels(program) and "b" in labels(program)
+    assert "c" not in labels(program) and "d" not in labels(program)
+    assert_preserved(text, [("f", [])], pool)
+
+def test_labels_read_past_their_data_keep_the_data_after_them():
+    text = """
+    data { a: word1[]"hi"; b: word1[]"lo"; c: word1{9}; }
+    data { x: word1[]"lo"; y: word1{9}; }
+    (word1) f(word1 i) { return word1[b + 3] + word1[a] + word1[x] + word1[y]; }
+    """
+    program = parse(text)
+    assert pool(program) == 0
+    assert labels(program) == ["a", "b", "c", "x", "y"]
+    assert pool(parse(text.replace("b + 3", "b + i"))) == 0
+    assert pool(parse(text.replace("b + 3", "b + 2"))) == 2 # 'c' with 'y', then 'b' with 'x'
+
+    # A read wider than the data of its label reaches the next one
+    text = """
+    data { a: word1{1}; b: word1{2}; }
+    data { c: word1{2}; }
+    (word2) f() { return word2[a] + word1[c]; }
+    """
+    assert assert_preserved(text, [("f", [])], pool) == 0
+    assert pool(parse(text.replace("word2[a]", "word1[a]"))) == 1
+
+def test_labels_named_by_consts_escape():
+    text = """
+    data { a: word1[]"lo"; }
+    data { b: word1[]"lo"; }
+    const p = a + 1;
+    (word1) f() { return word1[p] + word1[b]; }
+    """
+    assert pool(parse(text)) == 0
+    assert pool(parse(text.replace("const p = a + 1;", "const p = 1;").replace("word1[p]", "word1[a + p]"))) == 1
+
+def test_pooled_entries_keep_their_alignment():
+    text = """
+    data { x: word1{5}; y: word1{5}; align4; a: word2{1}; b: word2{3}; c: word4{43981}; }
+    data { x2: word1{5}; align4; d: word4{43981}; }
+    (word4) f() { return word4[c] + word4[d] + word2[a] + word2[b] + word1[x] + word1[x2]; }
+    """
+    program = parse(text)
+    assert pool(program) == 1
+    interp = Interpreter(program)
+    pooled = next(name for name in labels(program) if name.startswith(DataPooling.PREFIX))
+    assert interp.address(pooled) % 4 == 0
+    assert_preserved(text, [("f", [])], pool)
+
+def test_string_literals_share_storage():
+    text = """
+    data { greeting: word1[]"hello"; }
+    (word1) f(word1 i) { return word1[greeting + i] + word1["lo" + 1] + word1["hello"]; }
+    """
+    program = parse(text)
+    pooling = DataPooling(program)
+    assert pooling.run() == 1
+    assert pooling.saved > 0
+    assert_preserved(text, [("f", [i]) for i in range(5)], pool)
+
+def test_pooling_across_modules():
+    main = parse("""
+    data { a: word1[]"shared"; }
+    (word1) f() { return word1[a + 2]; }
+    """)
+    other = parse("""
+    import f;
+    data { b: word1[]"shared"; }
+    (word1) g() { return word1[b + 1]; }
+    """)
+    assert DataPooling(main, modules=[other]).run() == 1
+    assert other.imports[-1].startswith(DataPooling.PREFIX)
+    assert (other.imports[-1], False) in main.exports
+    assert interpret(main, [("f", [])]) == [ord("a")]
@@ -0,0 +1,75 @@
+from sirswitch import SwitchLowering
+from siropt import walk_stmts
+from sirparser import *
+from support import parse, interpret, assert_preserved, MercurySimulator
+
+# Returns an if chain comparing an expression against values, case i returning i + 1
+def chain(expr, values, default="return 0;"):
+    text = default
+    for i, value in reversed(list(enumerate(values))):
+        text = f"if ({expr} == {value}) {{ return {i + 1}; }} else {{ {text} }}"
+    return text
+
+PROGRAM = f"""
+data {{ buf: word1[2]{{3, 70000}}; }}
+(word1) dense(word1 x) {{ {chain("x", [3, 4, 5, 6, 8, 9, 4])} }}
+(word1) sparse(word2 x) {{ {chain("x", [1, 100, 1000, 65536, 7, 40000])} }}
+(word1) masked(word2 x) {{ {chain("(x & 7)", [0, 1, 2, 3, 4, 5, 6, 7, 9, 70000])} }}
+(word1) memory(word1 i) {{ {chain("word1[buf + (i & 1)]", [3, 4, 70000 & 0xFFFF, 9, 10])} }}
+(word1) wide(word4 x) {{ {chain("x", [0xFFFFFFFF, 0xFFFFFFFE, 0x100000000, 0, 1])} }}
+(word1) reversed(word1 x) {{ {chain("x", [5, 2, 1, 4, 3, 0], "x = x + 1; return x * 100;")} }}
+(word1) nested(word1 x, word1 y) {{
+    if (x == 0) {{ {chain("y", [1, 2, 3, 4])} }}
+    else {{ if (x == 1) {{ return 20; }} else {{ if (x == 2) {{ return 30; }} else {{ if (x == 3) {{ return 40; }} }} }} }}
+    return 50;
+}}
+"""
+CALLS = [("dense", [x]) for x in range(12)] + \
+    [("sparse", [x]) for x in [0, 1, 7, 100, 101, 1000, 40000, 65535, 65536, 0xFFFFFFFF]] + \
+    [("masked", [x]) for x in range(10)] + \
+    [("memory", [i]) for i in range(2)] + \
+    [("wide", [x]) for x in [0, 1, 2, 0xFFFFFFFE, 0xFFFFFFFF]] + \
+    [("reversed", [x]) for x in range(8)] + \
+    [("nested", [x, y]) for x in range(5) for y in range(6)]
+
+def lower(program):
+    return SwitchLowering(program).run()
+
+def lowered(program, name):
+    return [type(stmt).__name__ for stmt in walk_stmts(next(funct for funct in program.function_decls if funct.name == name).stmts)]
+
+def test_switch_lowering_keeps_results():
+    assert assert_preserved(PROGRAM, CALLS, lower) == 8
+
+def test_switch_lowering_keeps_results_once_compiled():
+    program = parse(PROGRAM)
+    lower(program)
+    simulator = MercurySimulator(program)
+    assert [simulator.call(name, *args) for name, args in CALLS] == interpret(parse(PROGRAM), CALLS)
+
+def test_dense_chains_become_tables_and_sparse_ones_trees():
+    program = parse(PROGRAM)
+    lowering = SwitchLowering(program)
+    lowering.run()
+    assert (lowering.tables, lowering.trees) == (5, 3)
+    assert "SwitchStatement" in lowered(program, "dense")
+    assert "SwitchStatement" not in lowered(program, "sparse") and "GotoStatement" in lowered(program, "sparse")
+
+    # Only the first of equal cases is kept, and values the expression cannot hold are dropped
+    switch = next(stmt for stmt in walk_stmts(program.function_decls[0].stmts) if isinstance(stmt, SwitchStatement))
+    assert [value for value, _ in switch.cases] == [3, 4, 5, 6, 8, 9]
+    switch = next(stmt for stmt in walk_stmts(program.function_decls[2].stmts) if isinstance(stmt, SwitchStatement))
+    assert [value for value, _ in switch.cases] == list(range(8))
+
+def test_short_chains_are_kept():
+    program = parse(f"(word1) f(word1 x) {{ {chain('x', [1, 2, 3])} }}")
+    assert lower(program) == 0
+    assert SwitchLowering(program, min_cases=3).run() == 1
+
+def test_sparse_trees_compute_the_value_once():
+    text = f"(word1) f(word2 x) {{ {chain('(x * 3)', [0, 3000, 300000, 30, 3])} }}"
+    program = parse(text)
+    assert lower(program) == 1
+    stmts = program.function_decls[0].stmts
+    assert sum(1 for stmt in walk_stmts(stmts) if isinstance(stmt, DefStatement)) == 1
+    assert_preserved(text, [("f", [x]) for x in [0, 1, 10, 100, 1000, 100000, 7]], lower)
@@ -0,0 +1,53 @@
+import pytest
+
+import sirinstr
+from sirparser import *
+from sirtypecheck import TypeChecker
+from support import parse, source
+
+# Function bodies raising each diagnostic of the checker
+DIAGNOSTICS = {
+    "T001": "(word1) f() { return nowhere; }",
+    "T002": "(word1) f() { x = 1; return 0; }",
+    "T003": "(word2) g() { return 1; } (word1) f() { word1 x; (word2) x = g(); return x; }",
+    "T004": "() g() { return; } (word1) f() { word1 x; () x = g(); return x; }",
+    "T005": "(word2) g() { return 1; } (word1) f() { word2 x; (word2) x = g(); jump g(); }",
+    "T006": "(word1) g(word1 a) { return a; } (word1) f() { word1 x; (word1) x = g(1, 2); return x; }",
+    "T007": "() f() { return 1; }",
+    "T008": "(word1) f(word2 y) { word1 x; x = y; return x; }",
+}
+
+def check(text):
+    checker = TypeChecker(parse(text))
+    checker.run()
+    return [diagnostic.code for diagnostic in checker.diagnostics]
+
+@pytest.mark.parametrize("code", sorted(DIAGNOSTICS))
+def test_diagnostic_codes(code):
+    assert check(DIAGNOSTICS[code]) == [code]
+
+def test_call_results_assigned_to_undeclared_registers():
+    assert check("(word1) g() { return 1; } (word1) f() { (word1) x = g(); return x; }") == ["T002"]
+
+def test_truncation_follows_the_narrowest_type_holding_a_value():
+    assert check("(word1) f(word1 x) { x = x + 1; x = x & word2(3); x = 65535; return x >> 3; }") == []
+    assert check("(word1) f(word1 x) { x = 65536; return x; }") == ["T008"]
+    assert check("(word1) f(word1 x, word2 y) { x = word1(y); word1[x] = y; return y; }") == ["T008", "T008"]
+    assert check("(word2) g(word1 a) { return a; } (word2) f(word2 y) { word2 x; (word2) x = g(y); return x; }") == ["T008"]
+
+def test_testfile_assigns_call_results_to_undeclared_registers():
+    checker = TypeChecker(parse(source("testfile.sir")))
+    checker.run()
+    assert [(diagnostic.code, diagnostic.message.split("'")[-2]) for diagnostic in checker.diagnostics] == [("T002", "a"), ("T002", "b"), ("T002", "n25")]
+
+def test_every_expression_is_annotated():
+    program = parse("(word2) f(word1 x, word2 y) { return word2(word1[x] + (y >> 1) - word2$(x)); }")
+    TypeChecker(program).run()
+    expr = program.function_decls[0].stmts[0].expr.expr
+    assert (expr.resolved_type, expr.left.left.resolved_type, expr.left.right.left.resolved_type) == ("word8", "word1", "word2")
+    assert all(node.resolved_type is not None for node in sirinstr.ast_nodes(expr) if not isinstance(node, ConstantNode))
+
+def test_expressions_have_no_dictionary():
+    expr = parse("(word1) f(word1 x) { return -x + 1; }").function_decls[0].stmts[0].expr
+    assert not hasattr(expr, "__dict__") and not hasattr(expr.left, "__dict__")
+    assert len(list(sirinstr.ast_nodes(expr))) == 6 # Four expressions and two constants